@@ -1,12 +1,34 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from datetime import datetime, date
+from datetime import datetime, date, time
 import plotly.graph_objects as go
 import plotly.express as px
 from pathlib import Path
 import io
 import json
+import uuid
+import hashlib
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
+from market_data import (
+    PriceIndex, PriceCache, LOOKUP_MODES, RESAMPLE_METHODS, INSTRUMENTS, MISSING_INSTRUMENT_ID, BASE_CURRENCY, usd_rates,
+    compact_price_frame, expand_price_frame, price_memory_report, apply_price_changes,
+    screen_price_quality, QUALITY_CHECKS
+)
+from risk_engine import (
+    simulate_pnl_distribution, stress_test_grid, trade_book_frame, exposure_ladder,
+    hedge_effectiveness, rolling_effectiveness_frame, ValuationCache, ChunkedSeriesJob, match_hedges_to_lots,
+    backtest_hedge_policies, policy_grid
+)
+from trade_book import OpenPositionIndex, lot_is_open, lot_ref, hedge_ref
+from trade_journal import TradeJournal, BitemporalIndex
+from trade_schema import PHYSICAL_TRADE_SCHEMA, HEDGE_TRADE_SCHEMA, apply_defaults, validate_trade_sheet
+from session_snapshot import dump_snapshot, load_snapshot, SnapshotError, FILE_EXTENSION as SNAPSHOT_EXTENSION
+from roll_calendar import parse_relative_label, relative_label, roll_calendar, month_label, to_days
+from business_calendar import CALENDARS, business_calendar, valuation_grid
+from chart_sampling import downsample_frame
 
 
 # Page configuration
@@ -37,6 +59,35 @@ PLATTS_PRODUCT_CATALOG = {
     ]
 }
 
+HEDGE_CONTRACTS = ["GASOIL Mo1", "GASOIL Mo2", "GASOIL Mo3"]
+
+# Settlement currencies offered on the trade forms; other currencies convert if the FX store has them
+TRADE_CURRENCIES = ["USD", "SGD", "EUR"]
+
+# Memory budget for the price histories shared by all sessions
+PRICE_CACHE_BUDGET_MB = 512
+# Valuation snapshots kept per session for quick valuation date switching
+VALUATION_CACHE_ENTRIES = 32
+# Rows shown by the market price editor (latest first when truncated)
+PRICE_EDITOR_MAX_ROWS = 2000
+PRICE_EDITOR_DEFAULT_DAYS = 30
+# Background valuation of the MTM history
+MTM_HISTORY_WORKERS = 4
+MTM_HISTORY_CHUNK_DATES = 25
+# Chunks one session's job may have queued on the shared pool; the rest wait their turn
+MTM_HISTORY_QUEUED_CHUNKS = 1
+# Price bar sizes offered for valuation (pandas offset aliases)
+PRICE_BAR_SIZES = {'D': '1 day', 'h': '1 hour', '15min': '15 minutes'}
+DEFAULT_PRICE_CUTOFF = time(16, 30)
+# Business-day calendar of the MTM history axis ('price_dates' values the dates that have prints)
+DEFAULT_VALUATION_CALENDAR = 'platts_singapore'
+# Points plotted per line chart; longer histories are downsampled (LTTB, extremes kept)
+CHART_POINT_BUDGET = 4000
+# Charts holding more points than this render with WebGL traces
+WEBGL_POINT_THRESHOLD = 1500
+# Traces up to this many points keep their markers
+CHART_MARKER_POINT_LIMIT = 200
+
 
 # Page configuration
 st.set_page_config(
@@ -398,32 +449,89 @@ header_html = """
 st.markdown(header_html, unsafe_allow_html=True)
 
 # Calculation functions
-def calculate_pnl(physical_trades, hedge_trades):
-    """Calculate P&L"""
-    # Physical trading P&L
-    physical_pnl = 0
-    for trade in physical_trades:
-        quantity = trade.get('quantity', 0)
-        if quantity != 0:
-            sale_price_base = trade.get('sale_price', 0.0)
-            sale_premium = trade.get('sale_premium_discount', 0.0)
-            if sale_price_base <= 0 and sale_premium == 0:
-                continue
-            buy_price = trade.get('buy_price', 0.0) + trade.get('buy_premium_discount', 0.0)
-            sale_price = sale_price_base + sale_premium
-            pnl = (sale_price - buy_price) * quantity
-            physical_pnl += pnl
-    
-    # Hedge P&L
-    hedge_pnl = 0
-    for hedge in hedge_trades:
-        if hedge['volume'] != 0:
-            pnl = (hedge['exit_price'] - hedge['entry_price']) * hedge['volume']
-            hedge_pnl += pnl
-    
-    # Net P&L
+def leg_usd_rate(fx_index, currency, leg_date) -> float:
+    """USD per unit of a trade leg's currency on the leg date (today when undated); NaN without a fixing"""
+    currency = currency or BASE_CURRENCY
+    if currency == BASE_CURRENCY:
+        return 1.0
+    try:
+        leg_date = pd.to_datetime(leg_date) if leg_date else pd.Timestamp.today()
+    except (ValueError, TypeError):
+        leg_date = pd.Timestamp.today()
+    return float(usd_rates(fx_index, currency, [leg_date])[0])
+
+
+def leg_usd_rates(fx_index, currencies, leg_dates) -> np.ndarray:
+    """leg_usd_rate for many legs at once: one as-of lookup per currency"""
+    currencies = pd.Series(list(currencies), dtype=object)
+    currencies = currencies.where(currencies.notna() & (currencies.astype(str).str.strip() != ''), BASE_CURRENCY)
+    currencies = currencies.astype(str).str.strip().str.upper().to_numpy()
+    leg_dates = pd.Series(list(leg_dates), dtype=object)
+    leg_dates = leg_dates.where(leg_dates.notna() & (leg_dates.astype(str).str.strip() != ''), None)
+    leg_dates = pd.to_datetime(leg_dates, errors='coerce', format='mixed').fillna(pd.Timestamp.today()).to_numpy()
+    rates = np.ones(len(currencies))
+    for currency in set(currencies) - {BASE_CURRENCY}:
+        mask = currencies == currency
+        rates[mask] = usd_rates(fx_index, currency, leg_dates[mask])
+    return rates
+
+
+def physical_usd_legs(physical_trades, fx_index=None) -> pd.DataFrame:
+    """Per lot: net buy and sale prices in USD at each leg's date, and realized P&L in USD.
+
+    A lot is realized once it has a sale price or premium; unsold lots, and
+    legs whose currency has no fixing, are NaN. `calculate_pnl` sums these.
+    """
+    if fx_index is None:
+        fx_index = get_fx_index()
+    df = pd.DataFrame(physical_trades)
+
+    def column(name, default):
+        return df[name] if name in df.columns else pd.Series(default, index=df.index, dtype=object)
+
+    quantity = pd.to_numeric(column('quantity', 0), errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    net_buy = (pd.to_numeric(column('buy_price', 0.0), errors='coerce').fillna(0.0)
+               + pd.to_numeric(column('buy_premium_discount', 0.0), errors='coerce').fillna(0.0)).to_numpy(dtype=float)
+    sale_price = pd.to_numeric(column('sale_price', 0.0), errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    sale_premium = pd.to_numeric(column('sale_premium_discount', 0.0), errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    sold = (sale_price > 0) | (sale_premium != 0)
+    net_buy_usd = net_buy * leg_usd_rates(fx_index, column('buy_currency', ''), column('date', ''))
+    net_sale_usd = np.where(sold, (sale_price + sale_premium) * leg_usd_rates(fx_index, column('sale_currency', ''), column('sale_date', '')), np.nan)
+    return pd.DataFrame({
+        'net_buy_usd': net_buy_usd,
+        'net_sale_usd': net_sale_usd,
+        'pnl_usd': (net_sale_usd - net_buy_usd) * quantity
+    }, index=df.index)
+
+
+def hedge_usd_pnl(hedge_trades, fx_index=None) -> np.ndarray:
+    """Per hedge: P&L in USD, entry and exit converted at their own dates; NaN without a fixing"""
+    if fx_index is None:
+        fx_index = get_fx_index()
+    if not hedge_trades:
+        return np.zeros(0)
+    currencies = [hedge.get('currency') for hedge in hedge_trades]
+    entry_rates = leg_usd_rates(fx_index, currencies, [hedge.get('trade_date') for hedge in hedge_trades])
+    exit_rates = leg_usd_rates(fx_index, currencies, [hedge.get('exit_date') for hedge in hedge_trades])
+    entry = np.array([hedge.get('entry_price', 0.0) or 0.0 for hedge in hedge_trades], dtype=float)
+    exit_price = np.array([hedge.get('exit_price', 0.0) or 0.0 for hedge in hedge_trades], dtype=float)
+    volume = np.array([hedge.get('volume', 0) or 0 for hedge in hedge_trades], dtype=float)
+    return (exit_price * exit_rates - entry * entry_rates) * volume
+
+
+def calculate_pnl(physical_trades, hedge_trades, fx_index=None):
+    """Calculate realized P&L in USD.
+
+    Each leg converts at its own date's rate (buy leg on the buy date, sale
+    leg on the sale date); trades whose currency has no fixing are left out.
+    Totals of `physical_usd_legs` and `hedge_usd_pnl`, so every view shares
+    one set of conversion rules.
+    """
+    if fx_index is None:
+        fx_index = get_fx_index()
+    physical_pnl = float(np.nansum(physical_usd_legs(physical_trades, fx_index)['pnl_usd'])) if physical_trades else 0.0
+    hedge_pnl = float(np.nansum(hedge_usd_pnl(hedge_trades, fx_index)))
     net_pnl = physical_pnl + hedge_pnl
-    
     return physical_pnl, hedge_pnl, net_pnl
 
 
@@ -437,9 +545,10 @@ def standardize_market_price_columns(df: pd.DataFrame) -> pd.DataFrame:
 
     column_map = {
         'date': ['date', 'valuation_date', 'pricing_date'],
-        'instrument': ['instrument', 'product', 'contract', 'name'],
-        'price': ['price', 'market_price', 'settlement', 'value'],
-        'type': ['type', 'category', 'instrument_type']
+        'instrument': ['instrument', 'product', 'contract', 'name', 'pair', 'currency_pair'],
+        'price': ['price', 'market_price', 'settlement', 'value', 'rate', 'fx_rate'],
+        'type': ['type', 'category', 'instrument_type'],
+        'volume': ['volume', 'traded_volume', 'size']
     }
 
     resolved = {}
@@ -454,75 +563,549 @@ def standardize_market_price_columns(df: pd.DataFrame) -> pd.DataFrame:
         raise ValueError(f"Missing required columns: {', '.join(missing_required)}")
 
     rename_map = {resolved['date']: 'date', resolved['instrument']: 'instrument', resolved['price']: 'price'}
-    if 'type' in resolved:
-        rename_map[resolved['type']] = 'type'
+    for optional in ['type', 'volume']:
+        if optional in resolved:
+            rename_map[resolved[optional]] = optional
 
     df = df.rename(columns=rename_map)
     if 'type' not in df.columns:
         df['type'] = ''
-    return df[['date', 'instrument', 'price', 'type']]
+    # traded volume is optional and only kept when the file has it (VWAP bars)
+    return df[['date', 'instrument', 'price', 'type'] + (['volume'] if 'volume' in resolved else [])]
 
 
 def normalize_market_price_df(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty:
-        return pd.DataFrame(columns=['date', 'instrument', 'price', 'type', 'instrument_key'])
+        return pd.DataFrame(columns=['date', 'instrument', 'price', 'type', 'instrument_id'])
 
     df = standardize_market_price_columns(df)
-    df['date'] = pd.to_datetime(df['date'], errors='coerce').dt.normalize()
+    # full timestamps are kept; daily bars come from PriceSet.view
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
     df['instrument'] = df['instrument'].astype(str).str.strip()
     df['price'] = pd.to_numeric(df['price'], errors='coerce')
     df['type'] = df['type'].fillna('').astype(str).str.strip()
+    if 'volume' in df.columns:
+        df['volume'] = pd.to_numeric(df['volume'], errors='coerce').fillna(0.0)
     df = df.dropna(subset=['date', 'instrument'])
     df = df[df['instrument'] != '']
     df = df.dropna(subset=['price'])
-    df['instrument_key'] = df['instrument'].str.lower().str.strip()
-    df = df.sort_values(['date', 'instrument_key']).reset_index(drop=True)
+    df['instrument_id'] = INSTRUMENTS.intern_many(df['instrument'])
+    df = df.sort_values(['date', 'instrument'], key=lambda col: col.str.lower() if col.name == 'instrument' else col)
+    df = df.reset_index(drop=True)
     return df
 
 
+@st.cache_resource
+def get_price_cache() -> PriceCache:
+    """Process-wide price cache shared by every session"""
+    return PriceCache(PRICE_CACHE_BUDGET_MB * 1024 * 1024)
+
+
+def get_market_price_set():
+    return st.session_state.get('market_price_set')
+
+
 def get_market_price_df() -> pd.DataFrame:
-    data = st.session_state.get('market_prices', [])
-    if isinstance(data, pd.DataFrame):
-        df = normalize_market_price_df(data)
-    else:
-        df = normalize_market_price_df(pd.DataFrame(data))
-    return df
+    """Session's normalized price frame (shared, read-only: copy before modifying)"""
+    price_set = get_market_price_set()
+    if price_set is None:
+        return normalize_market_price_df(None)
+    return price_set.frame
+
+
+def get_valuation_price_set(daily=False):
+    """Session's prices as the price bars selected for valuation.
+
+    `daily` forces one bar per day for the analytics built on daily
+    returns; raw timestamps then fall back to end-of-day bars. Views are
+    cached on the shared PriceSet, so switching back and forth is free, and
+    built through the price cache so their memory stays within its budget.
+    """
+    price_set = get_market_price_set()
+    if price_set is None:
+        return None
+    method = st.session_state.get('price_bar_method', 'eod')
+    frequency = st.session_state.get('price_bar_size', 'D')
+    if daily:
+        frequency = 'D'
+        if method == 'raw':
+            method = 'eod'
+    return get_price_cache().view(price_set, method, frequency, st.session_state.get('price_cutoff', DEFAULT_PRICE_CUTOFF))
+
+
+def price_storage_mode() -> str:
+    if not st.session_state.get('compact_price_storage', True):
+        return 'plain'
+    return 'float32' if st.session_state.get('float32_prices', False) else 'compact'
+
+
+def store_price_frame(normalized: pd.DataFrame) -> pd.DataFrame:
+    """Apply the session's price storage mode to a normalized frame"""
+    mode = price_storage_mode()
+    if mode == 'plain':
+        return normalized
+    return compact_price_frame(normalized, float32_prices=(mode == 'float32'))
 
 
 def save_market_price_df(df: pd.DataFrame) -> None:
     normalized = normalize_market_price_df(df)
     if normalized.empty:
-        st.session_state.market_prices = []
+        st.session_state.market_price_set = None
         return
+    st.session_state.market_price_set = get_price_cache().put(store_price_frame(normalized))
+
 
-    to_store = normalized.drop(columns=['instrument_key'])
-    to_store['date'] = to_store['date'].dt.strftime('%Y-%m-%d')
-    st.session_state.market_prices = to_store.to_dict(orient='records')
+def load_market_price_bytes(file_bytes: bytes) -> None:
+    """Load an uploaded price workbook, reusing the shared copy if any session already loaded it"""
+    source_key = f"excel:{hashlib.sha1(file_bytes).hexdigest()}:{price_storage_mode()}"
+    price_set = get_price_cache().get_or_build(
+        source_key,
+        lambda: store_price_frame(normalize_market_price_df(pd.read_excel(io.BytesIO(file_bytes))))
+    )
+    st.session_state.market_price_set = price_set if len(price_set) else None
 
 
-def lookup_market_price(prices_df: pd.DataFrame, instrument_name: str, valuation_date: pd.Timestamp):
-    if prices_df.empty or not instrument_name:
-        return None
+def forget_applied_upload(kind='price') -> None:
+    """Re-arm the price ('price') or FX ('fx') uploader after the session's copy was cleared or replaced.
 
-    key = str(instrument_name).strip().lower()
-    if not key:
-        return None
+    The uploader gets a fresh key, so it drops the file it still shows and
+    uploading the same file again loads it instead of being skipped.
+    """
+    st.session_state.pop(f"applied_{kind}_upload", None)
+    st.session_state[f"{kind}_upload_generation"] = st.session_state.get(f"{kind}_upload_generation", 0) + 1
 
-    valuation_date = pd.to_datetime(valuation_date).normalize()
-    subset = prices_df[(prices_df['instrument_key'] == key) & (prices_df['date'] == valuation_date)]
-    if subset.empty:
+
+def clear_market_prices() -> None:
+    st.session_state.market_price_set = None
+    forget_applied_upload('price')
+
+
+def get_fx_rate_set():
+    return st.session_state.get('fx_rate_set')
+
+
+def get_fx_index() -> PriceIndex:
+    fx_set = get_fx_rate_set()
+    if fx_set is None:
+        return PriceIndex(None)
+    return fx_set.index
+
+
+def load_fx_rate_bytes(file_bytes: bytes) -> None:
+    """Load an uploaded FX workbook (date, pair, rate) into the shared store like a price file"""
+    source_key = f"fx-excel:{hashlib.sha1(file_bytes).hexdigest()}"
+    fx_set = get_price_cache().get_or_build(
+        source_key,
+        lambda: compact_price_frame(normalize_market_price_df(pd.read_excel(io.BytesIO(file_bytes))))
+    )
+    st.session_state.fx_rate_set = fx_set if len(fx_set) else None
+
+
+def book_currencies(physical_trades, hedge_trades) -> list:
+    """Non-base currencies the book's trades settle in"""
+    currencies = {trade.get(field) or BASE_CURRENCY for trade in physical_trades for field in ('buy_currency', 'sale_currency')}
+    currencies |= {hedge.get('currency') or BASE_CURRENCY for hedge in hedge_trades}
+    return sorted(currencies - {BASE_CURRENCY})
+
+
+def book_fx_rates(fx_index: PriceIndex, physical_trades, hedge_trades, dates) -> dict:
+    """{currency: USD per unit on each of `dates`} for every currency the book uses"""
+    return {
+        currency: usd_rates(fx_index, currency, dates)
+        for currency in [BASE_CURRENCY] + book_currencies(physical_trades, hedge_trades)
+    }
+
+
+def reporting_rates(currency: str, dates) -> np.ndarray:
+    """Divisor from USD amounts to the reporting currency on each date"""
+    return usd_rates(get_fx_index(), currency, dates)
+
+
+def realized_reporting_rate():
+    """(currency, USD per unit) realized amounts are shown in: the Reporting Currency at its latest fixing, else USD"""
+    currency = st.session_state.get('reporting_currency', BASE_CURRENCY)
+    rate = reporting_rates(currency, [pd.Timestamp.today()])[0]
+    if np.isnan(rate):
+        return BASE_CURRENCY, 1.0
+    return currency, rate
+
+
+def currency_symbol(currency: str = BASE_CURRENCY) -> str:
+    """Column-label unit of an amount: '$' for USD, else the currency code"""
+    return '$' if currency == BASE_CURRENCY else currency
+
+
+def format_amount(value: float, currency: str = BASE_CURRENCY) -> str:
+    if currency == BASE_CURRENCY:
+        return f"${value:,.2f}"
+    return f"{currency} {value:,.2f}"
+
+
+def format_pnl_cell(value: float, currency: str = BASE_CURRENCY) -> str:
+    """Table cell of a P&L amount: '-' when zero, a note when a leg has no FX fixing"""
+    if pd.isna(value):
+        return 'No FX fixing'
+    return format_amount(value, currency) if value != 0 else '-'
+
+
+def restore_market_prices() -> None:
+    """Re-store the session's prices after the storage mode changes"""
+    if get_market_price_set() is not None:
+        save_market_price_df(expand_price_frame(get_market_price_df()))
+
+
+def _price_editor_mask(prices_df: pd.DataFrame, instruments, date_range) -> np.ndarray:
+    mask = np.ones(len(prices_df), dtype=bool)
+    if instruments:
+        mask &= prices_df['instrument'].isin(instruments).to_numpy()
+    dates = [d for d in (date_range if isinstance(date_range, (list, tuple)) else [date_range]) if d]
+    if dates:
+        start = pd.Timestamp(dates[0])
+        end = pd.Timestamp(dates[-1]) + pd.Timedelta(days=1)
+        mask &= ((prices_df['date'] >= start) & (prices_df['date'] < end)).to_numpy()
+    return mask
+
+
+def price_editor_match_count(prices_df: pd.DataFrame, instruments, date_range) -> int:
+    if prices_df.empty:
+        return 0
+    return int(_price_editor_mask(prices_df, instruments, date_range).sum())
+
+
+def price_editor_frame(prices_df: pd.DataFrame, instruments, date_range):
+    """Filtered slice of the stored prices for the editor and the store row position of each editor row"""
+    if prices_df.empty:
+        return np.array([], dtype=np.int64), pd.DataFrame({
+            'date': pd.Series(dtype='datetime64[ns]'),
+            'instrument': pd.Series(dtype='string'),
+            'price': pd.Series(dtype='float'),
+            'type': pd.Series(dtype='string')
+        })
+    positions = np.flatnonzero(_price_editor_mask(prices_df, instruments, date_range))[-PRICE_EDITOR_MAX_ROWS:]
+    editor_df = expand_price_frame(prices_df.iloc[positions]).drop(columns=['instrument_id'], errors='ignore')
+    return positions, editor_df.reset_index(drop=True)
+
+
+def apply_market_price_edits(positions: np.ndarray, editor_df: pd.DataFrame, editor_state: dict) -> int:
+    """Apply the price editor's diff (edited/added/deleted rows) to the session's prices.
+
+    Only the changed rows are normalized; they are upserted into the stored
+    frame by (date, instrument) and the price index is rebuilt for the
+    touched instruments only. Returns the number of rows changed.
+    """
+    edited = {int(row): changes for row, changes in (editor_state.get('edited_rows') or {}).items()}
+    deleted = {int(row) for row in editor_state.get('deleted_rows') or []}
+    added = list(editor_state.get('added_rows') or [])
+
+    removed = sorted({positions[row] for row in deleted | set(edited)})
+    records = []
+    for row, changes in edited.items():
+        if row in deleted:
+            continue
+        record = editor_df.iloc[row].to_dict()
+        record.update(changes)
+        records.append(record)
+    records.extend(added)
+    if not removed and not records:
+        return 0
+
+    upserts = normalize_market_price_df(pd.DataFrame(records, columns=list(editor_df.columns)))
+    if get_market_price_set() is None:
+        if not upserts.empty:
+            st.session_state.market_price_set = get_price_cache().put(store_price_frame(upserts))
+        return len(records)
+
+    commit_price_changes(removed, upserts)
+    return len(removed) + len(added)
+
+
+def commit_price_changes(removed_positions, upserts=None) -> None:
+    """Delete stored rows and upsert normalized rows, patching the price index for the touched instruments"""
+    price_set = get_market_price_set()
+    frame, changed_ids = apply_price_changes(price_set.frame, removed_positions, upserts)
+    if frame.empty:
+        st.session_state.market_price_set = None
+    else:
+        index = price_set.index.patched(frame, changed_ids)
+        st.session_state.market_price_set = get_price_cache().put(frame, index)
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_price_quality(price_set_key: str, calendar_name: str, extra_holidays: tuple, _frame: pd.DataFrame) -> pd.DataFrame:
+    """Data-quality exceptions of a stored price set; the set key identifies its content.
+
+    Missing days are counted on the valuation calendar when one is selected.
+    """
+    busdaycal = None
+    if calendar_name in CALENDARS and not _frame.empty:
+        busdaycal = business_calendar(calendar_name, _frame['date'].min(), _frame['date'].max(), extra_holidays).busdaycal
+    return screen_price_quality(_frame, busdaycal=busdaycal)
+
+
+@st.cache_data(max_entries=16)
+def cached_price_memory_report(price_set_key: str, _frame: pd.DataFrame) -> pd.DataFrame:
+    return price_memory_report(_frame)
+
+
+def market_prices_for_export() -> pd.DataFrame:
+    price_set = get_market_price_set()
+    export_df = expand_price_frame(get_market_price_df()).drop(columns=['instrument_id'], errors='ignore')
+    # intraday prints keep their time so a re-import does not collapse them onto midnight
+    intraday = price_set is not None and price_set.intraday
+    export_df['date'] = export_df['date'].dt.strftime('%Y-%m-%d %H:%M:%S' if intraday else '%Y-%m-%d')
+    return export_df
+
+
+SNAPSHOT_METADATA_KEYS = ['cargo_name', 'delivery_point', 'selected_product_category', 'selected_product_name']
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def cached_session_snapshot(book_version: str, price_set_key, fx_set_key, metadata_json: str,
+                            _physical_trades, _hedge_trades, _prices, _fx_rates) -> bytes:
+    """Snapshot bytes of a session; the book version and set keys identify its content"""
+    prices = None if _prices is None else expand_price_frame(_prices).drop(columns=['instrument_id'], errors='ignore')
+    fx_rates = None if _fx_rates is None else expand_price_frame(_fx_rates).drop(columns=['instrument_id'], errors='ignore')
+    return dump_snapshot(_physical_trades, _hedge_trades, prices, fx_rates, json.loads(metadata_json))
+
+
+def session_snapshot_bytes() -> bytes:
+    price_set, fx_set = get_market_price_set(), get_fx_rate_set()
+    metadata = {key: st.session_state.get(key, '') for key in SNAPSHOT_METADATA_KEYS}
+    return cached_session_snapshot(
+        st.session_state.trade_book_version,
+        price_set.key if price_set is not None else None,
+        fx_set.key if fx_set is not None else None,
+        json.dumps(metadata, sort_keys=True),
+        st.session_state.physical_trades,
+        st.session_state.hedge_trades,
+        price_set.frame if price_set is not None else None,
+        fx_set.frame if fx_set is not None else None
+    )
+
+
+def restore_session_snapshot(data: bytes) -> None:
+    """Replace the session's book, prices, FX rates and cargo details with a snapshot's (SnapshotError if unreadable)"""
+    snapshot = load_snapshot(data)
+    st.session_state.physical_trades = snapshot['physical_trades']
+    st.session_state.hedge_trades = snapshot['hedge_trades']
+    if snapshot['prices'] is None:
+        clear_market_prices()
+    else:
+        save_market_price_df(snapshot['prices'])
+        forget_applied_upload('price')
+    fx_rates = normalize_market_price_df(snapshot['fx_rates'])
+    st.session_state.fx_rate_set = get_price_cache().put(compact_price_frame(fx_rates)) if len(fx_rates) else None
+    forget_applied_upload('fx')
+    for key in SNAPSHOT_METADATA_KEYS:
+        if key in snapshot['metadata']:
+            st.session_state[key] = snapshot['metadata'][key]
+    get_trade_journal().load_book(st.session_state.physical_trades, st.session_state.hedge_trades)
+    bump_trade_book_version()
+
+
+def resolve_market_price(price_index: PriceIndex, instrument_name: str, valuation_date, lookup_mode='exact', max_staleness_days=5):
+    if not instrument_name:
+        return None, None, None
+
+    instrument_id = INSTRUMENTS.intern(instrument_name)
+    if instrument_id == MISSING_INSTRUMENT_ID:
+        return None, None, None
+
+    valuation_date = pd.to_datetime(valuation_date)
+    if lookup_mode == 'exact' and valuation_date != valuation_date.normalize():
+        # intraday: the latest bar closed by the valuation time is that day's price
+        day_elapsed = (valuation_date - valuation_date.normalize()) / pd.Timedelta(days=1)
+        price, price_date, source = price_index.lookup(instrument_id, valuation_date, 'last', day_elapsed)
+        return price, price_date, 'exact' if source is not None else None
+    return price_index.lookup(instrument_id, valuation_date, lookup_mode, max_staleness_days)
+
+
+def has_pricing_window(trade) -> bool:
+    return bool(trade.get('buy_pricing_start')) and bool(trade.get('buy_pricing_end'))
+
+
+def pricing_window_prices(price_index: PriceIndex, physical_trades, valuation_date=None, default_product=''):
+    """Buy-side window averages for the lots that price on a window.
+
+    Returns {trade position: (average, priced days, pending days)}, all
+    windows priced in one vectorized pass. With `valuation_date`, days after
+    it are pending and carried at the latest print (see
+    PriceIndex.window_averages); without it only stored prints count.
+    """
+    positions = [i for i, trade in enumerate(physical_trades) if has_pricing_window(trade)]
+    if not positions:
+        return {}
+    names = [physical_trades[i].get('product_name') or physical_trades[i].get('product') or default_product for i in positions]
+    windows = price_index.window_averages(
+        INSTRUMENTS.intern_many(names),
+        [physical_trades[i]['buy_pricing_start'] for i in positions],
+        [physical_trades[i]['buy_pricing_end'] for i in positions],
+        as_of=valuation_date
+    )
+    return {
+        position: (
+            None if np.isnan(windows['average'][row]) else float(windows['average'][row]),
+            int(windows['priced_days'][row]),
+            int(windows['pending_days'][row])
+        )
+        for row, position in enumerate(positions)
+    }
+
+
+def pricing_window_status(trade, price_set, default_product=''):
+    """(average, priced days, pending days) of a lot's window over the stored prints; None without a window"""
+    if not has_pricing_window(trade):
         return None
-    return subset.iloc[-1]['price']
+    if price_set is None or price_set.frame.empty:
+        return None, 0, 0
+    return pricing_window_prices(
+        price_set.index, [trade], price_set.frame['date'].max(), default_product
+    ).get(0, (None, 0, 0))
+
+
+def pricing_window_settlement(trade, price_set, default_product='', fx_index=None):
+    """Changes fixing a lot's `buy_price` at its window average, or None until every window day has a stored print.
+
+    `price_set` should hold daily bars (see get_valuation_price_set). The
+    average of USD market prints is stored in the lot's buy currency, at
+    the buy-date rate `calculate_pnl` converts it back with; a lot whose
+    currency has no fixing stays unsettled. A settled lot loses its
+    `buy_price_provisional` flag. The lot itself is not modified: record
+    the changes through the trade journal.
+    """
+    status = pricing_window_status(trade, price_set, default_product)
+    if status is None:
+        return None
+    average, priced_days, pending_days = status
+    if average is None or priced_days == 0 or pending_days > 0:
+        return None
+    buy_rate = leg_usd_rate(get_fx_index() if fx_index is None else fx_index, trade.get('buy_currency'), trade.get('date'))
+    if np.isnan(buy_rate):
+        return None
+    changes = {'buy_price': average / buy_rate}
+    if 'buy_price_provisional' in trade:
+        changes['buy_price_provisional'] = False
+    return changes
+
+
+def provisional_sold_lots(physical_trades):
+    """Positions of sold lots realized at a provisional (unsettled window) buy price"""
+    return [
+        position for position, trade in enumerate(physical_trades)
+        if trade.get('buy_price_provisional') is True and not lot_is_open(trade)
+    ]
+
+
+def hedge_roll_table(hedge_trades, valuation_dates) -> dict:
+    """Roll resolution of a book's relative-label (Moₙ) hedges on each valuation date.
+
+    Returns {hedge position: (family, contract month, Moₙ offset per
+    valuation date, expiry day)}. The contract month is fixed from the
+    label at trade date; offsets below 1 mean the contract has expired.
+    Hedges with absolute contract names or no trade date are left out.
+    """
+    valuation_days = to_days(valuation_dates)
+    if not len(valuation_days):
+        return {}
+    by_family = {}
+    for position, hedge in enumerate(hedge_trades):
+        parsed = parse_relative_label(hedge.get('contract'))
+        if parsed is None or not hedge.get('trade_date'):
+            continue
+        try:
+            trade_day = to_days(hedge['trade_date'])[0]
+        except (ValueError, TypeError):
+            continue
+        by_family.setdefault(parsed[0], []).append((position, parsed[1], trade_day))
+
+    table = {}
+    for family, rows in by_family.items():
+        positions, offsets, trade_days = zip(*rows)
+        trade_days = np.array(trade_days)
+        calendar = roll_calendar(
+            family,
+            min(trade_days.min(), valuation_days.min()),
+            max(trade_days.max(), valuation_days.max())
+        )
+        months = calendar.contract_months(offsets, trade_days)
+        nearby = calendar.nearby_offsets(months, valuation_days)
+        expiries = calendar.expiry(months)
+        for row, position in enumerate(positions):
+            table[position] = (family, int(months[row]), nearby[row], expiries[row])
+    return table
+
 
+def lookup_market_price(prices_df: pd.DataFrame, instrument_name: str, valuation_date: pd.Timestamp,
+                        lookup_mode='exact', max_staleness_days=5, price_index=None):
+    if prices_df.empty or not instrument_name:
+        return None
 
-def evaluate_market_pnl_for_date(prices_df: pd.DataFrame, physical_trades, hedge_trades, valuation_date):
-    valuation_date = pd.to_datetime(valuation_date).normalize()
+    if price_index is None:
+        price_index = PriceIndex(prices_df)
+    price, _, _ = resolve_market_price(price_index, instrument_name, valuation_date, lookup_mode, max_staleness_days)
+    return price
+
+
+def format_price_stamp(price_date) -> str:
+    """Date of a price, with the time of day for intraday prints"""
+    if price_date == price_date.normalize():
+        return price_date.strftime('%Y-%m-%d')
+    return price_date.strftime('%Y-%m-%d %H:%M')
+
+
+def describe_price_source(price_date, source, valuation_date) -> str:
+    if source is None:
+        return 'Missing'
+    if source == 'exact':
+        return 'Current'
+    age = (pd.to_datetime(valuation_date) - price_date).days
+    if source == 'interpolate':
+        return f"Interpolated (from {format_price_stamp(price_date)})"
+    return f"Stale ({age}d, {format_price_stamp(price_date)})"
+
+
+def evaluate_market_pnl_for_date(prices_df: pd.DataFrame, physical_trades, hedge_trades, valuation_date,
+                                 lookup_mode='exact', max_staleness_days=5, price_index=None, default_product=None,
+                                 hedge_rolls=None, fx_index=None, fx_rates=None):
+    """Mark-to-market of a book on one date, in USD.
+
+    `hedge_rolls` maps hedge positions to (family, contract month, Moₙ
+    offset, expiry day) on this date; without it the roll calendar is
+    resolved here. Relative-label hedges are marked against the nearby
+    label their contract month has rolled to, and expired ones against the
+    front-month print on their expiry day. `valuation_date` may carry a time
+    of day to value against intraday price bars.
+
+    Buy prices, premiums and hedge entry prices are in the trade's own
+    currency and convert at `fx_rates` ({currency: USD per unit on this
+    date}), looked up in `fx_index` when not given; market prices are USD.
+    A currency without a fixing is reported as a missing 'FX' instrument.
+    """
+    valuation_date = pd.to_datetime(valuation_date)
+    if price_index is None:
+        price_index = PriceIndex(prices_df)
+    if default_product is None:
+        default_product = st.session_state.get('selected_product_name', '')
+    if hedge_rolls is None:
+        hedge_rolls = {
+            position: (family, month, offsets[0], expiry)
+            for position, (family, month, offsets, expiry) in hedge_roll_table(hedge_trades, [valuation_date]).items()
+        }
+    if fx_rates is None:
+        if fx_index is None:
+            fx_index = get_fx_index()
+        fx_rates = {
+            currency: rates[0]
+            for currency, rates in book_fx_rates(fx_index, physical_trades, hedge_trades, [valuation_date]).items()
+        }
 
     physical_rows = []
     hedge_rows = []
     physical_pnl = 0.0
     hedge_pnl = 0.0
     missing_instruments = set()
+    stale_instruments = set()
+    window_prices = pricing_window_prices(price_index, physical_trades, valuation_date, default_product)
 
     for idx, trade in enumerate(physical_trades, start=1):
         quantity = trade.get('quantity', 0) or 0
@@ -551,15 +1134,31 @@ def evaluate_market_pnl_for_date(prices_df: pd.DataFrame, physical_trades, hedge
         if sale_date and sale_date <= valuation_date:
             status = 'Closed'
 
-        product_name = trade.get('product_name') or trade.get('product') or st.session_state.get('selected_product_name', '')
-        net_buy_price = (trade.get('buy_price', 0.0) or 0.0) + (trade.get('buy_premium_discount', 0.0) or 0.0)
-        market_price = lookup_market_price(prices_df, product_name, valuation_date)
+        product_name = trade.get('product_name') or trade.get('product') or default_product
+        currency = trade.get('buy_currency') or BASE_CURRENCY
+        fx_rate = fx_rates.get(currency, np.nan)
+        buy_price = (trade.get('buy_price', 0.0) or 0.0) * fx_rate
+        pricing = 'Fixed'
+        if idx - 1 in window_prices:
+            window_average, priced_days, pending_days = window_prices[idx - 1]
+            if window_average is not None:
+                # window averages are quoted in USD already
+                buy_price = window_average
+            pricing = f"Window {priced_days}/{priced_days + pending_days} priced"
+        net_buy_price = buy_price + (trade.get('buy_premium_discount', 0.0) or 0.0) * fx_rate
+        market_price, price_date, price_source = resolve_market_price(
+            price_index, product_name, valuation_date, lookup_mode, max_staleness_days
+        )
         pnl_value = np.nan
 
         if status == 'Open':
-            if market_price is not None:
+            if np.isnan(fx_rate):
+                missing_instruments.add(f"FX {currency}")
+            elif market_price is not None:
                 pnl_value = (market_price - net_buy_price) * quantity
                 physical_pnl += pnl_value
+                if price_source != 'exact':
+                    stale_instruments.add(product_name or 'Physical Product')
             else:
                 missing_instruments.add(product_name or 'Physical Product')
         else:
@@ -570,8 +1169,11 @@ def evaluate_market_pnl_for_date(prices_df: pd.DataFrame, physical_trades, hedge
             'Instrument': product_name or 'N/A',
             'Status': status,
             'Quantity (MT)': quantity,
+            'Currency': currency,
+            'Pricing': pricing,
             'Net Buy Price ($/BBL)': net_buy_price,
             'Market Price ($/BBL)': market_price,
+            'Price Source': describe_price_source(price_date, price_source, valuation_date),
             'P&L ($)': pnl_value
         })
 
@@ -603,31 +1205,62 @@ def evaluate_market_pnl_for_date(prices_df: pd.DataFrame, physical_trades, hedge
             status = 'Closed'
 
         contract_name = hedge.get('contract') or 'Hedge Instrument'
-        entry_price = hedge.get('entry_price', 0.0) or 0.0
-        market_price = lookup_market_price(prices_df, contract_name, valuation_date)
+        currency = hedge.get('currency') or BASE_CURRENCY
+        fx_rate = fx_rates.get(currency, np.nan)
+        entry_price = (hedge.get('entry_price', 0.0) or 0.0) * fx_rate
+        priced_as = contract_name
+        contract_month = ''
+        expired = False
+        roll = hedge_rolls.get(idx - 1)
+        if roll is not None:
+            family, month, offset, expiry_day = roll
+            contract_month = month_label(month)
+            expired = offset < 1
+            priced_as = relative_label(family, 1 if expired else int(offset))
+        if expired:
+            # settled: the contract's last front-month print of its expiry day
+            market_price, price_date, price_source = resolve_market_price(
+                price_index, priced_as, pd.Timestamp(expiry_day) + pd.Timedelta(days=1) - pd.Timedelta(1),
+                'last', max_staleness_days
+            )
+        else:
+            market_price, price_date, price_source = resolve_market_price(
+                price_index, priced_as, valuation_date, lookup_mode, max_staleness_days
+            )
         pnl_value = np.nan
 
         if status == 'Open':
-            if market_price is not None:
+            if np.isnan(fx_rate):
+                missing_instruments.add(f"FX {currency}")
+            elif market_price is not None:
                 pnl_value = (market_price - entry_price) * volume
                 hedge_pnl += pnl_value
+                if price_source != 'exact' and not expired:
+                    stale_instruments.add(priced_as)
             else:
-                missing_instruments.add(contract_name)
+                missing_instruments.add(priced_as)
         else:
             pnl_value = 0.0
 
         hedge_rows.append({
             'Hedge #': idx,
             'Instrument': contract_name,
+            'Contract Month': contract_month,
+            'Priced As': f"{priced_as} (expired {pd.Timestamp(expiry_day):%Y-%m-%d})" if expired else priced_as,
             'Status': status,
             'Volume': volume,
+            'Currency': currency,
             'Entry Price ($/BBL)': entry_price,
             'Market Price ($/BBL)': market_price,
+            'Price Source': (
+                f"Settled ({format_price_stamp(price_date)})" if expired and price_date is not None
+                else describe_price_source(price_date, price_source, valuation_date)
+            ),
             'P&L ($)': pnl_value
         })
 
-    physical_df = pd.DataFrame(physical_rows) if physical_rows else pd.DataFrame(columns=['Trade #', 'Instrument', 'Status', 'Quantity (MT)', 'Net Buy Price ($/BBL)', 'Market Price ($/BBL)', 'P&L ($)'])
-    hedge_df = pd.DataFrame(hedge_rows) if hedge_rows else pd.DataFrame(columns=['Hedge #', 'Instrument', 'Status', 'Volume', 'Entry Price ($/BBL)', 'Market Price ($/BBL)', 'P&L ($)'])
+    physical_df = pd.DataFrame(physical_rows) if physical_rows else pd.DataFrame(columns=['Trade #', 'Instrument', 'Status', 'Quantity (MT)', 'Currency', 'Pricing', 'Net Buy Price ($/BBL)', 'Market Price ($/BBL)', 'Price Source', 'P&L ($)'])
+    hedge_df = pd.DataFrame(hedge_rows) if hedge_rows else pd.DataFrame(columns=['Hedge #', 'Instrument', 'Contract Month', 'Priced As', 'Status', 'Volume', 'Currency', 'Entry Price ($/BBL)', 'Market Price ($/BBL)', 'Price Source', 'P&L ($)'])
 
     return {
         'valuation_date': valuation_date,
@@ -636,45 +1269,346 @@ def evaluate_market_pnl_for_date(prices_df: pd.DataFrame, physical_trades, hedge
         'net_pnl': float(physical_pnl + hedge_pnl),
         'physical_details': physical_df,
         'hedge_details': hedge_df,
-        'missing_instruments': sorted({m for m in missing_instruments if m})
+        'missing_instruments': sorted({m for m in missing_instruments if m}),
+        'stale_instruments': sorted({m for m in stale_instruments if m})
     }
 
 
-def calculate_market_pnl_series(prices_df: pd.DataFrame, physical_trades, hedge_trades) -> pd.DataFrame:
+def calculate_market_pnl_series(prices_df: pd.DataFrame, physical_trades, hedge_trades,
+                                lookup_mode='exact', max_staleness_days=5, price_index=None,
+                                valuation_dates=None, default_product=None, cancel_event=None,
+                                fx_index=None) -> pd.DataFrame:
     if prices_df.empty:
         return pd.DataFrame(columns=['date', 'physical_pnl', 'hedge_pnl', 'net_pnl'])
 
-    results = []
-    for valuation_date in sorted(prices_df['date'].dropna().unique()):
-        pnl_snapshot = evaluate_market_pnl_for_date(prices_df, physical_trades, hedge_trades, valuation_date)
-        results.append({
-            'date': pd.to_datetime(valuation_date),
-            'physical_pnl': pnl_snapshot['physical_pnl'],
-            'hedge_pnl': pnl_snapshot['hedge_pnl'],
-            'net_pnl': pnl_snapshot['net_pnl']
-        })
+    if price_index is None:
+        price_index = PriceIndex(prices_df)
+    if valuation_dates is None:
+        valuation_dates = sorted(prices_df['date'].dropna().unique())
+    valuation_dates = pd.DatetimeIndex(valuation_dates)
+
+    # resolve every relative hedge on every date in one pass of the roll calendars
+    roll_table = hedge_roll_table(hedge_trades, valuation_dates)
+    if fx_index is None:
+        fx_index = get_fx_index()
+    fx_table = book_fx_rates(fx_index, physical_trades, hedge_trades, valuation_dates)
+
+    physical_pnl = np.full(len(valuation_dates), np.nan)
+    hedge_pnl = np.full(len(valuation_dates), np.nan)
+    valued = 0
+    for column, valuation_date in enumerate(valuation_dates):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        hedge_rolls = {
+            position: (family, month, offsets[column], expiry)
+            for position, (family, month, offsets, expiry) in roll_table.items()
+        }
+        fx_rates = {currency: rates[column] for currency, rates in fx_table.items()}
+        pnl_snapshot = evaluate_market_pnl_for_date(
+            prices_df, physical_trades, hedge_trades, valuation_date,
+            lookup_mode, max_staleness_days, price_index, default_product, hedge_rolls,
+            fx_index, fx_rates
+        )
+        physical_pnl[column] = pnl_snapshot['physical_pnl']
+        hedge_pnl[column] = pnl_snapshot['hedge_pnl']
+        valued = column + 1
 
-    return pd.DataFrame(results)
+    return pd.DataFrame({
+        'date': valuation_dates[:valued],
+        'physical_pnl': physical_pnl[:valued],
+        'hedge_pnl': hedge_pnl[:valued],
+        'net_pnl': physical_pnl[:valued] + hedge_pnl[:valued]
+    })
 
 
 def build_price_history(prices_df: pd.DataFrame, instruments) -> pd.DataFrame:
     if prices_df.empty or not instruments:
         return pd.DataFrame()
 
-    instrument_keys = {str(instr).strip().lower() for instr in instruments if instr}
-    if not instrument_keys:
+    instrument_ids = {INSTRUMENTS.intern(instr) for instr in instruments if instr}
+    instrument_ids.discard(MISSING_INSTRUMENT_ID)
+    if not instrument_ids:
         return pd.DataFrame()
 
-    subset = prices_df[prices_df['instrument_key'].isin(instrument_keys)]
+    subset = prices_df[prices_df['instrument_id'].isin(instrument_ids)]
     if subset.empty:
         return pd.DataFrame()
 
-    pivot = (subset.pivot_table(index='date', columns='instrument', values='price', aggfunc='last')
+    pivot = (subset.pivot_table(index='date', columns='instrument', values='price', aggfunc='last', observed=True)
                     .sort_index())
     pivot = pivot.reset_index()
     return pivot
 
 
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_chart_series(data_version: str, x_column: str, y_columns: tuple, budget: int, _frame: pd.DataFrame) -> dict:
+    """Downsampled chart series; the data version identifies the frame's content"""
+    return downsample_frame(_frame, x_column, y_columns, budget)
+
+
+def line_traces(series: dict, names=None) -> list:
+    """Line traces of downsampled series, switching to WebGL once the chart holds many points"""
+    names = names or {}
+    trace_type = go.Scattergl if sum(len(frame) for frame in series.values()) > WEBGL_POINT_THRESHOLD else go.Scatter
+    return [
+        trace_type(
+            x=frame.iloc[:, 0],
+            y=frame[column],
+            mode='lines+markers' if len(frame) <= CHART_MARKER_POINT_LIMIT else 'lines',
+            name=names.get(column, column)
+        )
+        for column, frame in series.items()
+    ]
+
+
+def parse_holiday_list(text: str):
+    """(sorted ISO dates, unparseable entries) from a comma- or space-separated list of dates"""
+    holidays, invalid = set(), []
+    for token in str(text or '').replace(',', ' ').split():
+        try:
+            holidays.add(pd.Timestamp(token).date().isoformat())
+        except (ValueError, TypeError):
+            invalid.append(token)
+    return sorted(holidays), invalid
+
+
+def get_valuation_calendar():
+    """(calendar name, extra holidays) selected for the MTM history axis"""
+    name = st.session_state.get('valuation_calendar', DEFAULT_VALUATION_CALENDAR)
+    extra_holidays, _ = parse_holiday_list(st.session_state.get('extra_holidays', ''))
+    return name, tuple(extra_holidays)
+
+
+@st.cache_resource
+def get_background_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by all sessions for background valuation work.
+
+    Threads keep the page responsive while chunks are valued; they do not
+    value in parallel (the chunks are Python loops holding the GIL). Each
+    job queues MTM_HISTORY_QUEUED_CHUNKS chunks at a time, so sessions take
+    turns on the pool.
+    """
+    return ThreadPoolExecutor(max_workers=MTM_HISTORY_WORKERS, thread_name_prefix='mtm-history')
+
+
+def ensure_mtm_history_job(lookup_mode='exact', max_staleness_days=5, known_at=None) -> ChunkedSeriesJob:
+    """Start (or keep) the background MTM history valuation for the current book and prices.
+
+    With `known_at` the book is valued as it was recorded at that time,
+    corrections made since included only from then on. A running job for
+    different inputs is cancelled and replaced. Daily
+    bars are valued on every business day of the selected calendar, with
+    days that have no print priced as of the latest one (within
+    `max_staleness_days`); intraday bars, or the 'price_dates' calendar,
+    value every bar.
+    """
+    price_set = get_valuation_price_set()
+    fx_set = get_fx_rate_set()
+    default_product = st.session_state.get('selected_product_name', '')
+    calendar_name, extra_holidays = get_valuation_calendar()
+    use_grid = calendar_name in CALENDARS and price_set is not None and not price_set.intraday
+    if not use_grid:
+        calendar_name, extra_holidays = None, ()
+    elif lookup_mode == 'exact':
+        lookup_mode = 'last'
+    key = (
+        st.session_state.trade_book_version,
+        price_set.key if price_set is not None else None,
+        lookup_mode,
+        max_staleness_days if lookup_mode != 'exact' else None,
+        default_product,
+        calendar_name,
+        extra_holidays,
+        fx_set.key if fx_set is not None else None,
+        known_at
+    )
+    job = st.session_state.get('mtm_history_job')
+    if job is not None and job.key == key and not job.cancelled:
+        return job
+    if job is not None:
+        job.cancel()
+
+    prices_df = price_set.frame if price_set is not None else get_market_price_df()
+    price_index = price_set.index if price_set is not None else PriceIndex(None)
+    fx_index = get_fx_index()
+    if known_at is not None:
+        physical_trades, hedge_trades = get_bitemporal_index().book(known_at=known_at)
+    else:
+        # the workers get their own copy: the forms edit trade dicts in place
+        physical_trades = copy.deepcopy(st.session_state.physical_trades)
+        hedge_trades = copy.deepcopy(st.session_state.hedge_trades)
+    if prices_df.empty:
+        valuation_dates = []
+    elif use_grid:
+        valuation_dates = valuation_grid(calendar_name, prices_df['date'].min(), prices_df['date'].max(), extra_holidays)
+    else:
+        valuation_dates = sorted(prices_df['date'].dropna().unique())
+
+    def value_chunk(dates, cancel_event):
+        return calculate_market_pnl_series(
+            prices_df, physical_trades, hedge_trades, lookup_mode, max_staleness_days, price_index,
+            valuation_dates=dates, default_product=default_product, cancel_event=cancel_event,
+            fx_index=fx_index
+        )
+
+    job = ChunkedSeriesJob(key, valuation_dates, value_chunk, get_background_executor(), MTM_HISTORY_CHUNK_DATES,
+                           max_queued=MTM_HISTORY_QUEUED_CHUNKS)
+    st.session_state.mtm_history_job = job
+    return job
+
+
+def render_mtm_history_chart() -> None:
+    job = st.session_state.get('mtm_history_job')
+    if job is None:
+        return
+
+    pnl_series = job.completed_frame()
+    if not job.done:
+        st.caption(f"Valuing MTM history in the background: {job.chunks_done}/{job.chunks_total} chunks complete")
+    for error in job.errors():
+        st.error(f"MTM history valuation failed: {error}")
+
+    currency = st.session_state.get('reporting_currency', BASE_CURRENCY)
+    if not pnl_series.empty and currency != BASE_CURRENCY:
+        # the history is valued in USD once; other reporting currencies are a display-time division
+        pnl_series = pnl_series.copy()
+        rates = reporting_rates(currency, pnl_series['date'])
+        for column in ['physical_pnl', 'hedge_pnl', 'net_pnl']:
+            pnl_series[column] = pnl_series[column].to_numpy() / rates
+
+    if pnl_series.empty:
+        if job.done:
+            st.info("Add additional price history to see MTM trends.")
+    else:
+        # the job key and completed chunk count identify the valued series
+        chart_series = cached_chart_series(
+            f"{job.key}|{job.chunks_done}|{currency}", 'date', ('physical_pnl', 'hedge_pnl', 'net_pnl'),
+            CHART_POINT_BUDGET, pnl_series
+        )
+        pnl_fig = go.Figure(data=line_traces(
+            chart_series, {'physical_pnl': 'Physical MTM', 'hedge_pnl': 'Hedge MTM', 'net_pnl': 'Net MTM'}
+        ))
+        pnl_fig.update_layout(
+            title='MTM History',
+            xaxis_title='Date',
+            yaxis_title='P&L ($)' if currency == BASE_CURRENCY else f'P&L ({currency})',
+            hovermode='x unified',
+            legend_title='Category',
+            height=400
+        )
+        st.plotly_chart(pnl_fig, use_container_width=True)
+
+    if job.done and st.session_state.get('mtm_history_polling'):
+        # one full rerun to swap the polling fragment for a static chart
+        st.session_state.mtm_history_polling = False
+        st.rerun()
+
+
+@st.fragment(run_every=1.0)
+def poll_mtm_history_chart() -> None:
+    render_mtm_history_chart()
+
+
+def bump_trade_book_version() -> str:
+    """Mark the trade book as changed; cached book analytics are keyed on this token"""
+    st.session_state.trade_book_version = uuid.uuid4().hex
+    return st.session_state.trade_book_version
+
+
+def get_trade_journal() -> TradeJournal:
+    return st.session_state.trade_journal
+
+
+def get_bitemporal_index() -> BitemporalIndex:
+    """Versioned view of the session journal, synced on each query"""
+    index = st.session_state.get('bitemporal_index')
+    if index is None or index.journal is not get_trade_journal():
+        index = BitemporalIndex(get_trade_journal())
+        st.session_state.bitemporal_index = index
+    return index
+
+
+def get_known_at():
+    """Knowledge time the MTM values the book as of, or None for the current book"""
+    if not st.session_state.get('value_as_known'):
+        return None
+    known_date = st.session_state.get('known_at_date') or datetime.now().date()
+    return pd.Timestamp(datetime.combine(known_date, st.session_state.get('known_at_time') or time(23, 59)))
+
+
+def restore_journal_book() -> None:
+    """Make the journal's head state the session book, e.g. after an undo"""
+    st.session_state.physical_trades, st.session_state.hedge_trades = get_trade_journal().book()
+    bump_trade_book_version()
+
+
+def get_open_positions() -> OpenPositionIndex:
+    """Session's open lot/hedge index, rebuilt only after bulk book changes"""
+    index = st.session_state.get('open_positions')
+    if index is None or index.version != st.session_state.trade_book_version:
+        index = OpenPositionIndex(
+            st.session_state.physical_trades,
+            st.session_state.hedge_trades,
+            st.session_state.trade_book_version
+        )
+        st.session_state.open_positions = index
+    return index
+
+
+def get_hedge_matches() -> dict:
+    """Suggested hedge for each pending lot, recomputed when the book changes"""
+    open_positions = get_open_positions()
+    cached = st.session_state.get('hedge_matches')
+    if cached is None or cached[0] != open_positions.version:
+        cached = (open_positions.version, match_hedges_to_lots(open_positions.open_lots, open_positions.open_hedges))
+        st.session_state.hedge_matches = cached
+    return cached[1]
+
+
+def get_valuation_snapshot(valuation_date, lookup_mode='exact', max_staleness_days=5, known_at=None) -> dict:
+    """MTM snapshot for a date or timestamp, served from the session's LRU when the book and prices are unchanged.
+
+    With `known_at` the book is the bitemporal one: trades entered by the
+    valuation date, as recorded at `known_at`.
+    """
+    price_set = get_valuation_price_set()
+    fx_set = get_fx_rate_set()
+    default_product = st.session_state.get('selected_product_name', '')
+    key = (
+        pd.Timestamp(valuation_date),
+        st.session_state.trade_book_version,
+        price_set.key if price_set is not None else None,
+        lookup_mode,
+        max_staleness_days if lookup_mode != 'exact' else None,
+        default_product,
+        fx_set.key if fx_set is not None else None,
+        known_at
+    )
+    if known_at is None:
+        physical_trades, hedge_trades = st.session_state.physical_trades, st.session_state.hedge_trades
+    else:
+        physical_trades, hedge_trades = get_bitemporal_index().book(valuation_date, known_at)
+    return st.session_state.valuation_cache.get_or_compute(
+        key,
+        lambda: evaluate_market_pnl_for_date(
+            price_set.frame if price_set is not None else get_market_price_df(),
+            physical_trades,
+            hedge_trades,
+            valuation_date,
+            lookup_mode,
+            max_staleness_days,
+            price_set.index if price_set is not None else PriceIndex(None),
+            fx_index=get_fx_index()
+        )
+    )
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_exposure_ladder(book_version: str, as_of, default_product: str, _physical_trades, _hedge_trades) -> pd.DataFrame:
+    book = trade_book_frame(_physical_trades, _hedge_trades, default_product)
+    return exposure_ladder(book, as_of)
+
+
 
 
 
@@ -684,19 +1618,37 @@ if 'physical_trades' not in st.session_state:
     st.session_state.physical_trades = []
 if 'hedge_trades' not in st.session_state:
     st.session_state.hedge_trades = []
+if 'trade_book_version' not in st.session_state:
+    bump_trade_book_version()
+if 'valuation_cache' not in st.session_state:
+    st.session_state.valuation_cache = ValuationCache(VALUATION_CACHE_ENTRIES)
+
+apply_defaults(st.session_state.physical_trades, PHYSICAL_TRADE_SCHEMA, {
+    'product_name': st.session_state.get('selected_product_name', ''),
+    'product_category': st.session_state.get('selected_product_category', '')
+})
+apply_defaults(st.session_state.hedge_trades, HEDGE_TRADE_SCHEMA)
+
+if 'trade_journal' not in st.session_state:
+    st.session_state.trade_journal = TradeJournal()
+    # a book that predates the journal becomes its first event
+    if st.session_state.physical_trades or st.session_state.hedge_trades:
+        st.session_state.trade_journal.load_book(st.session_state.physical_trades, st.session_state.hedge_trades)
 
-for trade in st.session_state.physical_trades:
-    trade.setdefault('buy_premium_discount', 0.0)
-    trade.setdefault('sale_premium_discount', 0.0)
-    trade.setdefault('sale_date', '')
-    trade.setdefault('product_name', st.session_state.get('selected_product_name', ''))
-    trade.setdefault('product_category', st.session_state.get('selected_product_category', ''))
+if 'market_price_set' not in st.session_state:
+    st.session_state.market_price_set = None
+    # sessions started before prices moved to the shared cache kept raw records
+    legacy_prices = st.session_state.pop('market_prices', None)
+    if legacy_prices:
+        save_market_price_df(pd.DataFrame(legacy_prices))
 
-for hedge in st.session_state.hedge_trades:
-    hedge.setdefault('exit_date', '')
+if 'fx_rate_set' not in st.session_state:
+    st.session_state.fx_rate_set = None
 
-if 'market_prices' not in st.session_state:
-    st.session_state.market_prices = []
+if 'compact_price_storage' not in st.session_state:
+    st.session_state.compact_price_storage = True
+if 'float32_prices' not in st.session_state:
+    st.session_state.float32_prices = False
 
 if 'selected_product_category' not in st.session_state:
     st.session_state.selected_product_category = ''
@@ -709,9 +1661,10 @@ with st.sidebar:
 
     cargo_name = st.text_input(
         "Cargo Name",
-        value="GO-KAKI STAR 0.5%",
+        value=st.session_state.get("cargo_name", "GO-KAKI STAR 0.5%"),
         help="Enter vessel name"
     )
+    st.session_state.cargo_name = cargo_name
 
     delivery_point = st.text_input(
         "Delivery Point",
@@ -798,7 +1751,9 @@ with st.sidebar:
     if st.button("Reset All Data"):
         st.session_state.physical_trades = []
         st.session_state.hedge_trades = []
-        st.session_state.market_prices = []
+        get_trade_journal().clear()
+        clear_market_prices()
+        bump_trade_book_version()
         st.rerun()
 
     # Demo data presets
@@ -832,6 +1787,8 @@ with st.sidebar:
                 'status': 'Closed',
                 'exit_date': '2019-02-01'
             }]
+            get_trade_journal().load_book(st.session_state.physical_trades, st.session_state.hedge_trades)
+            bump_trade_book_version()
             st.rerun()
         elif demo_preset == "FO Cargo (Open Position)":
             st.session_state.physical_trades = [{
@@ -854,6 +1811,8 @@ with st.sidebar:
                 'status': 'Open',
                 'exit_date': ''
             }]
+            get_trade_journal().load_book(st.session_state.physical_trades, st.session_state.hedge_trades)
+            bump_trade_book_version()
             st.rerun()
         elif demo_preset == "Multi-Trade Portfolio":
             st.session_state.physical_trades = [
@@ -920,6 +1879,8 @@ with st.sidebar:
                     'exit_date': ''
                 }
             ]
+            get_trade_journal().load_book(st.session_state.physical_trades, st.session_state.hedge_trades)
+            bump_trade_book_version()
             st.rerun()
         else:
             st.warning("Please select a demo scenario first.")
@@ -928,7 +1889,7 @@ with st.sidebar:
     st.markdown("### Data Import/Export")
 
     # Export to Excel
-    if st.session_state.physical_trades or st.session_state.hedge_trades or st.session_state.market_prices:
+    if st.session_state.physical_trades or st.session_state.hedge_trades or get_market_price_set() is not None:
         export_buffer = io.BytesIO()
         with pd.ExcelWriter(export_buffer, engine='openpyxl') as writer:
             # Physical trades
@@ -942,8 +1903,8 @@ with st.sidebar:
                     writer, sheet_name='Hedge_Trades', index=False
                 )
             # Market prices
-            if st.session_state.market_prices:
-                pd.DataFrame(st.session_state.market_prices).to_excel(
+            if get_market_price_set() is not None:
+                market_prices_for_export().to_excel(
                     writer, sheet_name='Market_Prices', index=False
                 )
             # Metadata
@@ -966,6 +1927,27 @@ with st.sidebar:
     else:
         st.info("No data to export")
 
+    # Binary session snapshot: faster and smaller than Excel, and keeps dtypes
+    if st.session_state.physical_trades or st.session_state.hedge_trades or get_market_price_set() is not None:
+        st.download_button(
+            label="Save Session Snapshot",
+            data=session_snapshot_bytes(),
+            file_name=f"session_{datetime.now().strftime('%Y%m%d_%H%M')}.{SNAPSHOT_EXTENSION}",
+            mime="application/octet-stream",
+            help="Trades, hedges, prices, FX rates and cargo details in one compressed, checksummed file"
+        )
+    snapshot_file = st.file_uploader(
+        "Restore Session Snapshot",
+        type=[SNAPSHOT_EXTENSION],
+        key='session_snapshot_file'
+    )
+    if snapshot_file is not None and st.button("Confirm Restore"):
+        try:
+            restore_session_snapshot(snapshot_file.getvalue())
+            st.rerun()
+        except SnapshotError as err:
+            st.error(f"Restore failed: {err}")
+
     # Import from Excel
     uploaded_data = st.file_uploader(
         "Import Data (Excel)",
@@ -978,27 +1960,59 @@ with st.sidebar:
         if st.button("Confirm Import"):
             try:
                 excel_data = pd.ExcelFile(io.BytesIO(uploaded_data.getvalue()))
+                rejections = []
 
-                # Import physical trades
+                # Import physical trades; rows failing the schema are reported, not loaded
                 if 'Physical_Trades' in excel_data.sheet_names:
                     df_physical = pd.read_excel(excel_data, sheet_name='Physical_Trades')
-                    st.session_state.physical_trades = df_physical.to_dict(orient='records')
+                    st.session_state.physical_trades, rejected = validate_trade_sheet(
+                        df_physical, PHYSICAL_TRADE_SCHEMA, 'Physical_Trades', {
+                            'product_name': st.session_state.get('selected_product_name', ''),
+                            'product_category': st.session_state.get('selected_product_category', '')
+                        })
+                    rejections.append(rejected)
 
                 # Import hedge trades
                 if 'Hedge_Trades' in excel_data.sheet_names:
                     df_hedge = pd.read_excel(excel_data, sheet_name='Hedge_Trades')
-                    st.session_state.hedge_trades = df_hedge.to_dict(orient='records')
+                    st.session_state.hedge_trades, rejected = validate_trade_sheet(df_hedge, HEDGE_TRADE_SCHEMA, 'Hedge_Trades')
+                    rejections.append(rejected)
+
+                rejections = pd.concat(rejections, ignore_index=True) if rejections else pd.DataFrame()
+                st.session_state.import_rejections = rejections if not rejections.empty else None
 
                 # Import market prices
                 if 'Market_Prices' in excel_data.sheet_names:
                     df_market = pd.read_excel(excel_data, sheet_name='Market_Prices')
-                    st.session_state.market_prices = df_market.to_dict(orient='records')
+                    save_market_price_df(df_market)
+                    forget_applied_upload('price')
 
+                get_trade_journal().load_book(st.session_state.physical_trades, st.session_state.hedge_trades)
+                bump_trade_book_version()
                 st.success("Data imported successfully!")
                 st.rerun()
             except Exception as e:
                 st.error(f"Import failed: {str(e)}")
 
+    import_rejections = st.session_state.get('import_rejections')
+    if import_rejections is not None:
+        rejected_rows = import_rejections[['Sheet', 'Row']].drop_duplicates()
+        st.warning(f"{len(rejected_rows)} imported row(s) were rejected ({len(import_rejections)} error(s)) and not loaded")
+        st.dataframe(import_rejections.head(20), hide_index=True, width='stretch')
+        st.download_button(
+            label="Download Rejection Report",
+            data=import_rejections.to_csv(index=False).encode('utf-8'),
+            file_name="import_rejections.csv",
+            mime="text/csv"
+        )
+        if st.button("Dismiss Rejections"):
+            st.session_state.import_rejections = None
+            st.rerun()
+
+    st.markdown("---")
+    # filled in at the end of the run so the counters include this rerun
+    diagnostics_panel = st.expander("Diagnostics", expanded=False)
+
 product_name = st.session_state.get("selected_product_name", "Custom Product")
 
 # Main interface - Tabs
@@ -1052,6 +2066,26 @@ with tab1:
                     buy_price = st.number_input("Buy Price ($/BBL)", value=0.0, step=0.01)
                 with col4:
                     buy_premium_discount = st.number_input("Premium/Discount ($/BBL)", value=0.0, step=0.01, key="buy_premium_discount_input", help="Use positive for premium, negative for discount")
+
+                col0, col1, col2, col3 = st.columns(4)
+                with col0:
+                    buy_currency = st.selectbox(
+                        "Buy Currency",
+                        TRADE_CURRENCIES,
+                        key="buy_currency_input",
+                        help="Currency of the buy price and premium; converted to USD at the FX fixing for valuation"
+                    )
+                with col1:
+                    buy_pricing_basis = st.selectbox(
+                        "Pricing Basis",
+                        ["Fixed price", "Window average"],
+                        key="buy_pricing_basis",
+                        help="Window average prices the lot on the average of stored market prints over the window; Buy Price is then provisional"
+                    )
+                with col2:
+                    buy_window_start = st.date_input("Pricing Window Start", value=buy_date, key="buy_window_start")
+                with col3:
+                    buy_window_end = st.date_input("Pricing Window End", value=buy_date, key="buy_window_end")
                 
                 st.markdown("**Hedge Position Entry (Optional)**")
                 col1, col2, col3, col4 = st.columns(4)
@@ -1059,7 +2093,7 @@ with tab1:
                 with col1:
                     hedge_contract = st.selectbox(
                         "Contract Type",
-                        ["None", "GASOIL Mo1", "GASOIL Mo2", "GASOIL Mo3", "Others"],
+                        ["None"] + HEDGE_CONTRACTS + ["Others"],
                         key="buy_hedge_contract"
                     )
                 with col2:
@@ -1094,6 +2128,8 @@ with tab1:
                             st.error("Adjust the purchase date range in the sidebar before saving.")
                         elif not (purchase_start <= buy_date <= purchase_end):
                             st.error("Purchase date must fall within the selected start and end dates.")
+                        elif buy_pricing_basis == "Window average" and buy_window_end < buy_window_start:
+                            st.error("Pricing window end must not be before its start.")
                         elif buy_quantity != 0:
                             # Add physical trade record (incomplete - no sale price yet)
                             new_trade = {
@@ -1104,10 +2140,21 @@ with tab1:
                                 'sale_price': 0.0,  # To be filled in sell operation
                                 'sale_premium_discount': 0.0,
                                 'sale_date': '',
+                                'buy_pricing_start': '',
+                                'buy_pricing_end': '',
+                                'buy_currency': buy_currency,
+                                'sale_currency': buy_currency,
                                 'product_name': st.session_state.get('selected_product_name', ''),
                                 'product_category': st.session_state.get('selected_product_category', '')
                             }
+                            if buy_pricing_basis == "Window average":
+                                new_trade['buy_pricing_start'] = buy_window_start.strftime('%Y-%m-%d')
+                                new_trade['buy_pricing_end'] = buy_window_end.strftime('%Y-%m-%d')
+                                new_trade.update(pricing_window_settlement(new_trade, get_valuation_price_set(daily=True)) or {})
+                            open_positions = get_open_positions()
                             st.session_state.physical_trades.append(new_trade)
+                            open_positions.add_lot(len(st.session_state.physical_trades) - 1, new_trade)
+                            get_trade_journal().add_lot(new_trade)
                             
                             # Add hedge record if specified
                             if hedge_contract != "None" and hedge_volume != 0:
@@ -1118,10 +2165,14 @@ with tab1:
                                     'exit_price': 0.0,  # To be filled in sell operation
                                     'trade_date': hedge_trade_date.strftime('%Y-%m-%d'),
                                     'status': 'Open',
-                                    'exit_date': ''
+                                    'exit_date': '',
+                                    'currency': BASE_CURRENCY
                                 }
                                 st.session_state.hedge_trades.append(new_hedge)
+                                open_positions.add_hedge(len(st.session_state.hedge_trades) - 1, new_hedge)
+                                get_trade_journal().add_hedge(new_hedge)
                             
+                            open_positions.version = bump_trade_book_version()
                             st.session_state.show_buy_form = False
                             st.success("Buy operation added!")
                             st.rerun()
@@ -1135,8 +2186,9 @@ with tab1:
         st.markdown('</div>', unsafe_allow_html=True)
         
         # 🔧 优化：显示pending operations with related hedge information
-        incomplete_trades = [trade for trade in st.session_state.physical_trades if trade['sale_price'] == 0.0]
-        open_hedges = [hedge for hedge in st.session_state.hedge_trades if hedge['status'] == 'Open']
+        open_positions = get_open_positions()
+        incomplete_trades = [trade for _, trade in open_positions.open_lots]
+        open_hedges = [hedge for _, hedge in open_positions.open_hedges]
         
         if incomplete_trades or open_hedges:
             st.markdown("### Current Pending Operations")
@@ -1199,9 +2251,9 @@ with tab1:
             # Summary section
             if incomplete_trades and open_hedges:
                 st.markdown("#### Operations Summary")
-                total_physical_volume = sum(trade['quantity'] for trade in incomplete_trades)
-                total_hedge_volume = sum(abs(hedge['volume']) for hedge in open_hedges)
-                hedge_ratio = (total_hedge_volume / total_physical_volume * 100) if total_physical_volume > 0 else 0
+                total_physical_volume = open_positions.pending_volume
+                total_hedge_volume = open_positions.open_hedge_volume
+                hedge_ratio = open_positions.hedge_ratio
                 
                 col1, col2, col3, col4 = st.columns(4)
                 with col1:
@@ -1216,6 +2268,9 @@ with tab1:
         #st.markdown('<div class="input-section">', unsafe_allow_html=True)
         st.markdown("### Sell & Hedge Exit")
         st.markdown("*Complete the trading cycle by selling physical oil and closing hedge positions*")
+        sale_notice = st.session_state.pop('sale_notice', None)
+        if sale_notice:
+            st.warning(sale_notice)
         
         col1, col2 = st.columns([3, 1])
         with col1:
@@ -1226,17 +2281,31 @@ with tab1:
         
         # Add sell operation form
         if st.session_state.get('show_sell_form', False):
+            hedge_matches = get_hedge_matches()
+            suggested_hedges = dict(zip(hedge_matches['matches']['Lot'], hedge_matches['matches']['Hedge']))
+            if suggested_hedges:
+                with st.expander(f"Suggested Hedge Matches ({len(suggested_hedges)})", expanded=False):
+                    st.caption(
+                        "Pairs pending lots with open hedges to minimise volume mismatch and the gap between "
+                        "purchase and hedge trade dates. Suggested hedges are marked in the Sell form."
+                    )
+                    suggestion_display = hedge_matches['matches'].copy()
+                    suggestion_display['Lot'] = suggestion_display['Lot'].map(lot_ref)
+                    suggestion_display['Hedge'] = suggestion_display['Hedge'].map(hedge_ref)
+                    st.dataframe(suggestion_display, hide_index=True, width='stretch')
+                    if hedge_matches['method'] == 'greedy':
+                        st.caption("scipy is not installed: suggestions use a greedy approximation.")
             with st.form("sell_operation_form"):
                 st.markdown("**Physical Oil Sale**")
                 
                 # Show available incomplete trades
-                incomplete_trades = [(i, trade) for i, trade in enumerate(st.session_state.physical_trades) if trade['sale_price'] == 0.0]
+                open_positions = get_open_positions()
+                incomplete_trades = open_positions.open_lots
                 sale_price = 0.0
                 sale_premium_discount = 0.0
                 sale_date = datetime.now().date()
                 if incomplete_trades:
-                    trade_options = [f"Trade {i}: {trade['date']} - {trade['quantity']:,.0f} MT at ${trade['buy_price']:.2f}" 
-                                   for i, trade in incomplete_trades]
+                    trade_options = [label for _, label in open_positions.lot_options]
                     selected_trade_idx = st.selectbox("Select Trade to Complete", range(len(trade_options)), 
                                                      format_func=lambda x: trade_options[x])
                     selected_trade_original_idx = incomplete_trades[selected_trade_idx][0]
@@ -1245,29 +2314,47 @@ with tab1:
                     buy_premium_value = selected_trade.get('buy_premium_discount', 0.0)
                     default_sale_premium = selected_trade.get('sale_premium_discount', 0.0)
                     net_buy_price = selected_trade['buy_price'] + buy_premium_value
+                    buy_currency = selected_trade.get('buy_currency') or BASE_CURRENCY
 
                     col1, col2, col3 = st.columns(3)
                     with col1:
                         sale_date = st.date_input("Sale Date", value=sale_date)
                         st.write(f"Quantity: {selected_trade['quantity']:,.0f} MT")
-                        st.write(f"Buy Price: ${selected_trade['buy_price']:.2f}/BBL")
-                        st.write(f"Buy Premium/Discount: ${buy_premium_value:.2f}/BBL")
-                        st.write(f"Net Buy Price: ${net_buy_price:.2f}/BBL")
+                        st.write(f"Buy Price: {format_amount(selected_trade['buy_price'], buy_currency)}/BBL")
+                        st.write(f"Buy Premium/Discount: {format_amount(buy_premium_value, buy_currency)}/BBL")
+                        st.write(f"Net Buy Price: {format_amount(net_buy_price, buy_currency)}/BBL")
                     with col2:
-                        sale_price = st.number_input("Sale Price ($/BBL)", value=0.0, step=0.01)
+                        sale_price = st.number_input("Sale Price (/BBL)", value=0.0, step=0.01)
+                        sale_currency = st.selectbox(
+                            "Sale Currency",
+                            TRADE_CURRENCIES,
+                            index=TRADE_CURRENCIES.index(buy_currency) if buy_currency in TRADE_CURRENCIES else 0,
+                            key="sale_currency_input"
+                        )
                     with col3:
                         sale_premium_discount = st.number_input(
-                            "Sale Premium/Discount ($/BBL)",
+                            "Sale Premium/Discount (/BBL)",
                             value=default_sale_premium,
                             step=0.01,
                             key="sale_premium_discount_input",
                             help="Use positive for premium, negative for discount"
                         )
                         net_sale_price = sale_price + sale_premium_discount
-                        st.write(f"Net Sale Price: ${net_sale_price:.2f}/BBL")
+                        st.write(f"Net Sale Price: {format_amount(net_sale_price, sale_currency)}/BBL")
+
+                    window_status = pricing_window_status(selected_trade, get_valuation_price_set(daily=True))
+                    if window_status is not None and (window_status[0] is None or window_status[2] > 0):
+                        _, priced_days, pending_days = window_status
+                        st.warning(
+                            f"Pricing window {priced_days}/{priced_days + pending_days} days priced: the sale realizes at "
+                            "the provisional Buy Price and the lot is flagged until its window settles."
+                        )
 
-                    estimated_pnl = (net_sale_price - net_buy_price) * selected_trade['quantity']
-                    st.write(f"Estimated P&L: ${estimated_pnl:,.2f}")
+                    if sale_currency == buy_currency:
+                        estimated_pnl = (net_sale_price - net_buy_price) * selected_trade['quantity']
+                        st.write(f"Estimated P&L: {format_amount(estimated_pnl, buy_currency)}")
+                    else:
+                        st.write("Estimated P&L: converted to USD at each leg's FX fixing in P&L Analysis")
 
                 else:
                     st.warning("No pending buy operations to complete. Please add a buy operation first.")
@@ -1275,7 +2362,7 @@ with tab1:
                 
                 # Hedge exit section
                 st.markdown("**Hedge Position Exit (Optional)**")
-                open_hedges = [(i, hedge) for i, hedge in enumerate(st.session_state.hedge_trades) if hedge['status'] == 'Open']
+                open_hedges = open_positions.open_hedges
                 
                 # Initialize variables
                 selected_hedge_original_idx = None
@@ -1284,21 +2371,17 @@ with tab1:
                 hedge_exit_date = None
                 
                 if open_hedges:
-                    # 🔧 修复：正确解构open_hedges元组
-                    hedge_options = []
-                    for orig_idx, hedge in open_hedges:
-                        trade_date = hedge.get('trade_date', '-')
-                        expiry_value = hedge.get('expiry')
-                        label = (
-                            f"ID {orig_idx+1}: {hedge['contract']} | {hedge['volume']:,.0f} MT | "
-                            f"Entry: ${hedge['entry_price']:.2f} | Trade: {trade_date}"
-                        )
-                        if expiry_value:
-                            label += f" | Exp: {expiry_value}"
-                        hedge_options.append(label)
+                    hedge_lots = {hedge: lot for lot, hedge in suggested_hedges.items()}
+                    hedge_options = [
+                        label + (f" (suggested for {lot_ref(hedge_lots[position])})" if position in hedge_lots else "")
+                        for position, label in open_positions.hedge_options
+                    ]
                     hedge_options.insert(0, "None - Don't close any hedge")
                     selected_hedge_idx = st.selectbox("Select Hedge to Close", range(len(hedge_options)), 
                                                     format_func=lambda x: hedge_options[x])
+                    if selected_trade_original_idx in suggested_hedges:
+                        st.caption(f"Suggested hedge for {lot_ref(selected_trade_original_idx)}: "
+                                   f"{hedge_ref(suggested_hedges[selected_trade_original_idx])}")
                     
                     if selected_hedge_idx > 0:  # Not "None"
                         selected_hedge_original_idx = open_hedges[selected_hedge_idx - 1][0]
@@ -1315,7 +2398,7 @@ with tab1:
                             st.info(f"""
                             **Contract:** {selected_hedge['contract']}  
                             **Volume:** {selected_hedge['volume']:,.0f} MT  
-                            **Entry Price:** ${selected_hedge['entry_price']:.2f}/BBL  
+                            **Entry Price:** {format_amount(selected_hedge['entry_price'], selected_hedge.get('currency') or BASE_CURRENCY)}/BBL  
                             **Trade Date:** {selected_hedge.get('trade_date', 'N/A')}
                             **Expiry:** {selected_hedge.get('expiry', 'N/A')}
                             """)
@@ -1323,9 +2406,10 @@ with tab1:
                         with col2:
                             st.markdown("**Exit Price Input:**")
                             # 🔧 修复：不使用自动默认值，要求用户主动输入
-                            st.write(f"**Reference Entry Price:** ${selected_hedge['entry_price']:.2f}/BBL")
+                            hedge_currency = selected_hedge.get('currency') or BASE_CURRENCY
+                            st.write(f"**Reference Entry Price:** {format_amount(selected_hedge['entry_price'], hedge_currency)}/BBL")
                             hedge_exit_price = st.number_input(
-                                "Exit Price ($/BBL)", 
+                                "Exit Price (/BBL)", 
                                 value=0.0,  # 修复：使用0.0强制用户输入实际退出价格
                                 step=0.01, 
                                 key="hedge_exit",
@@ -1346,11 +2430,11 @@ with tab1:
                             
                             # 🔧 优化：使用颜色编码显示盈亏
                             if hedge_pnl > 0:
-                                st.success(f"**Projected Profit:** ${hedge_pnl:,.2f}")
+                                st.success(f"**Projected Profit:** {format_amount(hedge_pnl, hedge_currency)}")
                             elif hedge_pnl < 0:
-                                st.error(f"**Projected Loss:** ${hedge_pnl:,.2f}")
+                                st.error(f"**Projected Loss:** {format_amount(hedge_pnl, hedge_currency)}")
                             else:
-                                st.info(f"**Break Even:** ${hedge_pnl:,.2f}")
+                                st.info(f"**Break Even:** {format_amount(hedge_pnl, hedge_currency)}")
                             
                             st.write(f"**Hedge Type:** {hedge_type}")
                             
@@ -1358,19 +2442,25 @@ with tab1:
                         st.markdown("---")
                         st.markdown("### Combined Operation Preview")
                         
-                        # 计算individual P&Ls
+                        # 计算individual P&Ls: each leg converted at its own date's fixing, as in calculate_pnl
                         physical_pnl_preview = 0
                         hedge_pnl_preview = 0
+                        preview_currency, preview_rate = realized_reporting_rate()
                         
                         if incomplete_trades and selected_trade_original_idx is not None and (sale_price > 0 or sale_premium_discount != 0):
                             selected_trade = incomplete_trades[selected_trade_idx][1]
-                            buy_premium_preview = selected_trade.get('buy_premium_discount', 0.0)
-                            net_sale_preview = sale_price + sale_premium_discount
-                            net_buy_preview = selected_trade['buy_price'] + buy_premium_preview
-                            physical_pnl_preview = (net_sale_preview - net_buy_preview) * selected_trade['quantity']
+                            previewed_sale = dict(
+                                selected_trade, sale_price=sale_price, sale_premium_discount=sale_premium_discount,
+                                sale_currency=sale_currency, sale_date=sale_date.strftime('%Y-%m-%d')
+                            )
+                            physical_pnl_preview = physical_usd_legs([previewed_sale])['pnl_usd'].iloc[0] / preview_rate
                         
                         if hedge_exit_price > 0:
-                            hedge_pnl_preview = (hedge_exit_price - selected_hedge['entry_price']) * selected_hedge['volume']
+                            previewed_exit = dict(
+                                selected_hedge, exit_price=hedge_exit_price,
+                                exit_date=(hedge_exit_date or sale_date).strftime('%Y-%m-%d')
+                            )
+                            hedge_pnl_preview = hedge_usd_pnl([previewed_exit])[0] / preview_rate
                         
                         combined_pnl = physical_pnl_preview + hedge_pnl_preview
                         
@@ -1378,22 +2468,19 @@ with tab1:
                         col1, col2, col3 = st.columns(3)
                         with col1:
                             if physical_pnl_preview != 0:
-                                color = "🟢" if physical_pnl_preview > 0 else "🔴"
-                                st.metric("Physical P&L", f"${physical_pnl_preview:,.2f}", delta=None)
+                                st.metric("Physical P&L", format_pnl_cell(physical_pnl_preview, preview_currency), delta=None)
                             else:
                                 st.metric("Physical P&L", "Not calculated", delta=None)
                         
                         with col2:
                             if hedge_pnl_preview != 0:
-                                color = "🟢" if hedge_pnl_preview > 0 else "🔴"
-                                st.metric("Hedge P&L", f"${hedge_pnl_preview:,.2f}", delta=None)
+                                st.metric("Hedge P&L", format_pnl_cell(hedge_pnl_preview, preview_currency), delta=None)
                             else:
                                 st.metric("Hedge P&L", "Not calculated", delta=None)
                         
                         with col3:
                             if physical_pnl_preview != 0 or hedge_pnl_preview != 0:
-                                color = "🟢" if combined_pnl > 0 else "🔴"
-                                st.metric("Combined P&L", f"${combined_pnl:,.2f}", delta=None)
+                                st.metric("Combined P&L", format_pnl_cell(combined_pnl, preview_currency), delta=None)
                             else:
                                 st.metric("Combined P&L", "Enter prices", delta=None)
                         
@@ -1434,20 +2521,39 @@ with tab1:
                             operation_completed = []
                             
                             # Complete physical trade if available
+                            # the journal records each change; the session book is rebuilt from it below
                             if has_physical_to_complete:
-                                st.session_state.physical_trades[selected_trade_original_idx]['sale_price'] = sale_price
-                                st.session_state.physical_trades[selected_trade_original_idx]['sale_premium_discount'] = sale_premium_discount
-                                st.session_state.physical_trades[selected_trade_original_idx]['sale_date'] = sale_date.strftime('%Y-%m-%d')
+                                sold_trade = st.session_state.physical_trades[selected_trade_original_idx]
+                                sale_changes = {
+                                    'sale_price': sale_price,
+                                    'sale_premium_discount': sale_premium_discount,
+                                    'sale_currency': sale_currency,
+                                    'sale_date': sale_date.strftime('%Y-%m-%d')
+                                }
+                                settlement = pricing_window_settlement(sold_trade, get_valuation_price_set(daily=True))
+                                if settlement:
+                                    sale_changes.update(settlement)
+                                elif has_pricing_window(sold_trade):
+                                    # realized at a placeholder: flag it until the window prints in full
+                                    sale_changes['buy_price_provisional'] = True
+                                    st.session_state.sale_notice = (
+                                        f"{lot_ref(selected_trade_original_idx)} was sold before its pricing window settled: "
+                                        "its realized P&L uses the provisional Buy Price."
+                                    )
+                                get_trade_journal().update_lot(selected_trade_original_idx, sale_changes)
                                 operation_completed.append("Physical sale")
                             
                             # Close hedge if selected
                             if has_hedge_to_close:
                                 exit_date_value = hedge_exit_date if hedge_exit_date else sale_date
-                                st.session_state.hedge_trades[selected_hedge_original_idx]['exit_price'] = hedge_exit_price
-                                st.session_state.hedge_trades[selected_hedge_original_idx]['exit_date'] = exit_date_value.strftime('%Y-%m-%d')
-                                st.session_state.hedge_trades[selected_hedge_original_idx]['status'] = 'Closed'
+                                get_trade_journal().update_hedge(selected_hedge_original_idx, {
+                                    'exit_price': hedge_exit_price,
+                                    'exit_date': exit_date_value.strftime('%Y-%m-%d'),
+                                    'status': 'Closed'
+                                })
                                 operation_completed.append("Hedge position closed")
                             
+                            restore_journal_book()
                             st.session_state.show_sell_form = False
                             success_msg = " and ".join(operation_completed) + " completed!"
                             st.success(success_msg)
@@ -1476,6 +2582,9 @@ with tab2:
         st.session_state.physical_trades,
         st.session_state.hedge_trades
     )
+    # realized amounts are USD; shown in the reporting currency at its latest fixing
+    realized_currency, realized_rate = realized_reporting_rate()
+    physical_pnl, hedge_pnl, net_pnl = (amount / realized_rate for amount in (physical_pnl, hedge_pnl, net_pnl))
     
     # Display key metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -1497,7 +2606,7 @@ with tab2:
         st.markdown(f"""
         <div class="metric-card">
             <h4>Physical P&L</h4>
-            <h3 class="{color_class}">${physical_pnl:,.2f}</h3>
+            <h3 class="{color_class}">{format_amount(physical_pnl, realized_currency)}</h3>
         </div>
         """, unsafe_allow_html=True)
     
@@ -1506,7 +2615,7 @@ with tab2:
         st.markdown(f"""
         <div class="metric-card">
             <h4>Hedge P&L</h4>
-            <h3 class="{color_class}">${hedge_pnl:,.2f}</h3>
+            <h3 class="{color_class}">{format_amount(hedge_pnl, realized_currency)}</h3>
         </div>
         """, unsafe_allow_html=True)
     
@@ -1515,11 +2624,31 @@ with tab2:
         st.markdown(f"""
         <div class="metric-card">
             <h4>Net P&L</h4>
-            <h3 class="{color_class}">${net_pnl:,.2f}</h3>
+            <h3 class="{color_class}">{format_amount(net_pnl, realized_currency)}</h3>
         </div>
         """, unsafe_allow_html=True)
     
     st.markdown('</div>', unsafe_allow_html=True)
+
+    provisional_lots = provisional_sold_lots(st.session_state.physical_trades)
+    if provisional_lots:
+        st.warning(
+            "Realized at a provisional window buy price: " +
+            ", ".join(lot_ref(position) for position in provisional_lots) +
+            ". Settle them once their pricing windows have prints for every day."
+        )
+        if st.button("Settle Provisional Buy Prices", key="settle_provisional_lots"):
+            daily_price_set = get_valuation_price_set(daily=True)
+            settled_lots = 0
+            for position in provisional_lots:
+                settlement = pricing_window_settlement(st.session_state.physical_trades[position], daily_price_set)
+                if settlement:
+                    get_trade_journal().update_lot(position, settlement)
+                    settled_lots += 1
+            if settled_lots:
+                restore_journal_book()
+                st.rerun()
+            st.info("No pricing window has a full set of prints yet.")
     
     # Detailed analysis
     if st.session_state.physical_trades or st.session_state.hedge_trades:
@@ -1528,23 +2657,19 @@ with tab2:
         col1, col2 = st.columns(2)
         
         with col1:
+            total_quantity = sum(trade.get('quantity', 0) or 0 for trade in st.session_state.physical_trades)
             if st.session_state.physical_trades:
                 st.markdown("**Physical Trading Details**")
-                df_physical = pd.DataFrame(st.session_state.physical_trades)
-                df_physical['buy_premium_discount'] = df_physical.get('buy_premium_discount', 0.0)
-                df_physical['sale_premium_discount'] = df_physical.get('sale_premium_discount', 0.0)
-                total_quantity = df_physical['quantity'].sum()
-                avg_buy_price = (df_physical['buy_price'] * df_physical['quantity']).sum() / total_quantity if total_quantity != 0 else 0
-                avg_sale_price = (df_physical['sale_price'] * df_physical['quantity']).sum() / total_quantity if total_quantity != 0 else 0
-                avg_buy_premium = (df_physical['buy_premium_discount'] * df_physical['quantity']).sum() / total_quantity if total_quantity != 0 else 0
-                avg_sale_premium = (df_physical['sale_premium_discount'] * df_physical['quantity']).sum() / total_quantity if total_quantity != 0 else 0
-                avg_net_buy_price = avg_buy_price + avg_buy_premium
-                avg_net_sale_price = avg_sale_price + avg_sale_premium
+                # each leg in USD at its own date's fixing, then in the reporting currency
+                legs = physical_usd_legs(st.session_state.physical_trades) / realized_rate
+                quantities = pd.Series([trade.get('quantity', 0) or 0 for trade in st.session_state.physical_trades], dtype=float)
+                avg_net_buy_price = (legs['net_buy_usd'] * quantities).sum() / total_quantity if total_quantity != 0 else 0
+                avg_net_sale_price = (legs['net_sale_usd'].fillna(0.0) * quantities).sum() / total_quantity if total_quantity != 0 else 0
 
                 st.write(f"- Total Volume: {total_quantity:,.0f} MT")
-                st.write(f"- Avg Net Buy Price: ${avg_net_buy_price:.2f}/BBL")
-                st.write(f"- Avg Net Sale Price: ${avg_net_sale_price:.2f}/BBL")
-                st.write(f"- Unit Profit (Net): ${avg_net_sale_price - avg_net_buy_price:.2f}/BBL")
+                st.write(f"- Avg Net Buy Price: {format_amount(avg_net_buy_price, realized_currency)}/BBL")
+                st.write(f"- Avg Net Sale Price: {format_amount(avg_net_sale_price, realized_currency)}/BBL")
+                st.write(f"- Unit Profit (Net): {format_amount(avg_net_sale_price - avg_net_buy_price, realized_currency)}/BBL")
 
         
         with col2:
@@ -1560,6 +2685,42 @@ with tab2:
                 st.write(f"- Closed Positions: {closed_positions:,.0f} MT")
                 st.write(f"- Hedge Ratio: {abs(total_hedge_volume/total_quantity)*100:.1f}%" if total_quantity != 0 else "- Hedge Ratio: 0%")
 
+        st.markdown("### Net Exposure Ladder")
+        st.markdown("*Open physical quantity netted against open hedge volume per instrument and delivery month/tenor*")
+        exposure_as_of = st.date_input(
+            "Exposure As Of",
+            value=st.session_state.get('exposure_as_of', datetime.now().date()),
+            key="exposure_as_of_input"
+        )
+        st.session_state.exposure_as_of = exposure_as_of
+        ladder = cached_exposure_ladder(
+            st.session_state.trade_book_version,
+            pd.Timestamp(exposure_as_of),
+            st.session_state.get('selected_product_name', ''),
+            st.session_state.physical_trades,
+            st.session_state.hedge_trades
+        )
+
+        if ladder.empty:
+            st.info(f"No open positions as of {exposure_as_of}.")
+        else:
+            ladder_cols = st.columns(2)
+            with ladder_cols[0]:
+                st.markdown("**By Instrument and Tenor**")
+                st.dataframe(ladder, width='stretch', hide_index=True)
+            with ladder_cols[1]:
+                st.markdown("**Net by Tenor**")
+                tenor_ladder = ladder.groupby('Tenor')[['Physical (MT)', 'Hedge (MT)', 'Net (MT)']].sum().reset_index()
+                st.dataframe(tenor_ladder, width='stretch', hide_index=True)
+
+            unmatched = ladder.groupby('Instrument')['Net (MT)'].sum()
+            unmatched = unmatched[unmatched.abs() > 0]
+            if not unmatched.empty:
+                st.warning(
+                    "Unhedged or mismatched instrument exposure: " +
+                    ", ".join(f"{name} {value:,.0f} MT" for name, value in unmatched.items())
+                )
+
 # Visualization tab
 with tab3:
     st.markdown("### P&L Visualization")
@@ -1596,12 +2757,12 @@ with tab3:
                 x=categories,
                 y=pnl_values,
                 marker_color=colors,
-                text=[f"${x:,.0f}" for x in pnl_values],
+                text=[format_amount(x, realized_currency) for x in pnl_values],
                 textposition='auto'
             )])
             fig_bar.update_layout(
                 title="P&L Comparison Analysis",
-                yaxis_title="P&L ($)",
+                yaxis_title=f"P&L ({currency_symbol(realized_currency)})",
                 height=400
             )
             st.plotly_chart(fig_bar, use_container_width=True)
@@ -1611,20 +2772,24 @@ with tab3:
             st.markdown("### 📅 Trading Time Series")
             df_trades = pd.DataFrame(st.session_state.physical_trades)
             df_trades['date'] = pd.to_datetime(df_trades['date'])
-            df_trades['buy_premium_discount'] = df_trades.get('buy_premium_discount', 0.0)
-            df_trades['sale_premium_discount'] = df_trades.get('sale_premium_discount', 0.0)
-            df_trades['Net Buy Price'] = df_trades['buy_price'] + df_trades['buy_premium_discount']
-            df_trades['Net Sale Price'] = df_trades['sale_price'] + df_trades['sale_premium_discount']
-            df_trades['Cumulative P&L'] = ((df_trades['Net Sale Price'] - df_trades['Net Buy Price']) * df_trades['quantity']).cumsum()
-            
+            # realized P&L as in calculate_pnl: unsold lots add nothing
+            realized = physical_usd_legs(st.session_state.physical_trades)['pnl_usd'].fillna(0.0) / realized_rate
+            df_trades['Cumulative P&L'] = realized.cumsum().to_numpy()
+
+            fx_set = get_fx_rate_set()
+            cumulative = cached_chart_series(
+                f"{st.session_state.trade_book_version}|{fx_set.key if fx_set is not None else ''}|{realized_currency}",
+                'date', ('Cumulative P&L',), CHART_POINT_BUDGET, df_trades[['date', 'Cumulative P&L']]
+            )['Cumulative P&L']
             fig_line = px.line(
-                df_trades,
+                cumulative,
                 x='date',
                 y='Cumulative P&L',
                 title='Cumulative P&L Trend',
-                markers=True
+                markers=len(cumulative) <= CHART_MARKER_POINT_LIMIT,
+                render_mode='webgl' if len(cumulative) > WEBGL_POINT_THRESHOLD else 'svg'
             )
-            fig_line.update_layout(height=400)
+            fig_line.update_layout(height=400, yaxis_title=f"Cumulative P&L ({currency_symbol(realized_currency)})")
             st.plotly_chart(fig_line, use_container_width=True)
     else:
         st.info("Please add trading data to view visualization charts")
@@ -1642,37 +2807,41 @@ with tab4:
             if 'product_name' not in df_trades.columns:
                 df_trades['product_name'] = ''
             
-            # Add calculation columns
+            # Add calculation columns; prices stay in each leg's currency, P&L is converted
             df_trades['buy_premium_discount'] = df_trades.get('buy_premium_discount', 0.0)
             df_trades['sale_premium_discount'] = df_trades.get('sale_premium_discount', 0.0)
+            for currency_column in ('buy_currency', 'sale_currency'):
+                currencies = df_trades.get(currency_column, pd.Series(BASE_CURRENCY, index=df_trades.index))
+                df_trades[currency_column] = currencies.where(currencies.notna() & (currencies != ''), BASE_CURRENCY)
             df_trades['Net Buy Price'] = df_trades['buy_price'] + df_trades['buy_premium_discount']
             df_trades['Net Sale Price'] = df_trades['sale_price'] + df_trades['sale_premium_discount']
-            df_trades['Unit P&L'] = df_trades.apply(
-                lambda row: (row['Net Sale Price'] - row['Net Buy Price']) if row['sale_price'] > 0 else 0.0,
-                axis=1
-            )
-            df_trades['Total P&L'] = df_trades['Unit P&L'] * df_trades['quantity']
+            legs = physical_usd_legs(st.session_state.physical_trades)
+            df_trades['Total P&L'] = np.where(df_trades['sale_price'] > 0, legs['pnl_usd'] / realized_rate, 0.0)
+            df_trades['Unit P&L'] = (df_trades['Total P&L'] / df_trades['quantity'].where(df_trades['quantity'] != 0)).where(df_trades['Total P&L'] != 0, 0.0)
             df_trades['Status'] = df_trades['sale_price'].apply(lambda x: 'Completed' if x > 0 else 'Pending')
-            
+
             # Format display
             df_display = df_trades.copy()
+            pnl_unit = currency_symbol(realized_currency)
             df_display['Quantity (MT)'] = df_display['quantity'].apply(lambda x: f"{x:,.0f}")
-            df_display['Buy Price ($/BBL)'] = df_display['buy_price'].apply(lambda x: f"${x:.2f}")
-            df_display['Buy Premium/Discount ($/BBL)'] = df_display['buy_premium_discount'].apply(lambda x: f"${x:.2f}")
-            df_display['Net Buy Price ($/BBL)'] = df_display['Net Buy Price'].apply(lambda x: f"${x:.2f}")
-            df_display['Sale Price ($/BBL)'] = df_display['sale_price'].apply(lambda x: f"${x:.2f}" if x > 0 else 'Pending')
-            df_display['Sale Premium/Discount ($/BBL)'] = df_display.apply(lambda row: f"${row['sale_premium_discount']:.2f}" if row['sale_price'] > 0 else '-', axis=1)
-            df_display['Net Sale Price ($/BBL)'] = df_display.apply(lambda row: f"${row['Net Sale Price']:.2f}" if row['sale_price'] > 0 else 'Pending', axis=1)
-            df_display['Unit P&L ($/BBL)'] = df_display['Unit P&L'].apply(lambda x: f"${x:.2f}" if x != 0 else '-')
-            df_display['Total P&L ($)'] = df_display['Total P&L'].apply(lambda x: f"${x:,.2f}" if x != 0 else '-')
-            
+            df_display['Buy Price (/BBL)'] = df_display.apply(lambda row: format_amount(row['buy_price'], row['buy_currency']), axis=1)
+            df_display['Buy Premium/Discount (/BBL)'] = df_display.apply(lambda row: format_amount(row['buy_premium_discount'], row['buy_currency']), axis=1)
+            df_display['Net Buy Price (/BBL)'] = df_display.apply(lambda row: format_amount(row['Net Buy Price'], row['buy_currency']), axis=1)
+            df_display['Sale Price (/BBL)'] = df_display.apply(lambda row: format_amount(row['sale_price'], row['sale_currency']) if row['sale_price'] > 0 else 'Pending', axis=1)
+            df_display['Sale Premium/Discount (/BBL)'] = df_display.apply(lambda row: format_amount(row['sale_premium_discount'], row['sale_currency']) if row['sale_price'] > 0 else '-', axis=1)
+            df_display['Net Sale Price (/BBL)'] = df_display.apply(lambda row: format_amount(row['Net Sale Price'], row['sale_currency']) if row['sale_price'] > 0 else 'Pending', axis=1)
+            df_display[f'Unit P&L ({pnl_unit}/BBL)'] = df_display['Unit P&L'].apply(format_pnl_cell, currency=realized_currency)
+            df_display[f'Total P&L ({pnl_unit})'] = df_display['Total P&L'].apply(format_pnl_cell, currency=realized_currency)
+
             st.dataframe(
-                df_display[['date', 'product_name', 'Quantity (MT)', 'Buy Price ($/BBL)', 'Buy Premium/Discount ($/BBL)', 'Net Buy Price ($/BBL)', 'Sale Price ($/BBL)', 'Sale Premium/Discount ($/BBL)', 'Net Sale Price ($/BBL)', 'Unit P&L ($/BBL)', 'Total P&L ($)', 'Status']].rename(columns={'product_name': 'Product'}),
+                df_display[['date', 'product_name', 'Quantity (MT)', 'Buy Price (/BBL)', 'Buy Premium/Discount (/BBL)', 'Net Buy Price (/BBL)', 'Sale Price (/BBL)', 'Sale Premium/Discount (/BBL)', 'Net Sale Price (/BBL)', f'Unit P&L ({pnl_unit}/BBL)', f'Total P&L ({pnl_unit})', 'Status']].rename(columns={'product_name': 'Product'}),
                 width='stretch'
             )
             
             if st.button("Clear Physical Records", key="clear_physical_records"):
                 st.session_state.physical_trades = []
+                get_trade_journal().clear(lots=True, hedges=False)
+                bump_trade_book_version()
                 st.rerun()
         else:
             st.info("No physical trading records yet.")
@@ -1682,14 +2851,18 @@ with tab4:
         if st.session_state.hedge_trades:
             df_hedges = pd.DataFrame(st.session_state.hedge_trades)
             
-            # Add calculation columns
-            df_hedges['Unit P&L'] = df_hedges['exit_price'] - df_hedges['entry_price']
-            df_hedges['Total P&L'] = df_hedges['Unit P&L'] * df_hedges['volume']
-            
+            currencies = df_hedges.get('currency', pd.Series(BASE_CURRENCY, index=df_hedges.index))
+            df_hedges['currency'] = currencies.where(currencies.notna() & (currencies != ''), BASE_CURRENCY)
+
+            # Add calculation columns; prices stay in the hedge currency, P&L is converted
+            df_hedges['Total P&L'] = hedge_usd_pnl(st.session_state.hedge_trades) / realized_rate
+            df_hedges['Unit P&L'] = (df_hedges['Total P&L'] / df_hedges['volume'].where(df_hedges['volume'] != 0)).where(df_hedges['Total P&L'] != 0, 0.0)
+
             # Format display
             df_display = df_hedges.copy()
+            pnl_unit = currency_symbol(realized_currency)
             df_display['Volume (MT)'] = df_display['volume'].apply(lambda x: f"{x:,.0f}")
-            df_display['Entry Price ($/BBL)'] = df_display['entry_price'].apply(lambda x: f"${x:.2f}")
+            df_display['Entry Price (/BBL)'] = df_display.apply(lambda row: format_amount(row['entry_price'], row['currency']), axis=1)
 
             if 'trade_date' in df_display.columns:
                 df_display['Trade Date'] = df_display['trade_date']
@@ -1698,29 +2871,94 @@ with tab4:
 
             # Improved Exit Price display logic - use status as primary indicator
             def format_exit_price(row):
+                exit_price = format_amount(row['exit_price'], row['currency'])
                 if row.get('status', 'Open') == 'Closed' and row['exit_price'] > 0:
-                    return f"${row['exit_price']:.2f}"
+                    return exit_price
                 elif row.get('status', 'Open') == 'Open':
-                    return "Open" if row['exit_price'] == 0 else f"${row['exit_price']:.2f}"
+                    return "Open" if row['exit_price'] == 0 else exit_price
                 else:
                     # Handle inconsistent data
-                    return f"${row['exit_price']:.2f}" if row['exit_price'] > 0 else "Pending"
+                    return exit_price if row['exit_price'] > 0 else "Pending"
 
-            df_display['Exit Price ($/BBL)'] = df_hedges.apply(format_exit_price, axis=1)
-            df_display['Unit P&L ($/BBL)'] = df_display['Unit P&L'].apply(lambda x: f"${x:.2f}" if x != 0 else "-")
-            df_display['Total P&L ($)'] = df_display['Total P&L'].apply(lambda x: f"${x:,.2f}" if x != 0 else "-")
+            df_display['Exit Price (/BBL)'] = df_hedges.apply(format_exit_price, axis=1)
+            df_display[f'Unit P&L ({pnl_unit}/BBL)'] = df_display['Unit P&L'].apply(format_pnl_cell, currency=realized_currency)
+            df_display[f'Total P&L ({pnl_unit})'] = df_display['Total P&L'].apply(format_pnl_cell, currency=realized_currency)
 
             st.dataframe(
-                df_display[['contract', 'Trade Date', 'Volume (MT)', 'Entry Price ($/BBL)', 'Exit Price ($/BBL)', 'Unit P&L ($/BBL)', 'Total P&L ($)', 'status']],
+                df_display[['contract', 'Trade Date', 'Volume (MT)', 'Entry Price (/BBL)', 'Exit Price (/BBL)', f'Unit P&L ({pnl_unit}/BBL)', f'Total P&L ({pnl_unit})', 'status']],
                 width='stretch'
             )
             
             if st.button("Clear Hedge Records", key="clear_hedge_records"):
                 st.session_state.hedge_trades = []
+                get_trade_journal().clear(lots=False, hedges=True)
+                bump_trade_book_version()
                 st.rerun()
         else:
             st.info("No hedge trading records yet.")
 
+    with st.expander("Trade Journal", expanded=False):
+        trade_journal = get_trade_journal()
+        st.caption(f"{len(trade_journal):,} events recorded. Undo appends a reversing event; nothing is deleted.")
+        if st.button("Undo Last Change", key="undo_trade_event", disabled=not trade_journal.can_undo):
+            trade_journal.undo()
+            restore_journal_book()
+            st.rerun()
+        st.dataframe(trade_journal.history(limit=200), width='stretch', hide_index=True)
+
+        if st.session_state.physical_trades or st.session_state.hedge_trades:
+            st.markdown("**Correct a Trade**")
+            st.caption("Corrections are recorded as of now; MTM can still value the book as known before them.")
+            correction_side = st.radio("Record", ["Physical", "Hedge"], horizontal=True, key="correction_side")
+            if correction_side == "Physical":
+                records = st.session_state.physical_trades
+                labels = [f"{lot_ref(position)}: {trade.get('date', '')} {trade.get('quantity', 0):,.0f} MT" for position, trade in enumerate(records)]
+                fields = [('date', 'Purchase Date'), ('quantity', 'Quantity (MT)'), ('buy_price', 'Buy Price'), ('buy_premium_discount', 'Premium/Discount')]
+            else:
+                records = st.session_state.hedge_trades
+                labels = [f"{hedge_ref(position)}: {hedge.get('contract', '')} {hedge.get('volume', 0):,.0f} MT" for position, hedge in enumerate(records)]
+                fields = [('trade_date', 'Trade Date'), ('volume', 'Volume (MT)'), ('entry_price', 'Entry Price')]
+            # chosen outside the form so picking another trade reruns and refills the inputs
+            position = st.selectbox("Trade", range(len(records)), format_func=lambda x: labels[x], key="correction_position") if records else None
+            with st.form("trade_correction_form"):
+                if position is not None:
+                    current = records[position]
+                    field_cols = st.columns(len(fields))
+                    corrected = {}
+                    for column, (field, label) in zip(field_cols, fields):
+                        field_key = f"correction_{correction_side.lower()}_{position}_{field}"
+                        with column:
+                            if field in ('date', 'trade_date'):
+                                value = st.date_input(label, value=pd.to_datetime(current.get(field) or datetime.now()).date(), key=field_key)
+                                corrected[field] = value.strftime('%Y-%m-%d')
+                            else:
+                                corrected[field] = st.number_input(label, value=float(current.get(field, 0.0) or 0.0), step=0.01, key=field_key)
+                    if st.form_submit_button("Record Correction"):
+                        changes = {field: value for field, value in corrected.items() if current.get(field) != value}
+                        if changes:
+                            trade_journal.restate([('lot' if correction_side == "Physical" else 'hedge', position, changes)])
+                            restore_journal_book()
+                            st.rerun()
+                        else:
+                            st.info("No fields changed.")
+                else:
+                    st.info(f"No {correction_side.lower()} records to correct.")
+                    st.form_submit_button("Record Correction", disabled=True)
+
+        if len(trade_journal):
+            st.markdown("**Book as Recorded At**")
+            as_of_cols = st.columns(2)
+            with as_of_cols[0]:
+                journal_as_of_date = st.date_input("Date", value=datetime.now().date(), key="journal_as_of_date")
+            with as_of_cols[1]:
+                journal_as_of_time = st.time_input("Time", value=time(23, 59), key="journal_as_of_time")
+            as_of_physical, as_of_hedges = trade_journal.book(as_of=datetime.combine(journal_as_of_date, journal_as_of_time))
+            st.caption(f"{len(as_of_physical)} physical trades and {len(as_of_hedges)} hedges")
+            if as_of_physical:
+                st.dataframe(pd.DataFrame(as_of_physical), width='stretch')
+            if as_of_hedges:
+                st.dataframe(pd.DataFrame(as_of_hedges), width='stretch')
+
 with tab5:
     st.markdown("### Market Prices & MTM Analysis")
     st.markdown("Upload market prices, pick an as-of date, and review mark-to-market P&L for open physical and hedge positions.")
@@ -1753,98 +2991,280 @@ with tab5:
             "Upload Market Prices (Excel)",
             type=["xlsx", "xls"],
             help="Template requires columns: date, instrument, price, optional type.",
-            key='market_price_file'
+            key=f"market_price_file_{st.session_state.get('price_upload_generation', 0)}"
+        )
+        storage_cols = st.columns(2)
+        storage_cols[0].checkbox(
+            "Compact price storage",
+            key='compact_price_storage',
+            on_change=restore_market_prices,
+            help="Store instrument and type as categoricals. Lossless; applies to loaded and future prices."
+        )
+        storage_cols[1].checkbox(
+            "Store prices as float32",
+            key='float32_prices',
+            on_change=restore_market_prices,
+            disabled=not st.session_state.compact_price_storage,
+            help="Halves price memory. Only applied when every price round-trips within 0.0001."
         )
         if uploaded_file is not None:
             try:
                 uploaded_bytes = uploaded_file.getvalue()
-                uploaded_df = pd.read_excel(io.BytesIO(uploaded_bytes))
-                normalized_df = normalize_market_price_df(uploaded_df)
-                save_market_price_df(normalized_df)
-                st.success("Market prices uploaded successfully.")
-                st.session_state.market_price_file = None
+                upload_id = hashlib.sha1(uploaded_bytes).hexdigest()
+                # the uploader keeps its file across reruns; only load it once so later edits stick
+                if st.session_state.get('applied_price_upload') != upload_id:
+                    load_market_price_bytes(uploaded_bytes)
+                    st.session_state.applied_price_upload = upload_id
+                    st.success("Market prices uploaded successfully.")
             except ValueError as err:
                 st.error(f"Template issue: {err}")
             except Exception as exc:
                 st.error(f"Failed to read file: {exc}")
 
-        editor_df = get_market_price_df().drop(columns=['instrument_key'], errors='ignore')
-        if not editor_df.empty and 'instrument' in editor_df.columns:
-            editor_df['instrument'] = editor_df['instrument'].astype(str).fillna('')
-        if editor_df.empty:
-            editor_df = pd.DataFrame({
-                'date': pd.Series(dtype='datetime64[ns]'),
-                'instrument': pd.Series(dtype='string'),
-                'price': pd.Series(dtype='float'),
-                'type': pd.Series(dtype='string')
-            })
+        fx_file = st.file_uploader(
+            "Upload FX Rates (Excel)",
+            type=["xlsx", "xls"],
+            help="Columns: date, pair, rate. 'SGDUSD' quotes USD per SGD; 'USDSGD' (SGD per USD) is inverted.",
+            key=f"fx_rate_file_{st.session_state.get('fx_upload_generation', 0)}"
+        )
+        if fx_file is not None:
+            try:
+                fx_bytes = fx_file.getvalue()
+                fx_upload_id = hashlib.sha1(fx_bytes).hexdigest()
+                if st.session_state.get('applied_fx_upload') != fx_upload_id:
+                    load_fx_rate_bytes(fx_bytes)
+                    st.session_state.applied_fx_upload = fx_upload_id
+                    st.success("FX rates uploaded successfully.")
+            except ValueError as err:
+                st.error(f"Template issue: {err}")
+            except Exception as exc:
+                st.error(f"Failed to read file: {exc}")
+        fx_set = get_fx_rate_set()
+        if fx_set is not None:
+            fx_pairs = sorted(fx_set.frame['instrument'].astype(str).unique())
+            st.caption(f"FX rates: {len(fx_set):,} fixings for {', '.join(fx_pairs)}")
+        missing_currencies = [
+            currency for currency in book_currencies(st.session_state.physical_trades, st.session_state.hedge_trades)
+            if np.isnan(usd_rates(get_fx_index(), currency, [pd.Timestamp.today()])[0])
+        ]
+        if missing_currencies:
+            st.warning("Upload FX rates for: " + ", ".join(missing_currencies) + ". Trades in these currencies are not valued.")
+
+        screened_set = get_market_price_set()
+        if screened_set is not None:
+            quality_exceptions = cached_price_quality(screened_set.key, *get_valuation_calendar(), screened_set.frame)
+            st.markdown("**Data Quality**")
+            if quality_exceptions.empty:
+                st.caption(f"No data-quality exceptions in {len(screened_set):,} prints.")
+            else:
+                check_counts = quality_exceptions['Check'].value_counts()
+                st.warning(
+                    f"{len(quality_exceptions):,} data-quality exception{'s' if len(quality_exceptions) != 1 else ''}: " +
+                    ", ".join(f"{check_counts[check]} {check.lower()}" for check in QUALITY_CHECKS if check in check_counts) +
+                    ". Review them below and correct prices in the editor."
+                )
+                st.dataframe(quality_exceptions, hide_index=True, width='stretch', height=min(400, 38 + 35 * len(quality_exceptions)))
+                st.caption(" · ".join(f"{check}: {description}" for check, description in QUALITY_CHECKS.items()))
+                outlier_rows = quality_exceptions.loc[quality_exceptions['Check'] == 'Outlier', 'Row'].to_numpy()
+                if len(outlier_rows) and st.button(
+                    f"Remove {len(outlier_rows)} Outlier Print{'s' if len(outlier_rows) != 1 else ''}",
+                    key='remove_price_outliers'
+                ):
+                    commit_price_changes(outlier_rows)
+                    st.rerun()
+
+        stored_prices = get_market_price_df()
+        filter_cols = st.columns(2)
+        instrument_options = sorted(stored_prices['instrument'].astype(str).unique().tolist()) if not stored_prices.empty else []
+        editor_instruments = filter_cols[0].multiselect(
+            "Edit Instruments",
+            instrument_options,
+            key='price_editor_instruments',
+            help="Leave empty to edit every instrument."
+        )
+        if stored_prices.empty:
+            latest_price_date = date.today()
+            earliest_price_date = latest_price_date
+        else:
+            latest_price_date = stored_prices['date'].max().date()
+            earliest_price_date = stored_prices['date'].min().date()
+        default_start = max(earliest_price_date, (pd.Timestamp(latest_price_date) - pd.Timedelta(days=PRICE_EDITOR_DEFAULT_DAYS)).date())
+        editor_dates = filter_cols[1].date_input(
+            "Edit Dates",
+            value=(default_start, latest_price_date),
+            key='price_editor_dates'
+        )
+        editor_positions, editor_df = price_editor_frame(stored_prices, editor_instruments, editor_dates)
+        if len(editor_df) < price_editor_match_count(stored_prices, editor_instruments, editor_dates):
+            st.caption(f"Showing the latest {PRICE_EDITOR_MAX_ROWS:,} matching rows; narrow the filters to edit older prices.")
 
         with st.form("market_price_form"):
-            editable_df = st.data_editor(
+            st.data_editor(
                 editor_df,
                 num_rows="dynamic",
                 width='stretch',
                 column_config={
-                    'date': st.column_config.DateColumn("Date"),
+                    'date': (
+                        st.column_config.DatetimeColumn("Timestamp", format="YYYY-MM-DD HH:mm")
+                        if get_market_price_set() is not None and get_market_price_set().intraday
+                        else st.column_config.DateColumn("Date")
+                    ),
                     'instrument': st.column_config.TextColumn("Instrument"),
                     'price': st.column_config.NumberColumn("Market Price ($/BBL)", format="%.2f"),
-                    'type': st.column_config.TextColumn("Type")
+                    'type': st.column_config.TextColumn("Type"),
+                    'volume': st.column_config.NumberColumn("Volume")
                 },
-                hide_index=True
+                hide_index=True,
+                key='market_price_editor'
             )
             form_cols = st.columns(2)
             save_prices = form_cols[0].form_submit_button("Save Market Prices")
             clear_prices = form_cols[1].form_submit_button("Clear Market Prices")
 
         if save_prices:
-            manual_df = pd.DataFrame(editable_df)
-            if not manual_df.empty and 'instrument' in manual_df.columns:
-                manual_df['instrument'] = manual_df['instrument'].astype(str).fillna('')
-            save_market_price_df(manual_df)
-            st.success("Market prices saved.")
+            changed_rows = apply_market_price_edits(editor_positions, editor_df, st.session_state.get('market_price_editor') or {})
+            st.success(f"Market prices saved ({changed_rows} row{'s' if changed_rows != 1 else ''} changed).")
 
         if clear_prices:
-            st.session_state.market_prices = []
-            if 'market_price_file' in st.session_state:
-                del st.session_state.market_price_file
+            clear_market_prices()
             st.success("Market prices cleared.")
 
-    market_price_df = get_market_price_df()
-
-    if market_price_df.empty:
+    if get_market_price_set() is None:
         st.info("Add market prices to evaluate mark-to-market P&L.")
     else:
+        bar_cols = st.columns(3)
+        with bar_cols[0]:
+            price_bar_method = st.selectbox(
+                "Price Bars",
+                list(RESAMPLE_METHODS.keys()),
+                format_func=lambda method: RESAMPLE_METHODS[method],
+                key="price_bar_method",
+                help="How intraday prints become the prices used for valuation. Daily price files are unaffected."
+            )
+        with bar_cols[1]:
+            st.selectbox(
+                "Bar Size",
+                list(PRICE_BAR_SIZES.keys()),
+                format_func=lambda size: PRICE_BAR_SIZES[size],
+                key="price_bar_size",
+                disabled=price_bar_method in ('cutoff', 'raw'),
+                help="Valuation resolution. Risk analytics always use daily bars."
+            )
+        with bar_cols[2]:
+            st.time_input(
+                "Cutoff Time",
+                value=DEFAULT_PRICE_CUTOFF,
+                key="price_cutoff",
+                disabled=price_bar_method != 'cutoff',
+                help="Last print at or before this time of day is the day's price"
+            )
+
+        calendar_cols = st.columns([1, 2, 1])
+        with calendar_cols[0]:
+            st.selectbox(
+                "Valuation Calendar",
+                list(CALENDARS) + ['price_dates'],
+                format_func=lambda name: CALENDARS[name]['label'] if name in CALENDARS else 'Dates with prices',
+                key="valuation_calendar",
+                help="Business days of the MTM history axis. Days without a print are valued at the latest print within Max Price Age."
+            )
+        with calendar_cols[1]:
+            st.text_input(
+                "Additional Holidays",
+                key="extra_holidays",
+                placeholder="2024-02-12, 2024-02-13",
+                help="Extra non-business days (YYYY-MM-DD), e.g. Chinese New Year or Hari Raya"
+            )
+        with calendar_cols[2]:
+            reporting_currency = st.selectbox(
+                "Reporting Currency",
+                TRADE_CURRENCIES,
+                key="reporting_currency",
+                help="MTM is valued in USD and converted at each date's FX fixing for display"
+            )
+        _, invalid_holidays = parse_holiday_list(st.session_state.get('extra_holidays', ''))
+        if invalid_holidays:
+            st.warning("Ignored holidays that are not dates: " + ", ".join(invalid_holidays))
+
+        valuation_set = get_valuation_price_set()
+        daily_price_set = get_valuation_price_set(daily=True)
+        market_price_df = daily_price_set.frame
+        intraday_valuation = valuation_set.intraday
         default_date = st.session_state.get('valuation_date')
         if default_date is None:
-            default_date = market_price_df['date'].max().date()
-        valuation_date = st.date_input(
-            "Valuation Date",
-            value=default_date,
-            max_value=market_price_df['date'].max().date()
-        )
+            default_date = valuation_set.frame['date'].max().date()
+        valuation_cols = st.columns(4 if intraday_valuation else 3)
+        with valuation_cols[0]:
+            valuation_date = st.date_input(
+                "Valuation Date",
+                value=default_date,
+                max_value=valuation_set.frame['date'].max().date()
+            )
+        if intraday_valuation:
+            with valuation_cols[3]:
+                valuation_time = st.time_input(
+                    "Valuation Time",
+                    value=time(23, 59),
+                    key="valuation_time",
+                    help="Intraday bars are valued as of this time"
+                )
+        with valuation_cols[1]:
+            lookup_mode = st.selectbox(
+                "Price Lookup",
+                list(LOOKUP_MODES.keys()),
+                format_func=lambda mode: LOOKUP_MODES[mode],
+                key="price_lookup_mode",
+                help="How to price an instrument with no print on the valuation date (e.g. holidays)"
+            )
+        with valuation_cols[2]:
+            max_staleness_days = st.number_input(
+                "Max Price Age (days)",
+                min_value=0,
+                max_value=365,
+                value=5,
+                step=1,
+                key="max_staleness_days",
+                disabled=lookup_mode == 'exact',
+                help="Oldest print that may be carried forward or interpolated from"
+            )
+        known_cols = st.columns([1, 1, 1])
+        with known_cols[0]:
+            value_as_known = st.checkbox(
+                "Value Book As Known At",
+                key="value_as_known",
+                help="Value the trades as they were recorded at a past time, before later corrections"
+            )
+        with known_cols[1]:
+            st.date_input("Known At Date", value=datetime.now().date(), key="known_at_date", disabled=not value_as_known)
+        with known_cols[2]:
+            st.time_input("Known At Time", value=time(23, 59), key="known_at_time", disabled=not value_as_known)
+        known_at = get_known_at()
+
         st.session_state.valuation_date = valuation_date
+        valuation_stamp = datetime.combine(valuation_date, valuation_time) if intraday_valuation else valuation_date
 
-        pnl_snapshot = evaluate_market_pnl_for_date(
-            market_price_df,
-            st.session_state.physical_trades,
-            st.session_state.hedge_trades,
-            valuation_date
-        )
+        pnl_snapshot = get_valuation_snapshot(valuation_stamp, lookup_mode, max_staleness_days, known_at)
+        if known_at is not None:
+            st.caption(f"Book as recorded at {known_at:%Y-%m-%d %H:%M}.")
 
+        reporting_rate = reporting_rates(reporting_currency, [valuation_stamp])[0]
+        if np.isnan(reporting_rate):
+            st.warning(f"No {reporting_currency} FX fixing on or before {valuation_date}; MTM is shown in USD.")
+            reporting_currency, reporting_rate = BASE_CURRENCY, 1.0
         metric_cols = st.columns(3)
         metric_cols[0].metric(
             "Physical MTM",
-            f"${pnl_snapshot['physical_pnl']:,.2f}",
+            format_amount(pnl_snapshot['physical_pnl'] / reporting_rate, reporting_currency),
             help=f"As of {valuation_date}" 
         )
         metric_cols[1].metric(
             "Hedge MTM",
-            f"${pnl_snapshot['hedge_pnl']:,.2f}",
+            format_amount(pnl_snapshot['hedge_pnl'] / reporting_rate, reporting_currency),
             help=f"As of {valuation_date}" 
         )
         metric_cols[2].metric(
             "Net MTM",
-            f"${pnl_snapshot['net_pnl']:,.2f}",
+            format_amount(pnl_snapshot['net_pnl'] / reporting_rate, reporting_currency),
             help=f"As of {valuation_date}" 
         )
 
@@ -1853,6 +3273,11 @@ with tab5:
                 "No market price found for: " + ", ".join(pnl_snapshot['missing_instruments']) +
                 f" on {valuation_date}. These exposures are excluded from MTM."
             )
+        if pnl_snapshot['stale_instruments']:
+            st.info(
+                "Valued with a carried-forward or interpolated price: " + ", ".join(pnl_snapshot['stale_instruments']) +
+                ". See the Price Source column below."
+            )
 
         physical_details = pnl_snapshot['physical_details'].copy()
         hedge_details = pnl_snapshot['hedge_details'].copy()
@@ -1869,45 +3294,16 @@ with tab5:
             st.markdown("#### Hedge Position Details")
             st.dataframe(hedge_details, width='stretch')
 
-        pnl_series = calculate_market_pnl_series(
-            market_price_df,
-            st.session_state.physical_trades,
-            st.session_state.hedge_trades
-        )
+        mtm_history_job = ensure_mtm_history_job(lookup_mode, max_staleness_days, known_at)
 
         chart_cols = st.columns(2)
         with chart_cols[0]:
-            if pnl_series.empty:
-                st.info("Add additional price history to see MTM trends.")
+            if mtm_history_job.done:
+                st.session_state.mtm_history_polling = False
+                render_mtm_history_chart()
             else:
-                pnl_fig = go.Figure()
-                pnl_fig.add_trace(go.Scatter(
-                    x=pnl_series['date'],
-                    y=pnl_series['physical_pnl'],
-                    mode='lines+markers',
-                    name='Physical MTM'
-                ))
-                pnl_fig.add_trace(go.Scatter(
-                    x=pnl_series['date'],
-                    y=pnl_series['hedge_pnl'],
-                    mode='lines+markers',
-                    name='Hedge MTM'
-                ))
-                pnl_fig.add_trace(go.Scatter(
-                    x=pnl_series['date'],
-                    y=pnl_series['net_pnl'],
-                    mode='lines+markers',
-                    name='Net MTM'
-                ))
-                pnl_fig.update_layout(
-                    title='MTM History',
-                    xaxis_title='Date',
-                    yaxis_title='P&L ($)',
-                    hovermode='x unified',
-                    legend_title='Category',
-                    height=400
-                )
-                st.plotly_chart(pnl_fig, use_container_width=True)
+                st.session_state.mtm_history_polling = True
+                poll_mtm_history_chart()
 
         with chart_cols[1]:
             relevant_instruments = set(physical_details['Instrument'].dropna().tolist()) | set(hedge_details['Instrument'].dropna().tolist())
@@ -1915,16 +3311,11 @@ with tab5:
             if price_history.empty:
                 st.info("Upload price history for relevant instruments to view price trends.")
             else:
-                price_fig = go.Figure()
-                for column in price_history.columns:
-                    if column == 'date':
-                        continue
-                    price_fig.add_trace(go.Scatter(
-                        x=price_history['date'],
-                        y=price_history[column],
-                        mode='lines+markers',
-                        name=column
-                    ))
+                price_columns = tuple(column for column in price_history.columns if column != 'date')
+                chart_series = cached_chart_series(
+                    f"{daily_price_set.key}|{'|'.join(price_columns)}", 'date', price_columns, CHART_POINT_BUDGET, price_history
+                )
+                price_fig = go.Figure(data=line_traces(chart_series))
                 price_fig.update_layout(
                     title='Instrument Price History',
                     xaxis_title='Date',
@@ -1934,11 +3325,327 @@ with tab5:
                 )
                 st.plotly_chart(price_fig, use_container_width=True)
 
+        with st.expander("Hedge Effectiveness", expanded=False):
+            st.markdown("Regression of daily physical price changes on hedge contract changes for every product/contract pair with price history.")
+            effectiveness_window = st.slider("Rolling Window (days)", min_value=5, max_value=250, value=20, step=5, key="effectiveness_window")
+
+            catalog_products = [item for items in PLATTS_PRODUCT_CATALOG.values() for item in items]
+            book_products = [trade.get('product_name') for trade in st.session_state.physical_trades if trade.get('product_name')]
+            book_contracts = [hedge.get('contract') for hedge in st.session_state.hedge_trades if hedge.get('contract')]
+            priced_hedges = market_price_df.loc[market_price_df['type'].astype(str).str.lower() == 'hedge', 'instrument'].unique().tolist()
+            effectiveness = hedge_effectiveness(
+                market_price_df,
+                catalog_products + book_products,
+                HEDGE_CONTRACTS + book_contracts + priced_hedges,
+                window=effectiveness_window
+            )
+
+            effectiveness_summary = effectiveness['summary']
+            if effectiveness_summary.empty:
+                st.info("Need at least three overlapping prices for a product and a hedge contract.")
+            else:
+                st.dataframe(
+                    effectiveness_summary.round(4),
+                    width='stretch',
+                    hide_index=True
+                )
+                st.caption("Effective = R² ≥ 0.80 and dollar offset within 80–125%. Optimal hedge ratio is the minimum-variance ratio (regression beta).")
+
+                pair_labels = [f"{product} vs {contract}" for product, contract in effectiveness['pairs']]
+                selected_pair = st.selectbox("Pair", range(len(pair_labels)), format_func=lambda x: pair_labels[x], key="effectiveness_pair")
+                rolling_frame = rolling_effectiveness_frame(effectiveness, *effectiveness['pairs'][selected_pair])
+
+                rolling_fig = go.Figure()
+                rolling_fig.add_trace(go.Scatter(x=rolling_frame['date'], y=rolling_frame['beta'], mode='lines', name='Beta'))
+                rolling_fig.add_trace(go.Scatter(x=rolling_frame['date'], y=rolling_frame['r2'], mode='lines', name='R²'))
+                rolling_fig.add_trace(go.Scatter(
+                    x=rolling_frame['date'],
+                    y=rolling_frame['dollar_offset'],
+                    mode='lines',
+                    name='Dollar Offset (%)',
+                    yaxis='y2'
+                ))
+                rolling_fig.update_layout(
+                    title=f'Rolling {effectiveness_window}-Day Hedge Effectiveness',
+                    xaxis_title='Date',
+                    yaxis=dict(title='Beta / R²'),
+                    yaxis2=dict(title='Dollar Offset (%)', overlaying='y', side='right'),
+                    hovermode='x unified',
+                    height=400
+                )
+                st.plotly_chart(rolling_fig, use_container_width=True)
+
+        with st.expander("Hedge Policy Backtest", expanded=False):
+            st.markdown("Replay the physical lots against the stored price history under alternative hedge contracts and ratios.")
+            backtest_contracts = list(dict.fromkeys(HEDGE_CONTRACTS + priced_hedges))
+            with st.form("hedge_backtest_form"):
+                bt_cols = st.columns(3)
+                with bt_cols[0]:
+                    bt_contracts = st.multiselect("Hedge Contracts", backtest_contracts, default=HEDGE_CONTRACTS[:2], key="backtest_contracts")
+                with bt_cols[1]:
+                    bt_ratios = st.multiselect(
+                        "Hedge Ratios (%)",
+                        [0, 50, 80, 90, 100, 110, 120, 150],
+                        default=[0, 80, 100, 120],
+                        key="backtest_ratios"
+                    )
+                with bt_cols[2]:
+                    bt_workers = st.number_input("Worker Processes", min_value=1, max_value=64, value=1, step=1, key="backtest_workers")
+                run_backtest = st.form_submit_button("Run Backtest")
+
+            if run_backtest:
+                if not bt_contracts or not bt_ratios:
+                    st.warning("Select at least one hedge contract and one hedge ratio.")
+                else:
+                    with st.spinner("Replaying hedge policies..."):
+                        st.session_state.backtest_result = backtest_hedge_policies(
+                            market_price_df,
+                            st.session_state.physical_trades,
+                            policy_grid(bt_contracts, [ratio / 100.0 for ratio in sorted(bt_ratios)]),
+                            default_product=st.session_state.get('selected_product_name', ''),
+                            max_workers=int(bt_workers)
+                        )
+
+            bt_result = st.session_state.get('backtest_result')
+            if bt_result is not None:
+                if bt_result['summary'].empty:
+                    st.info("No physical lots with purchase dates inside the price history to backtest.")
+                else:
+                    if bt_result['missing_contracts']:
+                        st.warning("No price history for: " + ", ".join(bt_result['missing_contracts']) + ". Those policies leave every lot unhedged.")
+                    st.dataframe(
+                        bt_result['summary'].style.format({
+                            'Hedge Ratio (%)': '{:.0f}',
+                            'Physical P&L ($)': '${:,.0f}',
+                            'Hedge P&L ($)': '${:,.0f}',
+                            'Net P&L ($)': '${:,.0f}',
+                            'Daily P&L Std ($)': '${:,.0f}',
+                            'Annualized Vol ($)': '${:,.0f}',
+                            'Max Drawdown ($)': '${:,.0f}'
+                        }),
+                        width='stretch',
+                        hide_index=True
+                    )
+                    st.caption(
+                        f"{bt_result['lots']} lot(s) replayed | {bt_result['chunks']} chunk(s) on {bt_result['workers']} worker(s). "
+                        "Net P&L uses the lots' own buy/sale prices; volatility uses daily mark-to-market changes."
+                    )
+                    if bt_result['skipped_lots']:
+                        st.caption("Skipped trades (no purchase date or no prices in the holding period): "
+                                   + ", ".join(str(p) for p in bt_result['skipped_lots']))
+
+                    backtest_fig = go.Figure()
+                    for policy_name in bt_result['cumulative'].columns:
+                        backtest_fig.add_trace(go.Scatter(
+                            x=bt_result['cumulative'].index,
+                            y=bt_result['cumulative'][policy_name],
+                            mode='lines',
+                            name=policy_name
+                        ))
+                    backtest_fig.update_layout(
+                        title='Cumulative Mark-to-Market P&L by Policy',
+                        xaxis_title='Date',
+                        yaxis_title='P&L ($)',
+                        hovermode='x unified',
+                        height=400
+                    )
+                    st.plotly_chart(backtest_fig, use_container_width=True)
+
+        with st.expander("Price Shock Stress Test", expanded=False):
+            st.markdown("Revalue the open book under a grid of price shocks, e.g. gasoil ±$10 against the product crack ±$3.")
+            hedge_instruments = sorted(set(hedge_details.loc[hedge_details['Status'] == 'Open', 'Instrument'].dropna())) if not hedge_details.empty else []
+            physical_instruments = sorted(set(physical_details.loc[physical_details['Status'] == 'Open', 'Instrument'].dropna())) if not physical_details.empty else []
+            stress_instruments = sorted(set(hedge_instruments) | set(physical_instruments))
+
+            if not stress_instruments:
+                st.info("No open positions to stress as of the valuation date.")
+            else:
+                with st.form("stress_test_form"):
+                    axis_cols = st.columns(2)
+                    with axis_cols[0]:
+                        st.markdown("**X Axis Shock**")
+                        x_instruments = st.multiselect("Instruments", stress_instruments, default=hedge_instruments or stress_instruments, key="stress_x_instruments")
+                        x_mode = st.selectbox("Shock Type", ["Absolute ($/BBL)", "Percentage (%)"], key="stress_x_mode")
+                        x_range = st.number_input("Shock Range (±)", min_value=0.0, value=10.0, step=0.5, key="stress_x_range")
+                        x_steps = st.number_input("Grid Points", min_value=2, max_value=201, value=21, step=1, key="stress_x_steps")
+                    with axis_cols[1]:
+                        st.markdown("**Y Axis Shock**")
+                        y_instruments = st.multiselect("Instruments", stress_instruments, default=physical_instruments, key="stress_y_instruments")
+                        y_mode = st.selectbox("Shock Type", ["Absolute ($/BBL)", "Percentage (%)"], key="stress_y_mode")
+                        y_range = st.number_input("Shock Range (±)", min_value=0.0, value=3.0, step=0.5, key="stress_y_range")
+                        y_steps = st.number_input("Grid Points", min_value=2, max_value=201, value=21, step=1, key="stress_y_steps")
+                    st.form_submit_button("Run Stress Test")
+
+                stress_result = stress_test_grid(
+                    market_price_df,
+                    st.session_state.physical_trades,
+                    st.session_state.hedge_trades,
+                    valuation_date,
+                    x_axis={
+                        'instruments': x_instruments,
+                        'shocks': np.linspace(-x_range, x_range, int(x_steps)),
+                        'mode': 'percent' if x_mode.startswith('Percentage') else 'absolute'
+                    },
+                    y_axis={
+                        'instruments': y_instruments,
+                        'shocks': np.linspace(-y_range, y_range, int(y_steps)),
+                        'mode': 'percent' if y_mode.startswith('Percentage') else 'absolute'
+                    },
+                    default_product=st.session_state.get('selected_product_name', '')
+                )
+
+                if stress_result['missing_instruments']:
+                    st.warning("No price available for: " + ", ".join(stress_result['missing_instruments']) + ". These exposures are excluded from the stress test.")
+
+                net_grid = stress_result['net']
+                stress_metric_cols = st.columns(3)
+                stress_metric_cols[0].metric("Base Net P&L", f"${stress_result['base_net']:,.2f}")
+                stress_metric_cols[1].metric("Worst Case", f"${net_grid.min():,.2f}")
+                stress_metric_cols[2].metric("Best Case", f"${net_grid.max():,.2f}")
+
+                x_unit = '%' if x_mode.startswith('Percentage') else '$'
+                y_unit = '%' if y_mode.startswith('Percentage') else '$'
+                heatmap_fig = go.Figure(data=go.Heatmap(
+                    z=net_grid,
+                    x=stress_result['x_shocks'],
+                    y=stress_result['y_shocks'],
+                    colorscale='RdYlGn',
+                    zmid=0,
+                    colorbar=dict(title='Net P&L ($)'),
+                    hovertemplate=f"X shock: %{{x:.2f}}{x_unit}<br>Y shock: %{{y:.2f}}{y_unit}<br>Net P&L: $%{{z:,.0f}}<extra></extra>"
+                ))
+                heatmap_fig.update_layout(
+                    title='Net P&L under Price Shocks',
+                    xaxis_title=f"X shock ({x_unit}): {', '.join(x_instruments) or 'none'}",
+                    yaxis_title=f"Y shock ({y_unit}): {', '.join(y_instruments) or 'none'}",
+                    height=500
+                )
+                st.plotly_chart(heatmap_fig, use_container_width=True)
+
+        with st.expander("Monte Carlo P&L Distribution", expanded=False):
+            st.markdown("Simulate correlated price paths for the open book, calibrated from the stored price history.")
+            with st.form("monte_carlo_form"):
+                mc_cols = st.columns(3)
+                with mc_cols[0]:
+                    mc_horizon = st.number_input("Horizon (days)", min_value=1, max_value=365, value=20, step=1)
+                    mc_lookback = st.number_input("Calibration Lookback (obs)", min_value=2, value=250, step=10)
+                with mc_cols[1]:
+                    mc_paths = st.number_input("Number of Paths", min_value=100, max_value=5000000, value=10000, step=1000)
+                    mc_seed = st.number_input("Random Seed", min_value=0, value=42, step=1)
+                with mc_cols[2]:
+                    mc_workers = st.number_input("Worker Processes", min_value=1, max_value=64, value=1, step=1)
+                    mc_memory_cap = st.number_input("Memory Cap per Chunk (MB)", min_value=16, value=256, step=16)
+                mc_use_drift = st.checkbox("Use historical drift", value=False, help="Off = driftless paths (recommended for short horizons)")
+                run_monte_carlo = st.form_submit_button("Run Simulation")
+
+            if run_monte_carlo:
+                with st.spinner("Simulating price paths..."):
+                    st.session_state.monte_carlo_result = simulate_pnl_distribution(
+                        market_price_df,
+                        st.session_state.physical_trades,
+                        st.session_state.hedge_trades,
+                        valuation_date,
+                        horizon_days=int(mc_horizon),
+                        n_paths=int(mc_paths),
+                        seed=int(mc_seed),
+                        max_workers=int(mc_workers),
+                        memory_cap_mb=int(mc_memory_cap),
+                        lookback=int(mc_lookback),
+                        use_drift=mc_use_drift,
+                        default_product=st.session_state.get('selected_product_name', '')
+                    )
+
+            mc_result = st.session_state.get('monte_carlo_result')
+            if run_monte_carlo and mc_result is None:
+                st.info("No open positions to simulate as of the valuation date.")
+            elif mc_result:
+                if mc_result.get('missing_instruments'):
+                    st.warning("No price history for: " + ", ".join(mc_result['missing_instruments']) + ". These exposures are excluded from the simulation.")
+                if mc_result.get('n_paths'):
+                    mc_metric_cols = st.columns(3)
+                    mc_metric_cols[0].metric("Expected Net P&L", f"${mc_result['mean_net_pnl']:,.2f}")
+                    mc_metric_cols[1].metric("Net P&L Std Dev", f"${mc_result['std_net_pnl']:,.2f}")
+                    mc_metric_cols[2].metric("Probability of Loss", f"{mc_result['prob_loss'] * 100:.1f}%")
+                    st.caption(
+                        f"{mc_result['n_paths']:,} paths over {mc_result['horizon_days']} days | "
+                        f"{mc_result['chunks']} chunk(s) on {mc_result['workers']} worker(s) | seed {mc_result['seed']}"
+                    )
+
+                    st.dataframe(
+                        mc_result['percentiles'].round(2),
+                        width='stretch',
+                        hide_index=True
+                    )
+
+                    mc_chart_cols = st.columns(2)
+                    with mc_chart_cols[0]:
+                        histogram = mc_result['histogram']
+                        hist_fig = go.Figure(data=[go.Bar(
+                            x=(histogram['bin_start'] + histogram['bin_end']) / 2,
+                            y=histogram['count'],
+                            width=(histogram['bin_end'] - histogram['bin_start']),
+                            marker_color='#3b82f6'
+                        )])
+                        hist_fig.update_layout(
+                            title='Final Net P&L Distribution',
+                            xaxis_title='Net P&L ($)',
+                            yaxis_title='Paths',
+                            height=400
+                        )
+                        st.plotly_chart(hist_fig, use_container_width=True)
+                    with mc_chart_cols[1]:
+                        bands = mc_result['bands']
+                        if not bands.empty:
+                            band_fig = go.Figure()
+                            for column in bands.columns:
+                                if column == 'day':
+                                    continue
+                                band_fig.add_trace(go.Scatter(
+                                    x=bands['day'],
+                                    y=bands[column],
+                                    mode='lines',
+                                    name=column
+                                ))
+                            band_fig.update_layout(
+                                title='Net P&L Percentile Bands',
+                                xaxis_title='Days Ahead',
+                                yaxis_title='Net P&L ($)',
+                                hovermode='x unified',
+                                height=400
+                            )
+                            st.plotly_chart(band_fig, use_container_width=True)
+
         with st.expander("Raw Market Price Data", expanded=False):
-            display_prices = market_price_df.drop(columns=['instrument_key'], errors='ignore').copy()
-            display_prices['date'] = display_prices['date'].dt.strftime('%Y-%m-%d')
+            stored_prices = get_market_price_set()
+            display_prices = expand_price_frame(stored_prices.frame).drop(columns=['instrument_id'], errors='ignore')
+            display_prices['date'] = display_prices['date'].dt.strftime('%Y-%m-%d %H:%M' if stored_prices.intraday else '%Y-%m-%d')
             st.dataframe(display_prices, width='stretch')
 
+with diagnostics_panel:
+    price_cache_stats = get_price_cache().stats()
+    st.markdown("**Shared Price Cache**")
+    st.write(f"- Price sets cached: {price_cache_stats['entries']}")
+    st.write(f"- Memory: {price_cache_stats['total_mb']:,.1f} / {price_cache_stats['budget_mb']:,.0f} MB")
+    st.write(f"- Hits / Misses: {price_cache_stats['hits']} / {price_cache_stats['misses']}")
+    st.write(f"- Evictions: {price_cache_stats['evictions']}")
+    session_price_set = get_market_price_set()
+    if session_price_set is not None:
+        st.write(f"- This session: {len(session_price_set):,} rows, key {session_price_set.key[:10]}")
+        st.write(f"- Storage mode: {price_storage_mode()}")
+        st.write(f"- Timestamps: {'intraday' if session_price_set.intraday else 'daily'}")
+        memory_report = cached_price_memory_report(session_price_set.key, session_price_set.frame)
+        st.dataframe(
+            memory_report.style.format({'Plain (MB)': '{:,.2f}', 'Stored (MB)': '{:,.2f}', 'Saving (%)': '{:.1f}'}),
+            hide_index=True,
+            width='stretch'
+        )
+
+    valuation_cache_stats = st.session_state.valuation_cache.stats()
+    st.markdown("**Valuation Snapshot Cache**")
+    st.write(f"- Snapshots cached: {valuation_cache_stats['entries']} / {valuation_cache_stats['max_entries']}")
+    st.write(f"- Hits / Misses: {valuation_cache_stats['hits']} / {valuation_cache_stats['misses']}")
+    st.write(f"- Hit rate: {valuation_cache_stats['hit_rate'] * 100:.1f}%")
+
 # Footer
 footer_logo_html = ""
 if logo_base64:
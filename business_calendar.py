@@ -0,0 +1,116 @@
+"""
+Holiday-aware business-day calendars for valuation grids.
+"""
+
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# Publishing/trading holidays per calendar. `fixed` holidays are (month,
+# day); `easter` holidays are day offsets from Easter Sunday. A fixed
+# holiday on a weekend day listed in `observed` moves to the next business
+# day. Moving feasts (e.g. Chinese New Year, Hari Raya) are not computed:
+# add them as extra holidays.
+CALENDARS = {
+    'platts_singapore': {
+        'label': 'Platts Singapore publishing days',
+        'fixed': [(1, 1), (5, 1), (8, 9), (12, 25)],
+        'easter': [-2],
+        'observed': ['Sun']
+    },
+    'london': {
+        'label': 'London (ICE Futures Europe)',
+        'fixed': [(1, 1), (12, 25), (12, 26)],
+        'easter': [-2, 1],
+        'observed': ['Sat', 'Sun']
+    },
+    'weekdays': {
+        'label': 'Weekdays only',
+        'fixed': [],
+        'easter': [],
+        'observed': []
+    }
+}
+
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def easter_sunday(year: int) -> date:
+    """Gregorian Easter Sunday (anonymous Gregorian computus)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def calendar_holidays(name: str, start_year: int, end_year: int, extra_holidays=()) -> np.ndarray:
+    """Sorted unique datetime64[D] holidays of a calendar for the given years plus `extra_holidays`"""
+    rules = CALENDARS[name]
+    observed = {WEEKDAY_NAMES.index(day) for day in rules['observed']}
+    holidays = set()
+    for year in range(start_year, end_year + 1):
+        easter = easter_sunday(year)
+        holidays.update(easter + timedelta(days=offset) for offset in rules['easter'])
+        for month, day in sorted(rules['fixed']):
+            holiday = date(year, month, day)
+            if holiday.weekday() in observed:
+                # observed on the next free weekday: Christmas on a Saturday pushes Boxing Day to Tuesday
+                while holiday.weekday() >= 5 or holiday in holidays:
+                    holiday += timedelta(days=1)
+            holidays.add(holiday)
+    holidays.update(pd.Timestamp(extra).date() for extra in extra_holidays)
+    return np.array(sorted(holidays), dtype='datetime64[D]')
+
+
+class BusinessCalendar:
+    """Business days of one calendar over whole years, precomputed once.
+
+    `days` is the datetime64[D] array of every business day in the range and
+    `busdaycal` the matching numpy calendar, so `np.busday_count` /
+    `np.busday_offset` callers can honour the same holidays.
+    """
+
+    def __init__(self, name: str, start_year: int, end_year: int, extra_holidays=()):
+        self.name = name
+        self.holidays = calendar_holidays(name, start_year, end_year, extra_holidays)
+        self.busdaycal = np.busdaycalendar(weekmask='1111100', holidays=self.holidays)
+        first = np.datetime64(f"{start_year}-01-01", 'D')
+        last = np.datetime64(f"{end_year}-12-31", 'D')
+        all_days = np.arange(first, last + 1)
+        self.days = all_days[np.is_busday(all_days, busdaycal=self.busdaycal)]
+
+    def between(self, start, end) -> np.ndarray:
+        """Business days from `start` to `end` inclusive"""
+        start = np.datetime64(pd.Timestamp(start).date(), 'D')
+        end = np.datetime64(pd.Timestamp(end).date(), 'D')
+        return self.days[np.searchsorted(self.days, start, side='left'):np.searchsorted(self.days, end, side='right')]
+
+    def is_business_day(self, days) -> np.ndarray:
+        days = pd.to_datetime(np.atleast_1d(np.asarray(days))).to_numpy(dtype='datetime64[D]')
+        return np.is_busday(days, busdaycal=self.busdaycal)
+
+
+@lru_cache(maxsize=32)
+def _cached_calendar(name: str, start_year: int, end_year: int, extra_holidays: tuple) -> BusinessCalendar:
+    return BusinessCalendar(name, start_year, end_year, extra_holidays)
+
+
+def business_calendar(name: str, start, end, extra_holidays=()) -> BusinessCalendar:
+    """Shared calendar covering `start`..`end`, built per whole calendar years so nearby ranges reuse it"""
+    extra = tuple(sorted({str(pd.Timestamp(day).date()) for day in extra_holidays}))
+    return _cached_calendar(name, pd.Timestamp(start).year, pd.Timestamp(end).year, extra)
+
+
+def valuation_grid(name: str, start, end, extra_holidays=()) -> np.ndarray:
+    """datetime64[D] business days from `start` to `end` inclusive on a calendar"""
+    return business_calendar(name, start, end, extra_holidays).between(start, end)
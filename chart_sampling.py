@@ -0,0 +1,68 @@
+"""
+Downsampling of long chart series to a point budget.
+
+Largest-Triangle-Three-Buckets (LTTB) keeps the points that shape a line:
+the first and last point, then per bucket the point spanning the largest
+triangle with the previously kept point and the next bucket's average.
+The series minimum and maximum are always kept on top, so spikes survive.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _as_float(values) -> np.ndarray:
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype(np.int64).astype(float)
+    return values.astype(float)
+
+
+def lttb_indices(x, y, budget: int) -> np.ndarray:
+    """Sorted positions of at most `budget` points of (x, y) to plot; y must not hold NaN"""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= budget:
+        return np.arange(n)
+    if budget < 4:
+        # too few points for a triangle: evenly spaced, end points first
+        return np.unique(np.linspace(0, n - 1, max(budget, 0)).round().astype(np.int64))
+    x = _as_float(x)
+
+    # two slots are reserved for the extremes, two for the end points
+    buckets = budget - 4
+    edges = np.linspace(1, n - 1, buckets + 1).astype(np.int64)
+    chosen = np.empty(buckets + 2, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(buckets):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 <= buckets:
+            next_x, next_y = x[end:edges[bucket + 2]].mean(), y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        px, py = x[previous], y[previous]
+        areas = np.abs((px - next_x) * (y[start:end] - py) - (px - x[start:end]) * (next_y - py))
+        previous = start + int(np.argmax(areas))
+        chosen[bucket + 1] = previous
+    return np.union1d(chosen, [int(np.argmin(y)), int(np.argmax(y))])
+
+
+def downsample_frame(frame: pd.DataFrame, x_column: str, y_columns, budget: int) -> dict:
+    """{column: frame of (x, column)} with the chart's `budget` split evenly across the columns.
+
+    Missing values of a column are dropped before sampling, so each series
+    keeps its own dates. The points plotted never exceed `budget` in total:
+    with more series than the budget allows for LTTB, each keeps only a few
+    evenly spaced points.
+    """
+    y_columns = list(y_columns)
+    # the first `budget % n` series take the remainder, one point each
+    per_series, remainder = divmod(budget, max(len(y_columns), 1))
+    series = {}
+    for number, column in enumerate(y_columns):
+        subset = frame[[x_column, column]].dropna(subset=[column])
+        positions = lttb_indices(subset[x_column].to_numpy(), subset[column].to_numpy(),
+                                 per_series + (number < remainder))
+        series[column] = subset.iloc[positions].reset_index(drop=True)
+    return series
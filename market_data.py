@@ -0,0 +1,809 @@
+"""
+Market price storage and lookup helpers for the Oil Trading P&L app.
+"""
+
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+
+LOOKUP_MODES = {
+    'exact': 'Exact date',
+    'last': 'Last available (carry forward)',
+    'interpolate': 'Linear interpolation'
+}
+
+RESAMPLE_METHODS = {
+    'eod': 'End of day (last print)',
+    'cutoff': 'Last print before cutoff',
+    'vwap': 'VWAP',
+    'raw': 'Raw timestamps'
+}
+
+NS_PER_DAY = 86_400_000_000_000
+
+# resampled views kept per PriceSet; the least recently used is dropped beyond this
+MAX_VIEWS_PER_SET = 8
+
+# Currency market prices and the MTM are valued in; other currencies convert through the FX store
+BASE_CURRENCY = 'USD'
+
+# ID returned for a blank instrument name; never matches a price series
+MISSING_INSTRUMENT_ID = -1
+
+# Variant spellings seen in broker confirms and price files -> catalog name
+INSTRUMENT_ALIASES = {
+    'GASOIL 2500PPM MOPS': 'GAS OIL2500PPM MOPS',
+    'GASOIL2500PPM MOPS': 'GAS OIL2500PPM MOPS',
+    'GAS OIL 2500PPM MOPS': 'GAS OIL2500PPM MOPS',
+    'GAS OIL 2500 PPM MOPS': 'GAS OIL2500PPM MOPS',
+    'GASOIL 2500 PPM MOPAG': 'GASOIL 2500PPM MOPAG',
+    'GAS OIL 2500PPM MOPAG': 'GASOIL 2500PPM MOPAG',
+    '180 CST MOPAG': '180 CST AG MOPAG',
+    '380 CST MOPAG': '380 CST AG MOPAG',
+    '180 CST MOPS': '180 CST SPOR MOPS',
+    '380 CST MOPS': '380 CST SPOR MOPS',
+    'GASOIL M1': 'GASOIL Mo1',
+    'GASOIL M2': 'GASOIL Mo2',
+    'GASOIL M3': 'GASOIL Mo3'
+}
+
+
+class InstrumentRegistry:
+    """Process-wide integer IDs for instrument names.
+
+    Names match case- and whitespace-insensitively, and registered aliases
+    resolve to their canonical instrument's ID. Each distinct spelling is
+    normalized once; after that `intern` is a single dict lookup. IDs are
+    only stable within a process, so they are derived when frames are built
+    and never saved with a book or price file.
+    """
+
+    def __init__(self, aliases=None):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._names = []
+        self._spellings = {}
+        self._aliases = {}
+        self._canonical_names = {}
+        for alias, canonical in (aliases or {}).items():
+            self.add_alias(alias, canonical)
+
+    @staticmethod
+    def normalize(name) -> str:
+        if name is None:
+            return ''
+        return ' '.join(str(name).split()).lower()
+
+    def add_alias(self, alias, canonical):
+        """Resolve `alias` to the same ID as `canonical`"""
+        alias_key = self.normalize(alias)
+        canonical_key = self.normalize(canonical)
+        if not alias_key or not canonical_key or alias_key == canonical_key:
+            return
+        with self._lock:
+            canonical_key = self._aliases.get(canonical_key, canonical_key)
+            if alias_key in self._ids:
+                if canonical_key in self._ids:
+                    raise ValueError(f"'{alias}' is already registered as a separate instrument")
+                # first seen under the alias: hand its ID to the canonical name
+                self._ids[canonical_key] = self._ids.pop(alias_key)
+                self._names[self._ids[canonical_key]] = ' '.join(str(canonical).split())
+            self._aliases[alias_key] = canonical_key
+            self._canonical_names.setdefault(canonical_key, ' '.join(str(canonical).split()))
+            self._spellings.clear()
+
+    def intern(self, name) -> int:
+        """ID for an instrument name, registering it on first sight"""
+        try:
+            return self._spellings[name]
+        except (KeyError, TypeError):
+            pass
+        key = self.normalize(name)
+        if not key:
+            return MISSING_INSTRUMENT_ID
+        with self._lock:
+            key = self._aliases.get(key, key)
+            instrument_id = self._ids.get(key)
+            if instrument_id is None:
+                instrument_id = len(self._names)
+                self._ids[key] = instrument_id
+                self._names.append(self._canonical_names.get(key, ' '.join(str(name).split())))
+            if isinstance(name, str):
+                self._spellings[name] = instrument_id
+        return instrument_id
+
+    def intern_many(self, names) -> np.ndarray:
+        """IDs for a column of names, normalizing each distinct spelling once"""
+        codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+        ids = np.array([self.intern(name) for name in uniques] + [MISSING_INSTRUMENT_ID], dtype=np.int32)
+        # factorize codes missing values as -1, which indexes the trailing MISSING_INSTRUMENT_ID
+        return ids[codes]
+
+    def name(self, instrument_id) -> str:
+        if instrument_id is None or instrument_id < 0 or instrument_id >= len(self._names):
+            return ''
+        return self._names[instrument_id]
+
+    def __len__(self):
+        return len(self._names)
+
+
+INSTRUMENTS = InstrumentRegistry(INSTRUMENT_ALIASES)
+
+
+class PriceIndex:
+    """Sorted per-instrument date/price arrays built once from a normalized price frame.
+
+    Series are keyed by `instrument_id` (see InstrumentRegistry). Lookups are a dict hit plus `np.searchsorted`, so an as-of lookup costs
+    the same as an exact one. When an instrument has several prints on the
+    same date the last row in frame order wins, as with the exact lookup.
+    """
+
+    def __init__(self, prices_df: pd.DataFrame):
+        self.series = {}
+        self._prefix_sums = {}
+        if prices_df is None or prices_df.empty:
+            return
+        self.series = self._build_series(prices_df)
+
+    @staticmethod
+    def _build_series(prices_df: pd.DataFrame) -> dict:
+        series = {}
+        if prices_df.empty:
+            return series
+        keys = prices_df['instrument_id'].to_numpy(dtype=np.int64)
+        dates = prices_df['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        prices = prices_df['price'].to_numpy(dtype=float)
+
+        order = np.lexsort((np.arange(len(keys)), dates, keys))
+        keys, dates, prices = keys[order], dates[order], prices[order]
+        # keep the last print per (instrument, date)
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = (keys[1:] != keys[:-1]) | (dates[1:] != dates[:-1])
+        keys, dates, prices = keys[last], dates[last], prices[last]
+
+        unique_keys, starts = np.unique(keys, return_index=True)
+        bounds = list(starts) + [len(keys)]
+        for i, key in enumerate(unique_keys):
+            series[int(key)] = (dates[bounds[i]:bounds[i + 1]], prices[bounds[i]:bounds[i + 1]])
+        return series
+
+    def patched(self, prices_df: pd.DataFrame, instrument_ids) -> 'PriceIndex':
+        """New index for an edited frame, rebuilding only the series of `instrument_ids`.
+
+        Series of untouched instruments are shared with this index.
+        """
+        ids = np.fromiter((int(i) for i in instrument_ids), dtype=np.int64)
+        rebuilt = set(ids.tolist())
+        patched = PriceIndex(None)
+        patched.series = {key: value for key, value in self.series.items() if key not in rebuilt}
+        patched._prefix_sums = {key: value for key, value in self._prefix_sums.items() if key not in rebuilt}
+        if len(ids) and prices_df is not None and not prices_df.empty:
+            changed = prices_df[np.isin(prices_df['instrument_id'].to_numpy(dtype=np.int64), ids)]
+            patched.series.update(self._build_series(changed))
+        return patched
+
+    def __contains__(self, instrument_id):
+        return instrument_id in self.series
+
+    def lookup(self, instrument_id, valuation_date, mode='exact', max_staleness_days=5):
+        """Price for an instrument on a date.
+
+        Returns (price, price_date, source) or (None, None, None), where
+        source says which rule produced the price. `mode` is one of
+        LOOKUP_MODES: 'exact' needs a print on the date, 'last' carries the
+        latest print forward up to `max_staleness_days`, and 'interpolate'
+        interpolates linearly between the surrounding prints (carrying
+        forward past the last print) within the same age limit.
+        """
+        series = self.series.get(instrument_id)
+        if series is None:
+            return None, None, None
+        dates, prices = series
+        target = pd.Timestamp(valuation_date).value
+
+        pos = np.searchsorted(dates, target, side='right') - 1
+        if pos >= 0 and dates[pos] == target:
+            return float(prices[pos]), pd.Timestamp(dates[pos]), 'exact'
+        if mode == 'exact' or pos < 0:
+            return None, None, None
+
+        max_age = (max_staleness_days if max_staleness_days is not None else np.inf) * NS_PER_DAY
+        if target - dates[pos] > max_age:
+            return None, None, None
+
+        if mode == 'interpolate' and pos + 1 < len(dates):
+            weight = (target - dates[pos]) / (dates[pos + 1] - dates[pos])
+            price = prices[pos] + weight * (prices[pos + 1] - prices[pos])
+            return float(price), pd.Timestamp(dates[pos]), 'interpolate'
+        return float(prices[pos]), pd.Timestamp(dates[pos]), 'last'
+
+    def lookup_asof(self, instrument_id, dates, max_staleness_days=None) -> np.ndarray:
+        """Latest price on or before each of `dates` (NaN before the first print or when too old)"""
+        targets = pd.to_datetime(np.atleast_1d(np.asarray(dates))).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        result = np.full(len(targets), np.nan)
+        series = self.series.get(instrument_id)
+        if series is None:
+            return result
+        stamps, prices = series
+        positions = np.searchsorted(stamps, targets, side='right') - 1
+        found = positions >= 0
+        if max_staleness_days is not None:
+            found &= targets - stamps[np.maximum(positions, 0)] <= max_staleness_days * NS_PER_DAY
+        result[found] = prices[positions[found]]
+        return result
+
+    def _prefix_sum(self, instrument_id) -> np.ndarray:
+        """Running price totals of a series with a leading zero, built on first use"""
+        prefix = self._prefix_sums.get(instrument_id)
+        if prefix is None:
+            prices = self.series[instrument_id][1]
+            prefix = np.concatenate(([0.0], np.cumsum(prices, dtype=float)))
+            self._prefix_sums[instrument_id] = prefix
+        return prefix
+
+    def window_averages(self, instrument_ids, starts, ends, as_of=None) -> dict:
+        """Average prices over pricing windows, one window per row.
+
+        Each window averages the prints dated `starts[i]`..`ends[i]`
+        (inclusive) of `instrument_ids[i]`. With `as_of`, prints after that
+        date are not known yet: the window's remaining business days are
+        counted as pending and priced at the latest print on or before
+        `as_of`, so a partly priced window values as a blend of fixed and
+        provisional days. Each window costs two `np.searchsorted` calls and
+        a prefix-sum difference, whatever its length.
+
+        Returns a dict of arrays: 'average' (fixed plus provisional days,
+        NaN when the window cannot be priced), 'fixed_average' (priced days
+        only), 'priced_days' and 'pending_days'.
+        """
+        ids = np.asarray(instrument_ids, dtype=np.int64)
+        start_days = pd.to_datetime(np.asarray(starts)).to_numpy(dtype='datetime64[D]')
+        end_days = pd.to_datetime(np.asarray(ends)).to_numpy(dtype='datetime64[D]')
+        count = len(ids)
+
+        # prints strictly before cutoff_ns are known: the day after the window, or just after `as_of`
+        cutoff_ns = (end_days + 1).astype('datetime64[ns]').astype(np.int64)
+        pending = np.zeros(count, dtype=np.int64)
+        if as_of is not None:
+            as_of_ns = pd.Timestamp(as_of).value
+            as_of_day = np.datetime64(pd.Timestamp(as_of).normalize().date(), 'D')
+            cutoff_ns = np.minimum(cutoff_ns, as_of_ns + 1)
+            first_pending = np.maximum(start_days, as_of_day + 1)
+            open_rows = end_days >= first_pending
+            pending[open_rows] = np.busday_count(first_pending[open_rows], end_days[open_rows] + 1)
+        start_ns = start_days.astype('datetime64[ns]').astype(np.int64)
+
+        priced_sum = np.zeros(count)
+        priced = np.zeros(count, dtype=np.int64)
+        latest = np.full(count, np.nan)
+        order = np.argsort(ids, kind='stable')
+        unique_ids, group_starts = np.unique(ids[order], return_index=True)
+        for instrument_id, rows in zip(unique_ids, np.split(order, group_starts[1:])):
+            series = self.series.get(int(instrument_id))
+            if series is None:
+                continue
+            dates, prices = series
+            prefix = self._prefix_sum(int(instrument_id))
+            lo = np.searchsorted(dates, start_ns[rows], side='left')
+            hi = np.maximum(np.searchsorted(dates, cutoff_ns[rows], side='left'), lo)
+            priced_sum[rows] = prefix[hi] - prefix[lo]
+            priced[rows] = hi - lo
+            if as_of is not None:
+                last = np.searchsorted(dates, as_of_ns, side='right') - 1
+                if last >= 0:
+                    latest[rows] = prices[last]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fixed_average = np.where(priced > 0, priced_sum / np.maximum(priced, 1), np.nan)
+            provisional = np.where(pending > 0, pending * latest, 0.0)
+            average = (priced_sum + provisional) / (priced + pending)
+        average[(priced + pending) == 0] = np.nan
+        return {
+            'average': average,
+            'fixed_average': fixed_average,
+            'priced_days': priced,
+            'pending_days': pending
+        }
+
+
+def usd_rates(fx_index: PriceIndex, currency: str, dates, max_staleness_days=None) -> np.ndarray:
+    """USD per unit of `currency` on each date, as of the latest fixing.
+
+    FX rates are stored like prices with one instrument per currency pair:
+    'SGDUSD' quotes USD per SGD, 'USDSGD' SGD per USD; either direction is
+    used. NaN where the currency has no fixing (or only one older than
+    `max_staleness_days`).
+    """
+    count = len(np.atleast_1d(np.asarray(dates)))
+    currency = str(currency or BASE_CURRENCY).strip().upper()
+    if currency == BASE_CURRENCY:
+        return np.ones(count)
+    direct = fx_index.lookup_asof(INSTRUMENTS.intern(f"{currency}{BASE_CURRENCY}"), dates, max_staleness_days)
+    inverse = fx_index.lookup_asof(INSTRUMENTS.intern(f"{BASE_CURRENCY}{currency}"), dates, max_staleness_days)
+    with np.errstate(divide='ignore'):
+        return np.where(np.isnan(direct), 1.0 / inverse, direct)
+
+
+def has_intraday_stamps(df: pd.DataFrame) -> bool:
+    """True when any price is stamped with a time of day other than midnight"""
+    if df is None or df.empty:
+        return False
+    return bool((df['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64) % NS_PER_DAY).any())
+
+
+def _time_of_day_ns(cutoff) -> int:
+    """Nanoseconds after midnight for a datetime.time or an 'HH:MM[:SS]' string"""
+    return pd.Timestamp(f"1970-01-01 {cutoff}").value
+
+
+def resample_prices(df: pd.DataFrame, method='eod', frequency='D', cutoff=None) -> pd.DataFrame:
+    """Price bars of a normalized frame: one row per instrument and period.
+
+    Timestamps are floored to `frequency` (a pandas offset alias: 'D',
+    'h', '15min', ...). Daily bars are stamped with their day; intraday
+    bars with their period end, the time the bar's price is first known,
+    so an as-of lookup never sees a bar before it has closed.
+    `method` is one of RESAMPLE_METHODS: 'eod' keeps the last print of the
+    period, 'cutoff' the last print at or before time of day `cutoff`
+    (daily bars only, e.g. '16:30' for a London close) and 'vwap' the
+    volume-weighted mean price, equal-weighted when the frame has no
+    `volume` column. 'raw' returns the frame unchanged. Storage dtypes are
+    kept.
+    """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(f"Unknown resampling method '{method}'")
+    if method == 'raw' or df is None or df.empty:
+        return df
+    stamps = df['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    if method == 'cutoff':
+        if cutoff is None:
+            raise ValueError("A cutoff time is needed for last-before-cutoff bars")
+        frequency = 'D'
+    bars = pd.DatetimeIndex(stamps.astype('datetime64[ns]')).floor(frequency).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    keys = df['instrument_id'].to_numpy(dtype=np.int64)
+
+    rows = np.arange(len(df))
+    if method == 'cutoff':
+        rows = rows[stamps[rows] - bars[rows] <= _time_of_day_ns(cutoff)]
+    # group rows by (instrument, bar) in timestamp order
+    rows = rows[np.lexsort((rows, stamps[rows], bars[rows], keys[rows]))]
+    group_keys, group_bars = keys[rows], bars[rows]
+    last = np.ones(len(rows), dtype=bool)
+    last[:-1] = (group_keys[1:] != group_keys[:-1]) | (group_bars[1:] != group_bars[:-1])
+
+    bars_df = df.iloc[rows[last]].copy()
+    bar_length = (pd.Timestamp(0) + to_offset(frequency)).value
+    if bar_length < NS_PER_DAY:
+        bars_df['date'] = (group_bars[last] + bar_length).astype('datetime64[ns]')
+    else:
+        bars_df['date'] = group_bars[last].astype('datetime64[ns]')
+    if method == 'vwap' and len(rows):
+        starts = np.flatnonzero(np.r_[True, last[:-1]])
+        prices = df['price'].to_numpy(dtype=float)[rows]
+        if 'volume' in df.columns:
+            weights = pd.to_numeric(df['volume'], errors='coerce').fillna(0.0).to_numpy(dtype=float)[rows]
+        else:
+            weights = np.ones(len(rows))
+        weight_sums = np.add.reduceat(weights, starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vwap = np.add.reduceat(prices * weights, starts) / weight_sums
+        # bars with no traded volume fall back to the plain mean
+        plain_mean = np.add.reduceat(prices, starts) / np.diff(np.r_[starts, len(rows)])
+        bars_df['price'] = np.where(weight_sums > 0, vwap, plain_mean).astype(bars_df['price'].dtype)
+    order = np.argsort(bars_df['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64), kind='stable')
+    return bars_df.take(order).reset_index(drop=True)
+
+
+QUALITY_CHECKS = {
+    'Conflicting duplicate': 'Several prints for one instrument and timestamp with different prices',
+    'Outlier': 'Price jumps away and straight back (e.g. a misplaced decimal)',
+    'Jump': 'Move far outside the trailing volatility of the instrument',
+    'Stale': 'Price unchanged for many consecutive prints',
+    'Missing days': 'Business days without a print between two prints'
+}
+
+QUALITY_COLUMNS = ['Check', 'Instrument', 'Date', 'Price', 'Detail', 'Row']
+
+
+def screen_price_quality(df: pd.DataFrame, z_threshold=6.0, window=60, min_history=10,
+                         spike_threshold=0.3, stale_prints=5, duplicate_tolerance=1e-6, busdaycal=None) -> pd.DataFrame:
+    """Data-quality exceptions of a normalized price frame, one row per issue.
+
+    Runs as whole-array passes over the frame sorted by instrument and
+    timestamp, so the cost is a sort plus a few linear scans. Checks (see
+    QUALITY_CHECKS): prints sharing an instrument and timestamp whose
+    prices differ by more than `duplicate_tolerance`; outliers, where the
+    price moves more than `spike_threshold` (relative) and straight back;
+    jumps, log returns more than `z_threshold` standard deviations from the
+    trailing `window` returns (after at least `min_history` of them); runs
+    of `stale_prints` or more identical prices; and business days missing
+    between consecutive print days (weekdays, or the holiday-aware
+    `busdaycal` np.busdaycalendar). Duplicates are screened on every print, the
+    other checks on the last print per timestamp. `Row` is the frame
+    position of the print the issue is reported on.
+    """
+    if df is None or df.empty:
+        return pd.DataFrame(columns=QUALITY_COLUMNS)
+
+    ids = df['instrument_id'].to_numpy(dtype=np.int64)
+    stamps = df['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    prices = df['price'].to_numpy(dtype=float)
+    order = np.lexsort((np.arange(len(df)), stamps, ids))
+    ids, stamps, prices = ids[order], stamps[order], prices[order]
+    new_instrument = np.r_[True, ids[1:] != ids[:-1]]
+    new_stamp = new_instrument | np.r_[True, stamps[1:] != stamps[:-1]]
+    issues = []
+
+    def report(check, rows, details):
+        issues.append(pd.DataFrame({'Check': check, 'Row': rows, 'Detail': details}))
+
+    # conflicting duplicates
+    starts = np.flatnonzero(new_stamp)
+    sizes = np.diff(np.r_[starts, len(order)])
+    high = np.maximum.reduceat(prices, starts)
+    low = np.minimum.reduceat(prices, starts)
+    conflict = (sizes > 1) & (high - low > duplicate_tolerance)
+    report('Conflicting duplicate', order[starts[conflict]], [
+        f"{size} prints from {lo:,.2f} to {hi:,.2f}"
+        for size, lo, hi in zip(sizes[conflict], low[conflict], high[conflict])
+    ])
+
+    # one print per timestamp (the last) for the series checks
+    last = np.r_[new_stamp[1:], True]
+    rows, stamps, prices = order[last], stamps[last], prices[last]
+    first = np.r_[True, ids[last][1:] != ids[last][:-1]]
+    count = len(rows)
+    positions = np.arange(count)
+
+    valid = np.zeros(count, dtype=bool)
+    valid[1:] = ~first[1:] & (prices[1:] > 0) & (prices[:-1] > 0)
+    returns = np.zeros(count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[valid] = np.log(prices[1:][valid[1:]] / prices[:-1][valid[1:]])
+
+    # a print that moves away and straight back is an outlier, not a jump
+    next_valid = np.r_[valid[1:], False]
+    next_returns = np.r_[returns[1:], 0.0]
+    moved = np.abs(np.expm1(returns)) > spike_threshold
+    moved_back = np.abs(np.expm1(next_returns)) > spike_threshold
+    spike = valid & next_valid & moved & moved_back & (np.sign(returns) != np.sign(next_returns))
+    report('Outlier', rows[spike], [
+        f"{np.expm1(r) * 100:+.1f}% then {np.expm1(nr) * 100:+.1f}%"
+        for r, nr in zip(returns[spike], next_returns[spike])
+    ])
+
+    # trailing return statistics from prefix sums, excluding the current return
+    group_start = np.maximum.accumulate(np.where(first, positions, 0))
+    lo = np.minimum(np.maximum(positions - window, group_start + 1), positions)
+    sums = np.r_[0.0, np.cumsum(returns)]
+    squares = np.r_[0.0, np.cumsum(returns * returns)]
+    counts = np.r_[0, np.cumsum(valid)]
+    n = counts[positions] - counts[lo]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (sums[positions] - sums[lo]) / n
+        variance = (squares[positions] - squares[lo] - n * mean * mean) / (n - 1)
+        z = (returns - mean) / np.sqrt(np.maximum(variance, 0.0))
+    after_spike = np.r_[False, spike[:-1]]
+    jump = valid & (n >= min_history) & np.isfinite(z) & (np.abs(z) >= z_threshold) & ~spike & ~after_spike
+    report('Jump', rows[jump], [
+        f"{np.expm1(r) * 100:+.1f}% move, z = {score:+.1f}" for r, score in zip(returns[jump], z[jump])
+    ])
+
+    # stale runs of identical prices
+    repeat = ~first & np.r_[False, prices[1:] == prices[:-1]]
+    run_starts = np.flatnonzero(~repeat)
+    run_lengths = np.diff(np.r_[run_starts, count])
+    stale = run_lengths >= stale_prints
+    run_ends = run_starts + run_lengths - 1
+    report('Stale', rows[run_starts[stale]], [
+        f"unchanged for {length} prints through {pd.Timestamp(stamps[end]):%Y-%m-%d}"
+        for length, end in zip(run_lengths[stale], run_ends[stale])
+    ])
+
+    # business days missing between consecutive print days
+    days = (stamps // NS_PER_DAY).astype('datetime64[D]')
+    new_day = first | np.r_[True, days[1:] != days[:-1]]
+    day_rows, day_values, day_first = rows[new_day], days[new_day], first[new_day]
+    missing = np.zeros(len(day_values), dtype=np.int64)
+    if len(day_values) > 1:
+        if busdaycal is None:
+            missing[1:] = np.busday_count(day_values[:-1] + 1, day_values[1:])
+        else:
+            missing[1:] = np.busday_count(day_values[:-1] + 1, day_values[1:], busdaycal=busdaycal)
+    missing[day_first] = 0
+    gaps = missing > 0
+    previous_days = np.r_[day_values[:1], day_values[:-1]]
+    report('Missing days', day_rows[gaps], [
+        f"{gap} business day{'s' if gap != 1 else ''} without a print after {prev}"
+        for gap, prev in zip(missing[gaps], previous_days[gaps])
+    ])
+
+    exceptions = pd.concat(issues, ignore_index=True)
+    if exceptions.empty:
+        return pd.DataFrame(columns=QUALITY_COLUMNS)
+    flagged = exceptions['Row'].to_numpy(dtype=np.int64)
+    exceptions['Instrument'] = df['instrument'].to_numpy()[flagged].astype(str)
+    exceptions['Date'] = df['date'].to_numpy()[flagged]
+    exceptions['Price'] = df['price'].to_numpy(dtype=float)[flagged]
+    exceptions['Check'] = pd.Categorical(exceptions['Check'], categories=list(QUALITY_CHECKS))
+    exceptions = exceptions.sort_values(['Check', 'Instrument', 'Date'], kind='stable')
+    exceptions['Check'] = exceptions['Check'].astype(str)
+    return exceptions[QUALITY_COLUMNS].reset_index(drop=True)
+
+
+def compact_price_frame(df: pd.DataFrame, float32_prices=False, price_tolerance=1e-4) -> pd.DataFrame:
+    """Copy of a normalized price frame with compact column dtypes.
+
+    `instrument` and `type` become categoricals, so each distinct string is
+    stored once plus a small integer code per row. With `float32_prices`
+    prices are downcast only if every price round-trips within
+    `price_tolerance`; otherwise they stay float64.
+    """
+    compact = df.copy()
+    for column in ['instrument', 'type']:
+        if column in compact.columns:
+            compact[column] = compact[column].astype('category')
+    if 'instrument_id' in compact.columns:
+        compact['instrument_id'] = compact['instrument_id'].astype(np.int32)
+    if float32_prices and 'price' in compact.columns and len(compact):
+        prices = compact['price'].to_numpy(dtype=float)
+        downcast = prices.astype(np.float32)
+        if np.nanmax(np.abs(downcast.astype(float) - prices)) <= price_tolerance:
+            compact['price'] = downcast
+    return compact
+
+
+def expand_price_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Copy of a (possibly compact) price frame with the plain string/float64 columns used for editing and export"""
+    expanded = df.copy()
+    for column in ['instrument', 'type']:
+        if column in expanded.columns and isinstance(expanded[column].dtype, pd.CategoricalDtype):
+            expanded[column] = expanded[column].astype(str)
+    if 'price' in expanded.columns:
+        expanded['price'] = expanded['price'].astype(float)
+    return expanded
+
+
+def price_memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-column memory of a stored price frame against its plain (uncompacted) layout"""
+    plain = expand_price_frame(df).memory_usage(deep=True, index=False)
+    stored = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'Column': list(stored.index) + ['Total'],
+        'Plain (MB)': np.append(plain.reindex(stored.index).to_numpy(), plain.sum()) / 2**20,
+        'Stored (MB)': np.append(stored.to_numpy(), stored.sum()) / 2**20
+    })
+    with np.errstate(divide='ignore', invalid='ignore'):
+        report['Saving (%)'] = (1 - report['Stored (MB)'] / report['Plain (MB)']) * 100.0
+    return report
+
+
+def _stamp_instrument_keys(frame: pd.DataFrame) -> pd.MultiIndex:
+    """(price timestamp, instrument_id) per row"""
+    return pd.MultiIndex.from_arrays([
+        frame['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64),
+        frame['instrument_id'].to_numpy(dtype=np.int64)
+    ])
+
+
+def _match_storage(upserts: pd.DataFrame, frame: pd.DataFrame) -> pd.DataFrame:
+    """Cast normalized upsert rows to the stored frame's dtypes, widening categories as needed"""
+    upserts = upserts.reindex(columns=frame.columns)
+    for column in frame.columns:
+        dtype = frame[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            values = upserts[column].astype(str)
+            categories = dtype.categories.union(pd.Index(values.unique()), sort=False)
+            upserts[column] = pd.Categorical(values, categories=categories)
+        else:
+            upserts[column] = upserts[column].astype(dtype)
+    return upserts
+
+
+def apply_price_changes(frame: pd.DataFrame, deleted_positions, upserts: pd.DataFrame):
+    """Apply an editor diff to a normalized price frame without renormalizing it.
+
+    `deleted_positions` are row positions in `frame` (edited rows are deleted
+    and re-added). Each row of `upserts`, a normalized frame, replaces every
+    existing print with its timestamp and instrument_id. Only the changed rows go
+    through pandas row handling; the rest of the frame moves as whole
+    arrays. Returns the new frame and the set of instrument_ids touched.
+    """
+    keep = np.ones(len(frame), dtype=bool)
+    deleted_positions = np.asarray(list(deleted_positions), dtype=np.int64)
+    keep[deleted_positions] = False
+    has_upserts = upserts is not None and not upserts.empty
+    if has_upserts:
+        upserts = _match_storage(upserts, frame)
+        keep &= ~_stamp_instrument_keys(frame).isin(_stamp_instrument_keys(upserts))
+    changed_ids = set(frame['instrument_id'].to_numpy()[~keep].tolist())
+
+    if has_upserts:
+        changed_ids |= set(upserts['instrument_id'].tolist())
+        for column in frame.columns:
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                frame = frame.assign(**{column: frame[column].cat.set_categories(upserts[column].cat.categories)})
+        updated = pd.concat([frame[keep], upserts], ignore_index=True)
+    else:
+        updated = frame[keep]
+
+    # the kept rows are already in date order, so the stable sort is close to linear
+    order = np.argsort(updated['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64), kind='stable')
+    return updated.take(order).reset_index(drop=True), changed_ids
+
+
+def content_hash(df: pd.DataFrame) -> str:
+    """Stable hash of a price frame's contents (row order and storage dtypes included).
+
+    Every stored column except the derived instrument_id is hashed, so frames
+    differing only in an optional column such as volume stay separate sets.
+    """
+    if df is None or df.empty:
+        return hashlib.sha1(b'empty').hexdigest()
+    columns = [c for c in df.columns if c != 'instrument_id']
+    row_hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    # compact and plain copies of the same prices are separate cache entries
+    layout = ','.join(f"{c}:{df[c].dtype}" for c in columns).encode()
+    return hashlib.sha1(row_hashes.tobytes() + layout).hexdigest()
+
+
+class PriceSet:
+    """A normalized price frame and its lookup index, shared read-only between sessions.
+
+    Never mutate `frame` in place: editing prices builds a new PriceSet
+    (copy-on-write) so other sessions holding this one are unaffected.
+    """
+
+    __slots__ = ('key', 'frame', 'index', 'nbytes', 'intraday', '_views', '_views_lock', '__weakref__')
+
+    def __init__(self, key: str, frame: pd.DataFrame, index: PriceIndex = None):
+        self.key = key
+        self.frame = frame
+        self.index = index if index is not None else PriceIndex(frame)
+        index_bytes = sum(dates.nbytes + prices.nbytes for dates, prices in self.index.series.values())
+        self.nbytes = int(frame.memory_usage(deep=True).sum()) + index_bytes
+        self.intraday = has_intraday_stamps(frame)
+        self._views = OrderedDict()
+        self._views_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def view(self, method='eod', frequency='D', cutoff=None) -> 'PriceSet':
+        """Resampled bars of this set (see resample_prices), built on first use and kept with the set.
+
+        A set stamped at midnight only is its own daily end-of-day and
+        cutoff view, so daily files never pay for resampling. View memory
+        counts towards this set's `nbytes`; at most MAX_VIEWS_PER_SET views
+        are kept. Go through PriceCache.view so the cache budget is enforced.
+        """
+        if method == 'raw':
+            return self
+        if method == 'cutoff':
+            frequency = 'D'
+        if not self.intraday and frequency == 'D' and method in ('eod', 'cutoff'):
+            return self
+        view_key = (method, frequency, str(cutoff) if method == 'cutoff' else None)
+        with self._views_lock:
+            view = self._views.get(view_key)
+            if view is not None:
+                self._views.move_to_end(view_key)
+                return view
+            frame = resample_prices(self.frame, method, frequency, cutoff)
+            view = PriceSet(f"{self.key}/{'/'.join(str(part) for part in view_key if part)}", frame)
+            self._views[view_key] = view
+            self.nbytes += view.nbytes
+            while len(self._views) > MAX_VIEWS_PER_SET:
+                _, dropped = self._views.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+            return view
+
+
+class PriceCache:
+    """Process-wide LRU of PriceSets keyed by content hash, bounded by a memory budget.
+
+    Identical price histories (same content hash) resolve to one PriceSet no
+    matter how many sessions load them. Entries evicted to respect the budget
+    stay reachable through a weak reference for as long as some session still
+    holds them, so eviction never loses a session's data.
+    """
+
+    def __init__(self, memory_budget_bytes: int):
+        self.memory_budget_bytes = int(memory_budget_bytes)
+        self._entries = OrderedDict()
+        self._evicted = weakref.WeakValueDictionary()
+        self._aliases = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._evicted.get(key)
+                if entry is None:
+                    return None
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                # a resurrected entry counts against the budget again
+                self._evict()
+                return entry
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, frame: pd.DataFrame, index: PriceIndex = None) -> PriceSet:
+        """Share a normalized frame; returns the existing PriceSet if the content is already cached.
+
+        Pass `index` when it was already built (e.g. patched after an edit).
+        """
+        key = content_hash(frame)
+        with self._lock:
+            entry = self.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            entry = PriceSet(key, frame, index)
+            self._entries[key] = entry
+            self._evict()
+            return entry
+
+    def view(self, price_set: PriceSet, method='eod', frequency='D', cutoff=None) -> PriceSet:
+        """`price_set.view(...)` as a use of the set, evicting afterwards since a new view grows it"""
+        view = price_set.view(method, frequency, cutoff)
+        with self._lock:
+            if price_set.key in self._entries:
+                self._entries.move_to_end(price_set.key)
+            if view is not price_set:
+                self._evict()
+        return view
+
+    def get_or_build(self, source_key: str, builder) -> PriceSet:
+        """Look up a PriceSet by a source key (e.g. a hash of uploaded bytes), building it on a miss.
+
+        `builder` returns a normalized frame and only runs when the source
+        has not been seen, so repeated uploads skip normalization entirely.
+        """
+        with self._lock:
+            content_key = self._aliases.get(source_key)
+            entry = self.get(content_key) if content_key else None
+            if entry is not None:
+                self.hits += 1
+                return entry
+        entry = self.put(builder())
+        with self._lock:
+            self._aliases[source_key] = entry.key
+            self._aliases.move_to_end(source_key)
+            while len(self._aliases) > 1024:
+                self._aliases.popitem(last=False)
+        return entry
+
+    def _evict(self):
+        while len(self._entries) > 1 and self.total_bytes > self.memory_budget_bytes:
+            key, entry = self._entries.popitem(last=False)
+            self._evicted[key] = entry
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'total_mb': self.total_bytes / (1024 * 1024),
+                'budget_mb': self.memory_budget_bytes / (1024 * 1024),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
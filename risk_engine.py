@@ -0,0 +1,956 @@
+"""
+Risk analytics for the Oil Trading P&L app.
+
+Pure pandas/numpy functions kept outside app.py so they can be imported by
+worker processes (app.py runs Streamlit code at import time).
+"""
+
+import os
+import multiprocessing
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from market_data import INSTRUMENTS, MISSING_INSTRUMENT_ID
+
+
+DEFAULT_PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+# Volume mismatch (MT) treated as equivalent to one day between purchase and hedge date
+HEDGE_MATCH_DATE_PENALTY = 500.0
+
+
+def _to_day(value):
+    """Parse a trade date field into a normalized Timestamp (None if blank/invalid)"""
+    if value is None or value == '':
+        return None
+    try:
+        parsed = pd.to_datetime(value)
+    except Exception:
+        return None
+    if pd.isna(parsed):
+        return None
+    return parsed.normalize()
+
+
+def book_exposures(physical_trades, hedge_trades, valuation_date, default_product='') -> pd.DataFrame:
+    """Open physical and hedge positions as of a date, one row per position.
+
+    Uses the same open/closed rules as the Market P&L tab: physical lots are
+    marked via `product_name`, hedges via `contract`.
+    """
+    valuation_date = pd.to_datetime(valuation_date).normalize()
+    rows = []
+
+    for idx, trade in enumerate(physical_trades, start=1):
+        quantity = trade.get('quantity', 0) or 0
+        if quantity == 0:
+            continue
+        buy_date = _to_day(trade.get('date'))
+        if buy_date is not None and buy_date > valuation_date:
+            continue
+        sale_date = _to_day(trade.get('sale_date'))
+        if sale_date is not None and sale_date <= valuation_date:
+            continue
+        instrument = trade.get('product_name') or trade.get('product') or default_product or ''
+        rows.append({
+            'leg': 'physical',
+            'position': idx,
+            'instrument': instrument,
+            'instrument_id': INSTRUMENTS.intern(instrument),
+            'quantity': float(quantity),
+            'ref_price': float((trade.get('buy_price', 0.0) or 0.0) + (trade.get('buy_premium_discount', 0.0) or 0.0))
+        })
+
+    for idx, hedge in enumerate(hedge_trades, start=1):
+        volume = hedge.get('volume', 0) or 0
+        if volume == 0:
+            continue
+        trade_date = _to_day(hedge.get('trade_date'))
+        if trade_date is not None and trade_date > valuation_date:
+            continue
+        status = hedge.get('status', 'Open')
+        exit_date = _to_day(hedge.get('exit_date'))
+        if exit_date is not None and exit_date <= valuation_date:
+            status = 'Closed'
+        if status != 'Open':
+            continue
+        instrument = hedge.get('contract') or 'Hedge Instrument'
+        rows.append({
+            'leg': 'hedge',
+            'position': idx,
+            'instrument': instrument,
+            'instrument_id': INSTRUMENTS.intern(instrument),
+            'quantity': float(volume),
+            'ref_price': float(hedge.get('entry_price', 0.0) or 0.0)
+        })
+
+    return pd.DataFrame(rows, columns=['leg', 'position', 'instrument', 'instrument_id', 'quantity', 'ref_price'])
+
+
+def price_matrix(prices_df: pd.DataFrame, instrument_ids, end_date=None) -> pd.DataFrame:
+    """Date x instrument_id matrix of prices (last print per day), up to end_date"""
+    keys = list(dict.fromkeys(int(key) for key in instrument_ids))
+    if prices_df.empty or not keys:
+        return pd.DataFrame(columns=keys)
+    subset = prices_df[prices_df['instrument_id'].isin(keys)]
+    if end_date is not None:
+        subset = subset[subset['date'] <= pd.to_datetime(end_date)]
+    matrix = subset.pivot_table(index='date', columns='instrument_id', values='price', aggfunc='last', observed=True)
+    return matrix.reindex(columns=keys).sort_index()
+
+
+def calibrate_price_model(prices_df: pd.DataFrame, instrument_ids, valuation_date, lookback=250):
+    """Estimate spot, daily log-return drift and covariance for each instrument.
+
+    Covariance is pairwise over the last `lookback` observations and repaired
+    to be positive semi-definite so it can be factorized.
+    """
+    matrix = price_matrix(prices_df, instrument_ids, valuation_date)
+    keys = list(matrix.columns)
+    spot = matrix.ffill().iloc[-1].to_numpy(dtype=float) if not matrix.empty else np.full(len(keys), np.nan)
+
+    returns = np.log(matrix.where(matrix > 0)).diff()
+    if lookback:
+        returns = returns.tail(int(lookback))
+    counts = returns.notna().sum().to_numpy()
+    drift = returns.mean().fillna(0.0).to_numpy(dtype=float)
+    cov = returns.cov(min_periods=2).fillna(0.0).to_numpy(dtype=float) if len(keys) else np.zeros((0, 0))
+
+    # Pairwise estimates are not guaranteed PSD; clip negative eigenvalues
+    if cov.size:
+        cov = (cov + cov.T) / 2.0
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        cov = (eigvecs * np.clip(eigvals, 0.0, None)) @ eigvecs.T
+
+    return {
+        'instrument_ids': keys,
+        'spot': spot,
+        'drift': drift,
+        'cov': cov,
+        'observations': counts
+    }
+
+
+def _cholesky_psd(cov: np.ndarray) -> np.ndarray:
+    if cov.size == 0:
+        return cov
+    try:
+        return np.linalg.cholesky(cov + np.eye(len(cov)) * 1e-14)
+    except np.linalg.LinAlgError:
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        return eigvecs * np.sqrt(np.clip(eigvals, 0.0, None))
+
+
+def _run_tasks(func, tasks, max_workers=None):
+    """Run module-level `func` over `tasks`, in a process pool when more than one worker is allowed.
+
+    Returns the results in task order and the number of workers used.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(int(max_workers), len(tasks)))
+    if max_workers == 1:
+        return [func(task) for task in tasks], max_workers
+    # spawn: forking a Streamlit server process (with its threads) is unsafe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        return list(executor.map(func, tasks)), max_workers
+
+
+def _simulate_chunk(task):
+    """Simulate one block of GBM paths and value the book on every path.
+
+    Module-level so it can be pickled into a process pool.
+    """
+    rng = np.random.default_rng(task['seed'])
+    n_paths = task['n_paths']
+    steps = task['steps']
+    chol = task['chol']
+    k = len(task['spot'])
+
+    shocks = rng.standard_normal((n_paths, steps, k))
+    log_paths = shocks @ chol.T
+    log_paths += task['step_drift']
+    np.cumsum(log_paths, axis=1, out=log_paths)
+    np.exp(log_paths, out=log_paths)
+    log_paths *= task['spot']
+    paths = log_paths
+
+    physical = paths[:, -1, :] @ task['physical_qty'] - task['physical_cost']
+    hedge = paths[:, -1, :] @ task['hedge_qty'] - task['hedge_cost']
+
+    band_take = task['band_take']
+    band_net = None
+    if band_take:
+        total_qty = task['physical_qty'] + task['hedge_qty']
+        band_net = paths[:band_take] @ total_qty - (task['physical_cost'] + task['hedge_cost'])
+
+    return physical, hedge, band_net
+
+
+def simulate_pnl_distribution(prices_df: pd.DataFrame, physical_trades, hedge_trades, valuation_date,
+                              horizon_days=20, n_paths=10000, seed=None, max_workers=None,
+                              memory_cap_mb=256, lookback=250, use_drift=False, default_product='',
+                              percentiles=DEFAULT_PERCENTILES, histogram_bins=50, band_paths=20000):
+    """Monte Carlo distribution of final Net P&L for the open book.
+
+    Correlated GBM paths are generated for every instrument the open book is
+    exposed to, calibrated from the stored price history. Paths are produced
+    in chunks sized so a chunk's working arrays stay under `memory_cap_mb`;
+    each chunk gets its own child seed, so a given seed reproduces the same
+    distribution whatever the number of workers.
+    """
+    exposures = book_exposures(physical_trades, hedge_trades, valuation_date, default_product)
+    if exposures.empty:
+        return None
+
+    keys = list(dict.fromkeys(exposures['instrument_id']))
+    model = calibrate_price_model(prices_df, keys, valuation_date, lookback)
+    priced = ~np.isnan(model['spot'])
+    missing = sorted(set(exposures.loc[exposures['instrument_id'].isin(np.array(keys)[~priced]), 'instrument']))
+
+    keys = [key for key, ok in zip(keys, priced) if ok]
+    if not keys:
+        return {'missing_instruments': missing, 'n_paths': 0}
+    spot = model['spot'][priced]
+    cov = model['cov'][np.ix_(priced, priced)]
+    drift = model['drift'][priced] if use_drift else np.zeros(len(keys))
+    step_drift = drift - 0.5 * np.diag(cov)
+
+    exposures = exposures[exposures['instrument_id'].isin(keys)]
+    key_pos = {key: i for i, key in enumerate(keys)}
+    cols = exposures['instrument_id'].map(key_pos).to_numpy()
+    qty = exposures['quantity'].to_numpy(dtype=float)
+    cost = (exposures['quantity'] * exposures['ref_price']).to_numpy(dtype=float)
+    is_physical = (exposures['leg'] == 'physical').to_numpy()
+    physical_qty = np.bincount(cols[is_physical], qty[is_physical], minlength=len(keys))
+    hedge_qty = np.bincount(cols[~is_physical], qty[~is_physical], minlength=len(keys))
+
+    steps = max(int(horizon_days), 1)
+    n_paths = max(int(n_paths), 1)
+    # shocks + a couple of temporaries of the same shape per path
+    bytes_per_path = steps * len(keys) * 8 * 3
+    chunk_size = max(1, min(n_paths, int(memory_cap_mb * 1024 * 1024) // bytes_per_path))
+    starts = list(range(0, n_paths, chunk_size))
+    child_seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    band_paths = min(int(band_paths), n_paths)
+
+    chol = _cholesky_psd(cov)
+    tasks = []
+    for start, child in zip(starts, child_seeds):
+        size = min(chunk_size, n_paths - start)
+        tasks.append({
+            'seed': child,
+            'n_paths': size,
+            'steps': steps,
+            'chol': chol,
+            'spot': spot,
+            'step_drift': step_drift,
+            'physical_qty': physical_qty,
+            'hedge_qty': hedge_qty,
+            'physical_cost': float(cost[is_physical].sum()),
+            'hedge_cost': float(cost[~is_physical].sum()),
+            'band_take': max(0, min(size, band_paths - start))
+        })
+
+    results, max_workers = _run_tasks(_simulate_chunk, tasks, max_workers)
+
+    physical_pnl = np.concatenate([r[0] for r in results])
+    hedge_pnl = np.concatenate([r[1] for r in results])
+    net_pnl = physical_pnl + hedge_pnl
+
+    percentile_table = pd.DataFrame({
+        'Percentile': [f"P{p:g}" for p in percentiles],
+        'Physical P&L ($)': np.percentile(physical_pnl, percentiles),
+        'Hedge P&L ($)': np.percentile(hedge_pnl, percentiles),
+        'Net P&L ($)': np.percentile(net_pnl, percentiles)
+    })
+
+    counts, edges = np.histogram(net_pnl, bins=histogram_bins)
+    histogram = pd.DataFrame({
+        'bin_start': edges[:-1],
+        'bin_end': edges[1:],
+        'count': counts
+    })
+
+    bands = pd.DataFrame()
+    band_blocks = [r[2] for r in results if r[2] is not None and len(r[2])]
+    if band_blocks:
+        band_net = np.concatenate(band_blocks)
+        band_values = np.percentile(band_net, percentiles, axis=0)
+        bands = pd.DataFrame(band_values.T, columns=[f"P{p:g}" for p in percentiles])
+        bands.insert(0, 'day', np.arange(1, steps + 1))
+
+    return {
+        'n_paths': n_paths,
+        'horizon_days': steps,
+        'seed': seed,
+        'chunks': len(tasks),
+        'workers': max_workers,
+        'instruments': keys,
+        'spot': spot,
+        'daily_vol': np.sqrt(np.diag(cov)),
+        'physical_pnl': physical_pnl,
+        'hedge_pnl': hedge_pnl,
+        'net_pnl': net_pnl,
+        'mean_net_pnl': float(net_pnl.mean()),
+        'std_net_pnl': float(net_pnl.std()),
+        'prob_loss': float((net_pnl < 0).mean()),
+        'percentiles': percentile_table,
+        'histogram': histogram,
+        'bands': bands,
+        'missing_instruments': missing
+    }
+
+
+def latest_prices(prices_df: pd.DataFrame, instrument_ids, valuation_date) -> pd.Series:
+    """Last available price at or before the valuation date for each instrument_id"""
+    matrix = price_matrix(prices_df, instrument_ids, valuation_date)
+    if matrix.empty:
+        return pd.Series(np.nan, index=list(dict.fromkeys(instrument_ids)), dtype=float)
+    return matrix.ffill().iloc[-1].astype(float)
+
+
+def _axis_weights(axis, keys, spot):
+    """Per-instrument price move for a unit shock on one grid axis"""
+    selected = {INSTRUMENTS.intern(name) for name in axis.get('instruments', []) if name}
+    in_axis = np.array([key in selected for key in keys], dtype=float)
+    if axis.get('mode', 'absolute') == 'percent':
+        return in_axis * spot / 100.0
+    return in_axis
+
+
+def stress_test_grid(prices_df: pd.DataFrame, physical_trades, hedge_trades, valuation_date,
+                     x_axis, y_axis, default_product=''):
+    """Revalue the open book under every point of a two-axis price shock grid.
+
+    Each axis is a dict with `instruments`, `shocks` (array of shock sizes) and
+    `mode` ('absolute' in $/BBL or 'percent'). An instrument on both axes
+    receives both shocks. The whole grid is valued in one broadcast:
+    shocked prices have shape (len(y), len(x), instruments).
+    """
+    exposures = book_exposures(physical_trades, hedge_trades, valuation_date, default_product)
+    x_shocks = np.asarray(x_axis.get('shocks', [0.0]), dtype=float)
+    y_shocks = np.asarray(y_axis.get('shocks', [0.0]), dtype=float)
+    empty_grid = np.zeros((len(y_shocks), len(x_shocks)))
+    if exposures.empty:
+        return {
+            'x_shocks': x_shocks, 'y_shocks': y_shocks,
+            'physical': empty_grid, 'hedge': empty_grid.copy(), 'net': empty_grid.copy(),
+            'base_net': 0.0, 'missing_instruments': []
+        }
+
+    keys = list(dict.fromkeys(exposures['instrument_id']))
+    spot_series = latest_prices(prices_df, keys, valuation_date)
+    priced_keys = [key for key in keys if not np.isnan(spot_series.get(key, np.nan))]
+    missing = sorted(set(exposures.loc[~exposures['instrument_id'].isin(priced_keys), 'instrument']))
+    exposures = exposures[exposures['instrument_id'].isin(priced_keys)]
+    keys = priced_keys
+    spot = spot_series.reindex(keys).to_numpy(dtype=float)
+
+    key_pos = {key: i for i, key in enumerate(keys)}
+    cols = exposures['instrument_id'].map(key_pos).to_numpy(dtype=int)
+    qty = exposures['quantity'].to_numpy(dtype=float)
+    cost = (exposures['quantity'] * exposures['ref_price']).to_numpy(dtype=float)
+    is_physical = (exposures['leg'] == 'physical').to_numpy()
+    physical_qty = np.bincount(cols[is_physical], qty[is_physical], minlength=len(keys))
+    hedge_qty = np.bincount(cols[~is_physical], qty[~is_physical], minlength=len(keys))
+
+    w_x = _axis_weights(x_axis, keys, spot)
+    w_y = _axis_weights(y_axis, keys, spot)
+    shocked = (spot[None, None, :]
+               + x_shocks[None, :, None] * w_x[None, None, :]
+               + y_shocks[:, None, None] * w_y[None, None, :])
+
+    physical = shocked @ physical_qty - cost[is_physical].sum()
+    hedge = shocked @ hedge_qty - cost[~is_physical].sum()
+
+    return {
+        'x_shocks': x_shocks,
+        'y_shocks': y_shocks,
+        'physical': physical,
+        'hedge': hedge,
+        'net': physical + hedge,
+        'base_net': float(spot @ (physical_qty + hedge_qty) - cost.sum()),
+        'instruments': [INSTRUMENTS.name(key) for key in keys],
+        'missing_instruments': missing
+    }
+
+
+def _contract_offset(contract: pd.Series) -> pd.Series:
+    """Months ahead encoded in relative hedge labels such as 'GASOIL Mo2'"""
+    return pd.to_numeric(contract.astype(str).str.extract(r'[Mm]o\s*(\d+)\s*$')[0], errors='coerce')
+
+
+def _column(frame: pd.DataFrame, name, default) -> pd.Series:
+    if name in frame.columns:
+        return frame[name]
+    return pd.Series(default, index=frame.index)
+
+
+def _dates(values: pd.Series) -> pd.Series:
+    return pd.to_datetime(values.replace('', None), errors='coerce').dt.normalize()
+
+
+def trade_book_frame(physical_trades, hedge_trades, default_product='') -> pd.DataFrame:
+    """Physical lots and hedges as one columnar frame with a delivery month/tenor.
+
+    Physical lots are bucketed by purchase month. Hedges use their expiry
+    month when given, otherwise the trade month shifted by the Mo<n> offset.
+    """
+    columns = ['leg', 'position', 'instrument', 'instrument_id', 'start', 'end', 'status', 'quantity', 'tenor']
+    frames = []
+
+    if physical_trades:
+        phys = pd.DataFrame(physical_trades)
+        instrument = _column(phys, 'product_name', '').fillna('').astype(str)
+        instrument = instrument.where(instrument != '', _column(phys, 'product', '').fillna('').astype(str))
+        start = _dates(_column(phys, 'date', None))
+        frames.append(pd.DataFrame({
+            'leg': 'physical',
+            'position': np.arange(1, len(phys) + 1),
+            'instrument': instrument.where(instrument != '', default_product or ''),
+            'start': start,
+            'end': _dates(_column(phys, 'sale_date', None)),
+            'status': 'Open',
+            'quantity': pd.to_numeric(_column(phys, 'quantity', 0.0), errors='coerce').fillna(0.0).astype(float),
+            'tenor': start.dt.to_period('M')
+        }))
+
+    if hedge_trades:
+        hedges = pd.DataFrame(hedge_trades)
+        contract = _column(hedges, 'contract', '').fillna('').astype(str)
+        start = _dates(_column(hedges, 'trade_date', None))
+        expiry = _dates(_column(hedges, 'expiry', None))
+        shifted = start.dt.to_period('M') + _contract_offset(contract).fillna(0).astype(int).to_numpy()
+        frames.append(pd.DataFrame({
+            'leg': 'hedge',
+            'position': np.arange(1, len(hedges) + 1),
+            'instrument': contract.where(contract != '', 'Hedge Instrument'),
+            'start': start,
+            'end': _dates(_column(hedges, 'exit_date', None)),
+            'status': _column(hedges, 'status', 'Open').fillna('Open'),
+            'quantity': pd.to_numeric(_column(hedges, 'volume', 0.0), errors='coerce').fillna(0.0).astype(float),
+            'tenor': expiry.dt.to_period('M').where(expiry.notna(), shifted)
+        }))
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    book = pd.concat(frames, ignore_index=True)
+    book['instrument_id'] = INSTRUMENTS.intern_many(book['instrument'])
+    return book[columns]
+
+
+def exposure_ladder(book: pd.DataFrame, as_of) -> pd.DataFrame:
+    """Net open physical quantity against hedge volume per instrument and tenor.
+
+    One vectorized open-position mask followed by a single grouped
+    aggregation over the book frame from `trade_book_frame`.
+    """
+    result_columns = ['Instrument', 'Tenor', 'Physical (MT)', 'Hedge (MT)', 'Net (MT)']
+    if book.empty:
+        return pd.DataFrame(columns=result_columns)
+
+    as_of = pd.to_datetime(as_of).normalize()
+    started = book['start'].isna() | (book['start'] <= as_of)
+    ended = book['end'].notna() & (book['end'] <= as_of)
+    still_open = (book['leg'] == 'physical') | (book['status'] == 'Open')
+    open_book = book[started & ~ended & still_open & (book['quantity'] != 0)]
+    if open_book.empty:
+        return pd.DataFrame(columns=result_columns)
+
+    ladder = (open_book.assign(tenor=open_book['tenor'].astype(str).fillna('Unspecified').replace('NaT', 'Unspecified'))
+                       .groupby(['instrument_id', 'tenor', 'leg'])['quantity'].sum()
+                       .unstack('leg', fill_value=0.0)
+                       .reindex(columns=['physical', 'hedge'], fill_value=0.0)
+                       .reset_index())
+    ladder['net'] = ladder['physical'] + ladder['hedge']
+    ladder['instrument_id'] = ladder['instrument_id'].map(INSTRUMENTS.name)
+    ladder.columns = result_columns
+    return ladder.sort_values(['Tenor', 'Instrument']).reset_index(drop=True)
+
+
+def _rolling_sums(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing window sums along axis 0 from one cumulative sum"""
+    cumulative = np.cumsum(values, axis=0)
+    sums = cumulative.copy()
+    sums[window:] -= cumulative[:-window]
+    return sums
+
+
+def hedge_effectiveness(prices_df: pd.DataFrame, products, contracts, window=20, min_periods=None):
+    """Rolling and full-period hedge effectiveness for every product/contract pair.
+
+    Works on daily $/BBL price changes of the physical product (y) and the
+    hedge contract (x): regression beta (the minimum-variance / optimal hedge
+    ratio), R², and the dollar-offset ratio of cumulative hedge moves to
+    cumulative physical moves. All pairs are evaluated at once from trailing
+    sums built with cumulative sums, so cost is independent of the window.
+    """
+    products = [p for p in dict.fromkeys(products) if p]
+    contracts = [c for c in dict.fromkeys(contracts) if c]
+    ids = {name: INSTRUMENTS.intern(name) for name in products + contracts}
+    matrix = price_matrix(prices_df, [i for i in ids.values() if i != MISSING_INSTRUMENT_ID])
+    summary_columns = ['Product', 'Hedge Contract', 'Observations', 'Correlation', 'Beta', 'R²',
+                       'Dollar Offset (%)', 'Optimal Hedge Ratio', 'Rolling R² (latest)', 'Effective']
+    if matrix.empty or len(matrix) < 3:
+        return {'summary': pd.DataFrame(columns=summary_columns), 'dates': pd.DatetimeIndex([]), 'pairs': []}
+
+    available = set(matrix.columns[matrix.notna().sum() >= 3])
+    pairs = [(p, c) for p in products for c in contracts
+             if ids[p] in available and ids[c] in available and ids[p] != ids[c]]
+    if not pairs:
+        return {'summary': pd.DataFrame(columns=summary_columns), 'dates': pd.DatetimeIndex([]), 'pairs': []}
+
+    col_pos = {key: i for i, key in enumerate(matrix.columns)}
+    product_idx = np.array([col_pos[ids[p]] for p, _ in pairs])
+    contract_idx = np.array([col_pos[ids[c]] for _, c in pairs])
+
+    changes = np.diff(matrix.to_numpy(dtype=float), axis=0)
+    y = changes[:, product_idx]
+    x = changes[:, contract_idx]
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    stacked = np.stack([valid.astype(float), x, y, x * x, y * y, x * y])
+
+    window = max(int(window), 2)
+    if min_periods is None:
+        min_periods = max(3, window // 2)
+
+    def regression(sums):
+        n, sx, sy, sxx, syy, sxy = sums
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = n * sxy - sx * sy
+            var_x = n * sxx - sx * sx
+            var_y = n * syy - sy * sy
+            beta = cov / var_x
+            r2 = cov * cov / (var_x * var_y)
+            offset = sx / sy * 100.0
+        return beta, r2, offset
+
+    rolling = np.stack([_rolling_sums(stacked[i], window) for i in range(len(stacked))])
+    rolling_beta, rolling_r2, rolling_offset = regression(rolling)
+    enough = rolling[0] >= min_periods
+    rolling_beta[~enough] = np.nan
+    rolling_r2[~enough] = np.nan
+    rolling_offset[~enough] = np.nan
+
+    beta, r2, offset = regression(stacked.sum(axis=1))
+    latest_r2 = pd.DataFrame(rolling_r2).ffill().iloc[-1].to_numpy()
+    summary = pd.DataFrame({
+        'Product': [p for p, _ in pairs],
+        'Hedge Contract': [c for _, c in pairs],
+        'Observations': stacked[0].sum(axis=0).astype(int),
+        'Correlation': np.sign(beta) * np.sqrt(r2),
+        'Beta': beta,
+        'R²': r2,
+        'Dollar Offset (%)': offset,
+        'Optimal Hedge Ratio': beta,
+        'Rolling R² (latest)': latest_r2
+    })
+    summary['Effective'] = (summary['R²'] >= 0.8) & summary['Dollar Offset (%)'].between(80, 125)
+    summary = summary.sort_values('R²', ascending=False, na_position='last').reset_index(drop=True)
+
+    return {
+        'summary': summary[summary_columns],
+        'dates': matrix.index[1:],
+        'pairs': pairs,
+        'rolling_beta': rolling_beta,
+        'rolling_r2': rolling_r2,
+        'rolling_offset': rolling_offset
+    }
+
+
+def rolling_effectiveness_frame(result, product, contract) -> pd.DataFrame:
+    """Rolling beta / R² / dollar offset for one pair from `hedge_effectiveness`"""
+    if (product, contract) not in result['pairs']:
+        return pd.DataFrame(columns=['date', 'beta', 'r2', 'dollar_offset'])
+    i = result['pairs'].index((product, contract))
+    return pd.DataFrame({
+        'date': result['dates'],
+        'beta': result['rolling_beta'][:, i],
+        'r2': result['rolling_r2'][:, i],
+        'dollar_offset': result['rolling_offset'][:, i]
+    })
+
+
+def _greedy_assignment(savings: np.ndarray, candidates_per_row=8):
+    """Approximate assignment: best pairs first among each free row's top free candidates.
+
+    Repeats over the rows and columns still free until no profitable
+    (negative) pair is left.
+    """
+    n_rows, n_cols = savings.shape
+    row_match = np.full(n_rows, -1)
+    col_free = np.ones(n_cols, dtype=bool)
+    while True:
+        free_rows = np.flatnonzero(row_match < 0)
+        free_cols = np.flatnonzero(col_free)
+        if not len(free_rows) or not len(free_cols):
+            break
+        sub = savings[np.ix_(free_rows, free_cols)]
+        k = min(candidates_per_row, len(free_cols))
+        cand = np.argpartition(sub, k - 1, axis=1)[:, :k]
+        rows = np.repeat(np.arange(len(free_rows)), k)
+        cols = cand.ravel()
+        values = sub[rows, cols]
+        profitable = values < 0
+        if not profitable.any():
+            break
+        order = np.argsort(values[profitable], kind='stable')
+        added = 0
+        for row, col in zip(free_rows[rows[profitable][order]], free_cols[cols[profitable][order]]):
+            if row_match[row] < 0 and col_free[col]:
+                row_match[row] = col
+                col_free[col] = False
+                added += 1
+        if not added:
+            break
+    rows = np.flatnonzero(row_match >= 0)
+    return rows, row_match[rows]
+
+
+def match_hedges_to_lots(open_lots, open_hedges, date_penalty=HEDGE_MATCH_DATE_PENALTY, max_gap_days=None):
+    """Propose which open hedge to close against each pending physical lot.
+
+    `open_lots` / `open_hedges` are [(position, trade)] lists as kept by
+    `trade_book.OpenPositionIndex`. Leaving a lot or hedge unmatched costs
+    its full volume; matching a pair costs the residual volume mismatch
+    plus `date_penalty` MT per day between purchase and hedge trade date.
+    Only hedges opposite in sign to the lot qualify, within `max_gap_days`.
+
+    Subtracting the unmatched costs turns this into an assignment whose
+    pair savings are `2 * min(lot, hedge) - date_penalty * gap`; clipping
+    unprofitable pairs to zero lets a rectangular solver also choose to
+    leave positions unmatched. Uses scipy's linear_sum_assignment when
+    available and a greedy fallback otherwise.
+    """
+    columns = ['Lot', 'Hedge', 'Lot Quantity (MT)', 'Hedge Volume (MT)', 'Mismatch (MT)', 'Date Gap (days)']
+    result = {'matches': pd.DataFrame(columns=columns), 'method': None,
+              'unmatched_lots': [p for p, _ in open_lots], 'unmatched_hedges': [p for p, _ in open_hedges]}
+    if not open_lots or not open_hedges:
+        return result
+
+    lot_positions = np.array([p for p, _ in open_lots])
+    hedge_positions = np.array([p for p, _ in open_hedges])
+    quantity = np.array([float(t.get('quantity', 0) or 0) for _, t in open_lots])
+    volume = np.array([float(h.get('volume', 0) or 0) for _, h in open_hedges])
+    lot_day = _dates(pd.Series([t.get('date') for _, t in open_lots], dtype=object)).to_numpy(dtype='datetime64[D]')
+    hedge_day = _dates(pd.Series([h.get('trade_date') for _, h in open_hedges], dtype=object)).to_numpy(dtype='datetime64[D]')
+
+    gap = np.abs((lot_day[:, None] - hedge_day[None, :]).astype('timedelta64[D]').astype(float))
+    gap = np.where(np.isnat(lot_day)[:, None] | np.isnat(hedge_day)[None, :], 0.0, gap)
+    matched = np.minimum(np.abs(quantity)[:, None], np.abs(volume)[None, :])
+    savings = -2.0 * matched + date_penalty * gap
+    eligible = np.sign(quantity)[:, None] * np.sign(volume)[None, :] < 0
+    if max_gap_days is not None:
+        eligible &= gap <= max_gap_days
+    savings = np.where(eligible, np.minimum(savings, 0.0), 0.0)
+
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        rows, cols = _greedy_assignment(savings)
+        result['method'] = 'greedy'
+    else:
+        rows, cols = linear_sum_assignment(savings)
+        result['method'] = 'optimal'
+    keep = savings[rows, cols] < 0
+    rows, cols = rows[keep], cols[keep]
+
+    order = np.argsort(lot_positions[rows], kind='stable')
+    rows, cols = rows[order], cols[order]
+    result['matches'] = pd.DataFrame({
+        'Lot': lot_positions[rows],
+        'Hedge': hedge_positions[cols],
+        'Lot Quantity (MT)': quantity[rows],
+        'Hedge Volume (MT)': volume[cols],
+        'Mismatch (MT)': np.abs(quantity[rows]) - np.abs(volume[cols]),
+        'Date Gap (days)': gap[rows, cols].astype(int)
+    }, columns=columns)
+    result['unmatched_lots'] = sorted(set(lot_positions.tolist()) - set(lot_positions[rows].tolist()))
+    result['unmatched_hedges'] = sorted(set(hedge_positions.tolist()) - set(hedge_positions[cols].tolist()))
+    return result
+
+
+def policy_grid(contracts, hedge_ratios):
+    """Every contract x hedge ratio combination as backtest policies (ratios as fractions)"""
+    return [{'name': f"{contract} @ {ratio:.0%}", 'contract': contract, 'hedge_ratio': float(ratio)}
+            for contract in contracts for ratio in hedge_ratios]
+
+
+def _held_quantity(starts, ends, quantity, n_days) -> np.ndarray:
+    """Quantity held on each day t with start < t <= end, from one cumulative sum"""
+    delta = np.zeros(n_days + 1)
+    np.add.at(delta, starts + 1, quantity)
+    np.add.at(delta, ends + 1, -quantity)
+    return np.cumsum(delta)[:n_days]
+
+
+def _backtest_chunk(task):
+    """Evaluate a block of hedge policies over the whole trade set.
+
+    Module-level so it can be pickled into a process pool.
+    """
+    hedge_prices = task['hedge_prices']
+    hedge_changes = task['hedge_changes']
+    starts, ends, quantity = task['starts'], task['ends'], task['quantity']
+    n_days = len(hedge_prices)
+    rows = []
+    paths = []
+    for ratio, column in task['policies']:
+        entry = hedge_prices[starts, column]
+        exit_ = hedge_prices[ends, column]
+        hedgeable = ~(np.isnan(entry) | np.isnan(exit_))
+        # short ratio x quantity of the contract for the life of each lot
+        hedge_pnl = -ratio * float(np.sum(quantity[hedgeable] * (exit_[hedgeable] - entry[hedgeable])))
+        held = _held_quantity(starts[hedgeable], ends[hedgeable], quantity[hedgeable], n_days)
+        daily = task['physical_daily'] - ratio * hedge_changes[:, column] * held
+        paths.append(np.cumsum(daily))
+        active = task['active_days']
+        rows.append((hedge_pnl, float(daily[active].std()) if active.any() else 0.0, int(hedgeable.sum())))
+    return rows, np.column_stack(paths) if paths else np.zeros((n_days, 0))
+
+
+def backtest_hedge_policies(prices_df: pd.DataFrame, physical_trades, policies, default_product='',
+                            end_date=None, max_workers=1, policies_per_chunk=16, trading_days=252):
+    """Replay historical physical lots under alternative hedge policies.
+
+    Each policy is a dict with `contract` and `hedge_ratio` (fraction of lot
+    quantity, e.g. 0.8) and an optional `name`. Every lot is hedged with a
+    short of ratio x quantity in the policy's contract from its purchase
+    date to its sale date (or `end_date`/the last price date while open),
+    entering and exiting at the as-of settlement price. The physical leg is
+    realised at the trade's own buy/sale prices, or marked at the last
+    product price while open.
+
+    Lots are vectorized: the book's daily P&L is built from the held
+    quantity per day (cumulative sums of lot starts/ends) times daily price
+    changes, so a policy costs O(days + lots). Policies are split into
+    chunks that run in a process pool when `max_workers` > 1.
+    """
+    summary_columns = ['Policy', 'Contract', 'Hedge Ratio (%)', 'Physical P&L ($)', 'Hedge P&L ($)', 'Net P&L ($)',
+                       'Daily P&L Std ($)', 'Annualized Vol ($)', 'Max Drawdown ($)', 'Hedged Lots']
+    empty = {'summary': pd.DataFrame(columns=summary_columns), 'cumulative': pd.DataFrame(),
+             'lots': 0, 'skipped_lots': [], 'missing_contracts': [], 'chunks': 0, 'workers': 0}
+    book = trade_book_frame(physical_trades, [], default_product)
+    if prices_df.empty or book.empty or not policies:
+        return empty
+
+    contracts = list(dict.fromkeys(policy['contract'] for policy in policies))
+    contract_ids = [INSTRUMENTS.intern(contract) for contract in contracts]
+    product_ids = list(dict.fromkeys(book['instrument_id']))
+    matrix = price_matrix(prices_df, product_ids + contract_ids, end_date).ffill()
+    if matrix.empty:
+        return empty
+    missing_contracts = [c for c, i in zip(contracts, contract_ids) if matrix[i].isna().all()]
+    dates = matrix.index
+    n_days = len(dates)
+    day_values = dates.to_numpy(dtype='datetime64[ns]')
+
+    trades = pd.DataFrame(physical_trades)
+    buy = (pd.to_numeric(_column(trades, 'buy_price', 0.0), errors='coerce').fillna(0.0)
+           + pd.to_numeric(_column(trades, 'buy_premium_discount', 0.0), errors='coerce').fillna(0.0)).to_numpy()
+    sale = (pd.to_numeric(_column(trades, 'sale_price', 0.0), errors='coerce').fillna(0.0)
+            + pd.to_numeric(_column(trades, 'sale_premium_discount', 0.0), errors='coerce').fillna(0.0)).to_numpy()
+    sold = (pd.to_numeric(_column(trades, 'sale_price', 0.0), errors='coerce').fillna(0.0) != 0).to_numpy()
+
+    quantity = book['quantity'].to_numpy(dtype=float)
+    starts = np.searchsorted(day_values, book['start'].to_numpy(dtype='datetime64[ns]'), side='right') - 1
+    end_values = book['end'].to_numpy(dtype='datetime64[ns]')
+    ends = np.where(np.isnat(end_values), n_days - 1,
+                    np.searchsorted(day_values, end_values, side='right') - 1)
+    valid = (quantity != 0) & book['start'].notna().to_numpy() & (starts >= 0) & (ends > starts)
+    skipped = (np.flatnonzero(~valid) + 1).tolist()
+    starts, ends, quantity = starts[valid], ends[valid], quantity[valid]
+    buy, sale, sold = buy[valid], sale[valid], sold[valid]
+    product_cols = matrix.columns.get_indexer(book['instrument_id'].to_numpy()[valid])
+
+    prices = matrix.to_numpy(dtype=float)
+    changes = np.nan_to_num(np.diff(prices, axis=0, prepend=prices[:1]))
+    mark = prices[ends, product_cols]
+    physical_values = np.where(sold, (sale - buy) * quantity, (mark - buy) * quantity)
+    physical_pnl = float(np.nansum(physical_values))
+
+    physical_daily = np.zeros(n_days)
+    for column in np.unique(product_cols):
+        in_product = product_cols == column
+        physical_daily += changes[:, column] * _held_quantity(starts[in_product], ends[in_product], quantity[in_product], n_days)
+    active_days = _held_quantity(starts, ends, np.ones(len(starts)), n_days) > 0
+
+    contract_cols = matrix.columns.get_indexer(contract_ids)
+    policy_specs = [(float(policy['hedge_ratio']), contract_cols[contracts.index(policy['contract'])]) for policy in policies]
+    chunk = max(int(policies_per_chunk), 1)
+    tasks = [{
+        'hedge_prices': prices,
+        'hedge_changes': changes,
+        'starts': starts,
+        'ends': ends,
+        'quantity': quantity,
+        'physical_daily': physical_daily,
+        'active_days': active_days,
+        'policies': policy_specs[i:i + chunk]
+    } for i in range(0, len(policy_specs), chunk)]
+    results, workers = _run_tasks(_backtest_chunk, tasks, max_workers)
+
+    rows = [row for chunk_rows, _ in results for row in chunk_rows]
+    names = [policy.get('name') or f"{policy['contract']} @ {float(policy['hedge_ratio']):.0%}" for policy in policies]
+    cumulative = pd.DataFrame(np.column_stack([paths for _, paths in results]), index=dates, columns=names)
+    drawdown = (cumulative.cummax() - cumulative).max().to_numpy()
+
+    summary = pd.DataFrame({
+        'Policy': names,
+        'Contract': [policy['contract'] for policy in policies],
+        'Hedge Ratio (%)': [float(policy['hedge_ratio']) * 100.0 for policy in policies],
+        'Physical P&L ($)': physical_pnl,
+        'Hedge P&L ($)': [row[0] for row in rows],
+        'Net P&L ($)': [physical_pnl + row[0] for row in rows],
+        'Daily P&L Std ($)': [row[1] for row in rows],
+        'Annualized Vol ($)': [row[1] * np.sqrt(trading_days) for row in rows],
+        'Max Drawdown ($)': drawdown,
+        'Hedged Lots': [row[2] for row in rows]
+    }, columns=summary_columns)
+
+    return {
+        'summary': summary,
+        'cumulative': cumulative,
+        'lots': int(valid.sum()),
+        'skipped_lots': skipped,
+        'missing_contracts': missing_contracts,
+        'chunks': len(tasks),
+        'workers': workers
+    }
+
+
+class ValuationCache:
+    """Bounded LRU of valuation snapshots with hit/miss counters"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = int(max_entries)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, key, compute):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        value = compute()
+        self._entries[key] = value
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class ChunkedSeriesJob:
+    """Values a date axis in chunks on an executor so results can be shown as they arrive.
+
+    `value_chunk(dates, cancel_event)` returns a frame with a 'date' column
+    and should return early once `cancel_event` is set. `key` identifies
+    the inputs (book/prices/settings); a job whose key no longer matches
+    is cancelled and replaced by the caller.
+
+    At most `max_queued` chunks of a job sit on the executor at once; each
+    finished chunk queues the next. Jobs sharing one executor therefore
+    take turns instead of one long history holding up everyone queued
+    behind it.
+    """
+
+    def __init__(self, key, dates, value_chunk, executor, chunk_size=25, max_queued=2):
+        self.key = key
+        self.total_dates = len(dates)
+        self._cancel_event = threading.Event()
+        self._value_chunk = value_chunk
+        self._executor = executor
+        chunk_size = max(int(chunk_size), 1)
+        # one placeholder per chunk, completed when the chunk is valued
+        self._futures = [Future() for _ in range(0, len(dates), chunk_size)]
+        self._pending = deque(
+            (future, dates[start:start + chunk_size])
+            for future, start in zip(self._futures, range(0, len(dates), chunk_size))
+        )
+        self._pending_lock = threading.Lock()
+        for _ in range(min(max(int(max_queued), 1), len(self._futures))):
+            self._submit_next()
+
+    def _submit_next(self):
+        while True:
+            with self._pending_lock:
+                if not self._pending:
+                    return
+                future, dates = self._pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._executor.submit(self._run_chunk, future, dates)
+                return
+            except RuntimeError:
+                # the executor is shutting down: value the rest on this thread
+                self._value_into(future, dates)
+
+    def _run_chunk(self, future, dates):
+        self._value_into(future, dates)
+        self._submit_next()
+
+    def _value_into(self, future, dates):
+        try:
+            result = None if self._cancel_event.is_set() else self._value_chunk(dates, self._cancel_event)
+        except BaseException as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    def cancel(self):
+        self._cancel_event.set()
+        for future in self._futures:
+            future.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def chunks_done(self) -> int:
+        return sum(future.done() for future in self._futures)
+
+    @property
+    def chunks_total(self) -> int:
+        return len(self._futures)
+
+    @property
+    def done(self) -> bool:
+        return all(future.done() for future in self._futures)
+
+    def errors(self):
+        return [future.exception() for future in self._futures
+                if future.done() and not future.cancelled() and future.exception() is not None]
+
+    def completed_frame(self) -> pd.DataFrame:
+        frames = [future.result() for future in self._futures
+                  if future.done() and not future.cancelled() and future.exception() is None
+                  and future.result() is not None]
+        if not frames:
+            return pd.DataFrame(columns=['date', 'physical_pnl', 'hedge_pnl', 'net_pnl'])
+        return pd.concat(frames, ignore_index=True).sort_values('date').reset_index(drop=True)
@@ -0,0 +1,124 @@
+"""
+Contract roll calendar for relative (Moₙ) hedge contract labels.
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# Expiry rule per contract family (upper-case family name). A family also
+# covers its grades: 'GASOIL 500PPM' takes the 'GASOIL' rule (the longest
+# listed prefix wins). A 'day' rule expires `business_days_before` business days before calendar day `day`
+# of the contract month (ICE Low Sulphur Gasoil: two business days before
+# the 14th). A 'month_end' rule expires on the last business day of the
+# month before the contract month, as Platts month swaps do.
+EXPIRY_RULES = {
+    'GASOIL': {'rule': 'day', 'day': 14, 'business_days_before': 2}
+}
+
+DEFAULT_EXPIRY_RULE = {'rule': 'month_end'}
+
+RELATIVE_LABEL = re.compile(r'^\s*(?P<family>.*\S)\s+Mo(?P<offset>\d+)\s*$', re.IGNORECASE)
+
+
+def parse_relative_label(label):
+    """(family, n) for a relative contract label such as 'GASOIL Mo2', else None"""
+    match = RELATIVE_LABEL.match(str(label or ''))
+    if match is None or int(match.group('offset')) < 1:
+        return None
+    return ' '.join(match.group('family').split()).upper(), int(match.group('offset'))
+
+
+def expiry_rule(family: str) -> dict:
+    """Expiry rule of a family: its own entry, else the longest listed family it is a grade of"""
+    words = family.upper().split()
+    for size in range(len(words), 0, -1):
+        rule = EXPIRY_RULES.get(' '.join(words[:size]))
+        if rule is not None:
+            return rule
+    return DEFAULT_EXPIRY_RULE
+
+
+def relative_label(family: str, offset: int) -> str:
+    """Price-file instrument name of the n-th nearby contract of a family"""
+    return f"{family} Mo{offset}"
+
+
+def to_days(dates) -> np.ndarray:
+    return pd.to_datetime(np.atleast_1d(np.asarray(dates))).to_numpy(dtype='datetime64[D]')
+
+
+def month_label(month: int) -> str:
+    """'Feb-24' for a month number (months since 1970-01)"""
+    return pd.Timestamp(np.datetime64(int(month), 'M')).strftime('%b-%y')
+
+
+def contract_expiries(family: str, months) -> np.ndarray:
+    """Last trading day of each contract month (months since 1970-01) under the family's rule"""
+    rule = expiry_rule(family)
+    first_days = np.asarray(months, dtype=np.int64).astype('datetime64[M]').astype('datetime64[D]')
+    if rule['rule'] == 'day':
+        return np.busday_offset(first_days + (rule['day'] - 1), -rule['business_days_before'], roll='forward')
+    return np.busday_offset(first_days, -1, roll='forward')
+
+
+class RollCalendar:
+    """Front contract month of one family for every day of a date range.
+
+    The table is built once with a single `np.searchsorted` over the
+    contract expiries; after that resolving a label is array indexing. A
+    contract is front month up to and including its expiry day. Months are
+    integers counted from 1970-01, so contract arithmetic is plain integer
+    arithmetic.
+    """
+
+    def __init__(self, family: str, start, end):
+        self.family = family.upper()
+        self.start = to_days(start)[0]
+        self.end = to_days(end)[0]
+        if self.end < self.start:
+            raise ValueError("Roll calendar end must not be before its start")
+        first_month = int(self.start.astype('datetime64[M]').astype(np.int64)) - 1
+        last_month = int(self.end.astype('datetime64[M]').astype(np.int64)) + 3
+        self.months = np.arange(first_month, last_month + 1, dtype=np.int64)
+        self.expiries = contract_expiries(self.family, self.months)
+        days = np.arange(self.start, self.end + 1)
+        self.front = self.months[np.searchsorted(self.expiries, days, side='left')]
+
+    def _day_positions(self, days) -> np.ndarray:
+        positions = (to_days(days) - self.start).astype(np.int64)
+        if len(positions) and (positions.min() < 0 or positions.max() >= len(self.front)):
+            raise ValueError(f"Dates outside the {self.family} roll calendar range {self.start} to {self.end}")
+        return positions
+
+    def front_months(self, days) -> np.ndarray:
+        return self.front[self._day_positions(days)]
+
+    def contract_months(self, offsets, trade_days) -> np.ndarray:
+        """Absolute contract month of Mo`offsets[i]` traded on `trade_days[i]`"""
+        return self.front_months(trade_days) + np.asarray(offsets, dtype=np.int64) - 1
+
+    def nearby_offsets(self, contract_months, valuation_days) -> np.ndarray:
+        """contracts × dates array of each contract's Moₙ position; below 1 once it has expired"""
+        contract_months = np.asarray(contract_months, dtype=np.int64)
+        return contract_months[:, None] - self.front_months(valuation_days)[None, :] + 1
+
+    def expiry(self, contract_months) -> np.ndarray:
+        contract_months = np.asarray(contract_months, dtype=np.int64)
+        inside = (contract_months >= self.months[0]) & (contract_months <= self.months[-1])
+        if inside.all():
+            return self.expiries[contract_months - self.months[0]]
+        return contract_expiries(self.family, contract_months)
+
+
+@lru_cache(maxsize=32)
+def _cached_calendar(family: str, start_year: int, end_year: int) -> RollCalendar:
+    return RollCalendar(family, f"{start_year}-01-01", f"{end_year}-12-31")
+
+
+def roll_calendar(family: str, start, end) -> RollCalendar:
+    """Shared calendar covering `start`..`end`, built per whole calendar years so nearby ranges reuse it"""
+    return _cached_calendar(family.upper(), pd.Timestamp(start).year, pd.Timestamp(end).year)
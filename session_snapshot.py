@@ -0,0 +1,220 @@
+"""
+Compact binary snapshots of a session: trades, hedges, prices and metadata.
+
+Layout (all integers little-endian):
+
+    magic     8 bytes   b'OTPNLSNP'
+    version   uint16    SNAPSHOT_VERSION
+    checksum  32 bytes  SHA-256 of everything after it
+    length    uint32    size of the JSON header
+    header    JSON      metadata plus, per table, its row count and columns
+    body      zlib      column buffers back to back
+
+Columns are stored as raw NumPy buffers: numbers and booleans as-is,
+timestamps as delta-encoded int64 ticks of their unit and strings as int32 codes into a category
+list kept in the header. A trade column with missing entries (a key some
+trade dicts lack) or None values also stores a mask for them, and a float
+column holding ints marks which, so trade dicts round-trip exactly.
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+MAGIC = b'OTPNLSNP'
+SNAPSHOT_VERSION = 1
+# versions this reader understands
+READABLE_VERSIONS = {1}
+FILE_EXTENSION = 'otpnl'
+
+_PREFIX = struct.Struct('<8sH32s')
+_LENGTH = struct.Struct('<I')
+
+
+class SnapshotError(ValueError):
+    """Raised for a file that is not a readable, intact snapshot"""
+
+
+def _column_kind(values) -> str:
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, (bool, np.bool_)) for value in present):
+        return 'bool'
+    if all(isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)) for value in present):
+        return 'int'
+    if all(isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_)) for value in present):
+        return 'float'
+    if all(isinstance(value, str) for value in present):
+        return 'str'
+    return 'json'
+
+
+class _Writer:
+    def __init__(self):
+        self.buffers = []
+        self.offset = 0
+
+    def add(self, array: np.ndarray) -> dict:
+        data = np.ascontiguousarray(array).tobytes()
+        spec = {'dtype': array.dtype.str, 'offset': self.offset, 'nbytes': len(data)}
+        self.buffers.append(data)
+        self.offset += len(data)
+        return spec
+
+
+def _encode_strings(writer: _Writer, values) -> dict:
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+        codes, categories = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, categories = pd.factorize(values if isinstance(values, pd.Series) else pd.Series(values, dtype=object))
+    return {'codes': writer.add(codes.astype(np.int32)), 'categories': [str(category) for category in categories]}
+
+
+def _encode_frame(writer: _Writer, frame: pd.DataFrame) -> dict:
+    """Columns of a typed frame (prices): numbers, datetimes, strings/categoricals"""
+    columns = []
+    for name in frame.columns:
+        series = frame[name]
+        spec = {'name': str(name)}
+        if isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(series.dtype) or series.dtype == object:
+            spec['kind'] = 'str'
+            spec.update(_encode_strings(writer, series))
+        elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+            # sorted timestamps differ by near-constant steps, which compress to almost nothing
+            stamps = series.to_numpy()
+            spec['kind'] = 'datetime'
+            spec['unit'] = np.datetime_data(stamps.dtype)[0]
+            spec['data'] = writer.add(np.diff(stamps.view(np.int64), prepend=np.int64(0)))
+        else:
+            spec['kind'] = 'array'
+            spec['data'] = writer.add(series.to_numpy())
+        columns.append(spec)
+    return {'rows': len(frame), 'columns': columns}
+
+
+def _encode_records(writer: _Writer, records) -> dict:
+    """Columns of a list of flat dicts (trades), keeping key order and missing keys"""
+    names = []
+    for record in records:
+        for key in record:
+            if key not in names:
+                names.append(key)
+    columns = []
+    for name in names:
+        present = np.array([name in record for record in records], dtype=bool)
+        values = [record.get(name) for record in records]
+        kind = _column_kind([value for value, has in zip(values, present) if has])
+        spec = {'name': name, 'kind': kind}
+        if not present.all():
+            spec['present'] = writer.add(present)
+        nulls = np.array([value is None for value in values], dtype=bool) & present
+        if nulls.any() and kind != 'json':
+            spec['nulls'] = writer.add(nulls)
+        if kind == 'bool':
+            spec['data'] = writer.add(np.array([bool(value) if value is not None else False for value in values], dtype=bool))
+        elif kind == 'int':
+            spec['data'] = writer.add(np.array([value if value is not None else 0 for value in values], dtype=np.int64))
+        elif kind == 'float':
+            spec['data'] = writer.add(np.array([np.nan if value is None else value for value in values], dtype=np.float64))
+            ints = np.array([isinstance(value, (int, np.integer)) for value in values], dtype=bool)
+            if ints.any():
+                spec['ints'] = writer.add(ints)
+        elif kind == 'str':
+            spec.update(_encode_strings(writer, values))
+        else:
+            spec['values'] = json.loads(json.dumps(values, default=str))
+        columns.append(spec)
+    return {'rows': len(records), 'columns': columns, 'records': True}
+
+
+def dump_snapshot(physical_trades, hedge_trades, prices: pd.DataFrame = None, fx_rates: pd.DataFrame = None,
+                  metadata=None, level: int = 1) -> bytes:
+    """Serialize a session to snapshot bytes"""
+    writer = _Writer()
+    tables = {
+        'physical_trades': _encode_records(writer, physical_trades),
+        'hedge_trades': _encode_records(writer, hedge_trades)
+    }
+    if prices is not None:
+        tables['prices'] = _encode_frame(writer, prices)
+    if fx_rates is not None:
+        tables['fx_rates'] = _encode_frame(writer, fx_rates)
+    header = json.dumps({'metadata': metadata or {}, 'tables': tables}, separators=(',', ':')).encode('utf-8')
+    payload = _LENGTH.pack(len(header)) + header + zlib.compress(b''.join(writer.buffers), level)
+    return _PREFIX.pack(MAGIC, SNAPSHOT_VERSION, hashlib.sha256(payload).digest()) + payload
+
+
+def _buffer(body: bytes, spec: dict) -> np.ndarray:
+    dtype = np.dtype(spec['dtype'])
+    return np.frombuffer(body, dtype=dtype, count=spec['nbytes'] // dtype.itemsize, offset=spec['offset'])
+
+
+def _decode_strings(body: bytes, spec: dict) -> np.ndarray:
+    codes = _buffer(body, spec['codes'])
+    categories = np.array(spec['categories'] + [None], dtype=object)
+    return categories[codes]
+
+
+def _decode_frame(body: bytes, table: dict) -> pd.DataFrame:
+    data = {}
+    for spec in table['columns']:
+        if spec['kind'] == 'str':
+            data[spec['name']] = _decode_strings(body, spec)
+        elif spec['kind'] == 'datetime':
+            data[spec['name']] = np.cumsum(_buffer(body, spec['data'])).view(f"datetime64[{spec['unit']}]")
+        else:
+            data[spec['name']] = _buffer(body, spec['data']).copy()
+    return pd.DataFrame(data, index=pd.RangeIndex(table['rows']))
+
+
+def _decode_records(body: bytes, table: dict):
+    rows = table['rows']
+    records = [{} for _ in range(rows)]
+    for spec in table['columns']:
+        kind = spec['kind']
+        if kind == 'str':
+            values = _decode_strings(body, spec).tolist()
+        elif kind == 'json':
+            values = spec['values']
+        else:
+            values = _buffer(body, spec['data']).tolist()
+            if 'ints' in spec:
+                values = [int(value) if is_int else value for value, is_int in zip(values, _buffer(body, spec['ints']))]
+        if 'nulls' in spec:
+            values = [None if is_null else value for value, is_null in zip(values, _buffer(body, spec['nulls']))]
+        present = _buffer(body, spec['present']) if 'present' in spec else None
+        name = spec['name']
+        for position, record in enumerate(records):
+            if present is None or present[position]:
+                record[name] = values[position]
+    return records
+
+
+def load_snapshot(data: bytes) -> dict:
+    """Parse snapshot bytes into {'metadata', 'physical_trades', 'hedge_trades', 'prices', 'fx_rates'}"""
+    if len(data) < _PREFIX.size + _LENGTH.size:
+        raise SnapshotError("File is too short to be a session snapshot")
+    magic, version, checksum = _PREFIX.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError("Not a session snapshot file")
+    if version not in READABLE_VERSIONS:
+        raise SnapshotError(f"Snapshot version {version} is not supported (this build reads {sorted(READABLE_VERSIONS)})")
+    payload = memoryview(data)[_PREFIX.size:]
+    if hashlib.sha256(payload).digest() != checksum:
+        raise SnapshotError("Snapshot checksum mismatch: the file is corrupt or truncated")
+    (header_length,) = _LENGTH.unpack_from(payload)
+    header = json.loads(bytes(payload[_LENGTH.size:_LENGTH.size + header_length]).decode('utf-8'))
+    body = zlib.decompress(payload[_LENGTH.size + header_length:])
+
+    tables = header['tables']
+    return {
+        'metadata': header['metadata'],
+        'physical_trades': _decode_records(body, tables['physical_trades']),
+        'hedge_trades': _decode_records(body, tables['hedge_trades']),
+        'prices': _decode_frame(body, tables['prices']) if 'prices' in tables else None,
+        'fx_rates': _decode_frame(body, tables['fx_rates']) if 'fx_rates' in tables else None
+    }
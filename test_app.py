@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+App-level regression tests: run app.py through Streamlit's AppTest with a seeded session
+"""
+
+import io
+from datetime import time
+from pathlib import Path
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+from market_data import INSTRUMENTS, PriceSet, compact_price_frame
+
+APP_PATH = str(Path(__file__).resolve().parent / 'app.py')
+
+
+def run_app(physical_trades, hedge_trades=(), market_prices=(), **session):
+    app = AppTest.from_file(APP_PATH, default_timeout=120)
+    app.session_state['physical_trades'] = list(physical_trades)
+    app.session_state['hedge_trades'] = list(hedge_trades)
+    app.session_state['market_prices'] = list(market_prices)
+    for key, value in session.items():
+        app.session_state[key] = value
+    app.run()
+    assert not app.exception, [error.value for error in app.exception]
+    return app
+
+
+def click(app, label):
+    next(button for button in app.button if button.label == label).click()
+    app.run()
+    assert not app.exception, [error.value for error in app.exception]
+
+
+def table_with(app, column) -> pd.DataFrame:
+    return next(frame.value for frame in app.dataframe if column in frame.value.columns)
+
+
+def fx_rate_set(pair, rates) -> PriceSet:
+    """FX store of one currency pair from {date: rate}"""
+    frame = pd.DataFrame({'date': pd.to_datetime(list(rates)), 'instrument': pair, 'price': list(rates.values()), 'type': 'FX'})
+    frame['instrument_id'] = INSTRUMENTS.intern_many(frame['instrument'])
+    return PriceSet(f"fx-{pair}", compact_price_frame(frame))
+
+
+def window_lot(**fields):
+    return dict({'date': '2024-03-01', 'quantity': 1000, 'buy_price': 70.0, 'sale_price': 0.0, 'sale_date': '',
+                 'buy_pricing_start': '2024-03-01', 'buy_pricing_end': '2024-03-08', 'product_name': 'GASOIL 10PPM'}, **fields)
+
+
+def daily_prints(instrument, days, price=70.0):
+    return [{'date': f"2024-03-{day:02d}", 'instrument': instrument, 'price': price + day, 'type': 'Physical'} for day in days]
+
+
+def test_sale_before_window_settles_is_flagged_provisional():
+    app = run_app([window_lot()], market_prices=daily_prints('GASOIL 10PPM', range(1, 6)))
+    app.button(key='add_sell_op').click()
+    app.run()
+    assert any('5/8 days priced' in warning.value for warning in app.warning)
+
+    next(field for field in app.number_input if field.label.startswith('Sale Price')).set_value(75.0)
+    click(app, 'Complete Sale')
+    sold = app.session_state['physical_trades'][0]
+    assert sold['sale_price'] == 75.0 and sold['buy_price'] == 70.0 and sold['buy_price_provisional'] is True
+    # the sale is recorded in the journal and the session book is rebuilt from it
+    assert app.session_state['trade_journal'].book() == (app.session_state['physical_trades'], [])
+    # the notices name the lot the way the Sell form listed it
+    assert any(warning.value.startswith('Trade 0 was sold') for warning in app.warning)
+    assert any('provisional window buy price: Trade 0.' in warning.value for warning in app.warning)
+
+    # once every window day has a print the lot settles at the window average
+    app = run_app([dict(sold, sale_date='2024-03-04')], market_prices=daily_prints('GASOIL 10PPM', range(1, 9)))
+    click(app, 'Settle Provisional Buy Prices')
+    settled = app.session_state['physical_trades'][0]
+    assert settled['buy_price'] == 74.5 and settled['buy_price_provisional'] is False
+    assert app.session_state['trade_journal'].book()[0] == [settled]
+    assert not any('provisional' in warning.value for warning in app.warning)
+
+
+def test_settled_window_average_is_stored_in_the_buy_currency():
+    # 1 SGD = 0.75 USD; the window averages 74.50 USD
+    lot = window_lot(buy_currency='SGD', sale_currency='SGD', sale_price=100.0, sale_date='2024-03-11',
+                     buy_price_provisional=True)
+    app = run_app([lot], market_prices=daily_prints('GASOIL 10PPM', range(1, 9)),
+                  fx_rate_set=fx_rate_set('SGDUSD', {'2024-02-28': 0.75}))
+    click(app, 'Settle Provisional Buy Prices')
+    settled = app.session_state['physical_trades'][0]
+    assert abs(settled['buy_price'] - 74.5 / 0.75) < 1e-9 and settled['buy_price_provisional'] is False
+    # realized once: (100 SGD - 99.33 SGD) * 0.75 * 1,000 MT = $500
+    assert any('$500.00' in block.value for block in app.markdown if 'Physical P&L' in block.value)
+
+
+def test_foreign_currency_records_report_pnl_at_leg_fx_rates():
+    # bought at 100 SGD, sold at 110 SGD with 1 SGD = 0.75 USD
+    lot = {'date': '2024-03-01', 'quantity': 1000, 'buy_price': 100.0, 'sale_price': 110.0, 'sale_date': '2024-03-11',
+           'buy_currency': 'SGD', 'sale_currency': 'SGD', 'product_name': 'GASOIL 10PPM'}
+    app = run_app([lot], fx_rate_set=fx_rate_set('SGDUSD', {'2024-02-28': 0.75}))
+    record = table_with(app, 'Total P&L ($)').iloc[0]
+    assert record['Net Buy Price (/BBL)'] == 'SGD 100.00' and record['Net Sale Price (/BBL)'] == 'SGD 110.00'
+    assert record['Unit P&L ($/BBL)'] == '$7.50' and record['Total P&L ($)'] == '$7,500.00'
+    assert any('Avg Net Buy Price: $75.00/BBL' in block.value for block in app.markdown)
+
+
+def test_expired_mo1_hedge_settles_on_its_grade_expiry():
+    days = pd.bdate_range('2024-01-15', '2024-02-20')
+    prices = [
+        {'date': day.strftime('%Y-%m-%d'), 'instrument': f"GASOIL 500PPM Mo{offset}", 'price': 70.0 + i + 10 * offset, 'type': 'Hedge'}
+        for i, day in enumerate(days) for offset in (1, 2)
+    ]
+    hedges = [
+        {'contract': f"GASOIL 500PPM Mo{offset}", 'volume': -1000, 'entry_price': 80.0, 'exit_price': 0.0,
+         'trade_date': '2024-01-22', 'status': 'Open', 'exit_date': ''}
+        for offset in (1, 2)
+    ]
+    lot = {'date': '2024-01-22', 'quantity': 2000, 'buy_price': 80.0, 'sale_price': 0.0, 'sale_date': '',
+           'product_name': 'GASOIL 500PPM MOPAG'}
+    app = run_app([lot], hedges, prices)
+
+    # valued on 20 Feb: the Feb contract expired on 12 Feb under the ICE gasoil rule, not at the end of January
+    details = table_with(app, 'Priced As')
+    expired, live = details.iloc[0], details.iloc[1]
+    assert expired['Contract Month'] == 'Feb-24'
+    assert expired['Priced As'] == 'GASOIL 500PPM Mo1 (expired 2024-02-12)'
+    assert expired['Price Source'] == 'Settled (2024-02-12)'
+    assert expired['Market Price ($/BBL)'] == 70.0 + list(days).index(pd.Timestamp('2024-02-12')) + 10
+    assert expired['P&L ($)'] == (80.0 - expired['Market Price ($/BBL)']) * 1000
+    # the Mo2 traded alongside it has rolled into the front month
+    assert live['Contract Month'] == 'Mar-24' and live['Priced As'] == 'GASOIL 500PPM Mo1'
+    assert live['Market Price ($/BBL)'] == 70.0 + len(days) - 1 + 10
+
+
+def test_intraday_bars_value_with_default_controls():
+    prints = [('2024-03-04 09:10', 70.0), ('2024-03-04 16:20', 72.0),
+              ('2024-03-05 09:40', 71.0), ('2024-03-05 10:15', 73.0), ('2024-03-05 15:05', 74.0)]
+    prices = [{'date': stamp, 'instrument': 'GASOIL 10PPM', 'price': price, 'type': 'Physical'} for stamp, price in prints]
+    lot = {'date': '2024-03-01', 'quantity': 1000, 'buy_price': 70.0, 'sale_price': 0.0, 'sale_date': '',
+           'product_name': 'GASOIL 10PPM'}
+    # hourly bars; valuation time, lookup and staleness left at their defaults
+    app = run_app([lot], [], prices, price_bar_size='h')
+    details = table_with(app, 'Price Source')
+    assert details['Market Price ($/BBL)'].iloc[0] == 74.0 and details['Price Source'].iloc[0] == 'Current'
+    assert details['P&L ($)'].iloc[0] == 4000.0
+
+    # at 10:30 only the 09:00-10:00 bar has closed: the 10:15 print is not visible yet
+    app.time_input(key='valuation_time').set_value(time(10, 30))
+    app.run()
+    assert table_with(app, 'Price Source')['Market Price ($/BBL)'].iloc[0] == 71.0
+    app.selectbox(key='price_lookup_mode').set_value('last')
+    app.run()
+    assert table_with(app, 'Price Source')['Market Price ($/BBL)'].iloc[0] == 71.0
+
+
+def test_trade_correction_edits_the_selected_trade():
+    lots = [window_lot(buy_price=price, buy_pricing_start='', buy_pricing_end='') for price in (70.0, 80.0)]
+    app = run_app(lots)
+    picker = app.selectbox(key='correction_position')
+    assert picker.options[1].startswith('Trade 1:')
+    picker.set_value(1)
+    app.run()
+    buy_price = app.number_input(key='correction_physical_1_buy_price')
+    assert buy_price.value == 80.0
+    buy_price.set_value(85.0)
+    click(app, 'Record Correction')
+    assert [lot['buy_price'] for lot in app.session_state['physical_trades']] == [70.0, 85.0]
+    journal = app.session_state['trade_journal']
+    assert [lot['buy_price'] for lot in journal.book()[0]] == [70.0, 85.0]
+    assert journal.history(limit=1)['Event'].iloc[0] == 'Correction'
+
+
+def price_workbook(rows) -> bytes:
+    buffer = io.BytesIO()
+    pd.DataFrame(rows, columns=['date', 'instrument', 'price', 'type']).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def test_same_price_file_loads_again_after_clearing():
+    workbook = ('prices.xlsx', price_workbook([('2024-03-04', 'GASOIL 10PPM', 75.0, 'Physical')]),
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    app = run_app([])
+    next(field for field in app.get('file_uploader') if field.label == 'Upload Market Prices (Excel)').set_value(workbook)
+    app.run()
+    assert len(app.session_state['market_price_set']) == 1
+
+    click(app, 'Clear Market Prices')
+    assert app.session_state['market_price_set'] is None
+    # the uploader is emptied with the prices, so the cleared file is not reapplied on the next rerun
+    app.run()
+    assert app.session_state['market_price_set'] is None
+    next(field for field in app.get('file_uploader') if field.label == 'Upload Market Prices (Excel)').set_value(workbook)
+    app.run()
+    assert app.session_state['market_price_set'] is not None and len(app.session_state['market_price_set']) == 1
+
+
+if __name__ == "__main__":
+    print("App Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_sale_before_window_settles_is_flagged_provisional,
+        test_settled_window_average_is_stored_in_the_buy_currency,
+        test_foreign_currency_records_report_pnl_at_leg_fx_rates,
+        test_expired_mo1_hedge_settles_on_its_grade_expiry,
+        test_intraday_bars_value_with_default_controls,
+        test_trade_correction_edits_the_selected_trade,
+        test_same_price_file_loads_again_after_clearing,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the business-day calendars in business_calendar.py
+"""
+
+from datetime import date
+
+import numpy as np
+
+from business_calendar import easter_sunday, calendar_holidays, business_calendar, valuation_grid
+
+
+def test_easter_and_observed_holidays():
+    assert easter_sunday(2000) == date(2000, 4, 23)
+    assert easter_sunday(2024) == date(2024, 3, 31)
+    assert easter_sunday(2025) == date(2025, 4, 20)
+
+    london = [str(day) for day in calendar_holidays('london', 2021, 2021)]
+    # Christmas on a Saturday and Boxing Day on a Sunday move to Mon 27 and Tue 28 Dec
+    assert london == ['2021-01-01', '2021-04-02', '2021-04-05', '2021-12-27', '2021-12-28']
+
+    singapore = [str(day) for day in calendar_holidays('platts_singapore', 2020, 2020, ['2020-01-27'])]
+    # National Day on a Sunday is observed on Monday
+    assert singapore == ['2020-01-01', '2020-01-27', '2020-04-10', '2020-05-01', '2020-08-10', '2020-12-25']
+
+
+def test_valuation_grid_skips_weekends_and_holidays():
+    grid = valuation_grid('platts_singapore', '2024-03-27', '2024-04-02')
+    assert [str(day) for day in grid] == ['2024-03-27', '2024-03-28', '2024-04-01', '2024-04-02']
+    assert grid.dtype == np.dtype('datetime64[D]')
+
+    extra = valuation_grid('platts_singapore', '2024-02-08', '2024-02-14', ['2024-02-12', '2024-02-13'])
+    assert [str(day) for day in extra] == ['2024-02-08', '2024-02-09', '2024-02-14']
+
+    calendar = business_calendar('london', '2024-01-05', '2024-06-30')
+    assert calendar is business_calendar('london', '2024-11-01', '2024-12-31')
+    assert list(calendar.is_business_day(['2024-03-29', '2024-04-02'])) == [False, True]
+    assert np.busday_count(np.datetime64('2024-03-28'), np.datetime64('2024-04-03'), busdaycal=calendar.busdaycal) == 2
+
+
+if __name__ == "__main__":
+    print("Business Calendar Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_easter_and_observed_holidays,
+        test_valuation_grid_skips_weekends_and_holidays,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Regression tests for chart downsampling in chart_sampling.py
+"""
+
+import numpy as np
+import pandas as pd
+
+from chart_sampling import lttb_indices, downsample_frame
+
+
+def test_lttb_keeps_end_points_and_extremes_within_budget():
+    dates = pd.date_range('2015-01-01', periods=20000, freq='D').to_numpy()
+    prices = 70.0 + np.cumsum(np.random.default_rng(7).normal(scale=0.5, size=len(dates)))
+    # one-day spikes a plain stride would step over
+    prices[4001] += 60.0
+    prices[12345] -= 60.0
+
+    positions = lttb_indices(dates, prices, 500)
+    assert len(positions) <= 500 and (np.diff(positions) > 0).all()
+    assert positions[0] == 0 and positions[-1] == len(dates) - 1
+    assert 4001 in positions and 12345 in positions
+    # the sampled line covers the whole history, not just its start
+    assert np.diff(positions).max() < 4 * len(dates) / 500
+
+    # short series are plotted as they are
+    assert list(lttb_indices(dates[:10], prices[:10], 500)) == list(range(10))
+
+
+def test_downsample_frame_splits_budget_and_drops_gaps_per_series():
+    dates = pd.date_range('2020-01-01', periods=3000, freq='D')
+    frame = pd.DataFrame({
+        'date': dates,
+        'GASOIL Mo1': np.linspace(60.0, 90.0, len(dates)),
+        # quoted on alternate days only
+        '380 CST AG MOPAG': np.where(np.arange(len(dates)) % 2 == 0, 70.0, np.nan),
+    })
+    series = downsample_frame(frame, 'date', ['GASOIL Mo1', '380 CST AG MOPAG'], 1000)
+    assert list(series) == ['GASOIL Mo1', '380 CST AG MOPAG']
+    for column, sampled in series.items():
+        assert list(sampled.columns) == ['date', column]
+        assert len(sampled) <= 500 and sampled[column].notna().all()
+        assert sampled['date'].iloc[0] == dates[0]
+    assert series['GASOIL Mo1']['date'].iloc[-1] == dates[-1]
+    assert series['380 CST AG MOPAG']['date'].iloc[-1] == dates[-2]
+
+    small = downsample_frame(frame.head(50), 'date', ['GASOIL Mo1'], 1000)['GASOIL Mo1']
+    assert small.equals(frame.head(50)[['date', 'GASOIL Mo1']])
+
+
+def test_downsample_frame_caps_total_points_across_many_series():
+    dates = pd.date_range('2020-01-01', periods=200, freq='D')
+    values = np.random.default_rng(3).normal(70.0, 5.0, size=(len(dates), 1500))
+    frame = pd.concat([pd.DataFrame({'date': dates}), pd.DataFrame(values, columns=[f"S{i}" for i in range(1500)])], axis=1)
+
+    series = downsample_frame(frame, 'date', frame.columns[1:], 4000)
+    assert len(series) == 1500
+    assert sum(len(sampled) for sampled in series.values()) <= 4000
+    # two or three points each, still spanning the whole history
+    assert {len(sampled) for sampled in series.values()} == {2, 3}
+    assert all(sampled['date'].iloc[0] == dates[0] and sampled['date'].iloc[-1] == dates[-1] for sampled in series.values())
+
+    # below one point per series the rest are left out rather than overrunning the budget
+    assert lttb_indices(dates, values[:, 0], 1).tolist() == [0]
+    assert lttb_indices(dates, values[:, 0], 0).tolist() == []
+
+
+if __name__ == "__main__":
+    print("Chart Sampling Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_lttb_keeps_end_points_and_extremes_within_budget,
+        test_downsample_frame_splits_budget_and_drops_gaps_per_series,
+        test_downsample_frame_caps_total_points_across_many_series,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
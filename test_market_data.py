@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the market price helpers in market_data.py
+"""
+
+import numpy as np
+import pandas as pd
+
+from market_data import (
+    PriceIndex, PriceCache, InstrumentRegistry, INSTRUMENTS, MISSING_INSTRUMENT_ID,
+    compact_price_frame, expand_price_frame, price_memory_report, content_hash, apply_price_changes,
+    resample_prices, PriceSet, screen_price_quality, usd_rates, MAX_VIEWS_PER_SET
+)
+
+
+def make_prices(rows):
+    df = pd.DataFrame(rows, columns=['date', 'instrument', 'price'])
+    df['date'] = pd.to_datetime(df['date'])
+    df['type'] = ''
+    df['instrument_id'] = INSTRUMENTS.intern_many(df['instrument'])
+    return df
+
+
+GO1 = INSTRUMENTS.intern('GASOIL Mo1')
+
+
+def test_price_index_lookup_modes():
+    prices = make_prices([
+        ('2024-02-01', 'GASOIL Mo1', 77.00),
+        ('2024-02-02', 'GASOIL Mo1', 76.00),
+        ('2024-02-06', 'GASOIL Mo1', 80.00),
+        ('2024-02-02', '180 CST AG MOPAG', 74.95),
+    ])
+    index = PriceIndex(prices)
+
+    assert index.lookup(GO1, '2024-02-02') == (76.0, pd.Timestamp('2024-02-02'), 'exact')
+    assert index.lookup(GO1, '2024-02-05') == (None, None, None)
+    assert index.lookup(INSTRUMENTS.intern('unknown'), '2024-02-02', 'last') == (None, None, None)
+
+    price, price_date, source = index.lookup(GO1, '2024-02-05', 'last', max_staleness_days=5)
+    assert (price, price_date, source) == (76.0, pd.Timestamp('2024-02-02'), 'last')
+    assert index.lookup(GO1, '2024-02-05', 'last', max_staleness_days=2) == (None, None, None)
+
+    price, _, source = index.lookup(GO1, '2024-02-05', 'interpolate', max_staleness_days=5)
+    assert source == 'interpolate' and np.isclose(price, 79.0)
+    # past the last print interpolation falls back to carrying forward
+    assert index.lookup(GO1, '2024-02-08', 'interpolate')[2] == 'last'
+    assert index.lookup(GO1, '2024-01-31', 'last') == (None, None, None)
+
+
+def test_price_index_last_print_wins_on_duplicates():
+    prices = make_prices([
+        ('2024-02-01', 'GASOIL Mo1', 77.00),
+        ('2024-02-01', 'GASOIL Mo1', 78.50),
+    ])
+    assert PriceIndex(prices).lookup(GO1, '2024-02-01')[0] == 78.5
+
+
+def test_price_cache_shares_identical_content():
+    cache = PriceCache(memory_budget_bytes=64 * 1024 * 1024)
+    rows = [('2024-02-01', 'GASOIL Mo1', 77.00), ('2024-02-02', 'GASOIL Mo1', 76.00)]
+    first = cache.put(make_prices(rows))
+    second = cache.put(make_prices(rows))
+    assert first is second
+    assert cache.stats()['entries'] == 1
+
+    builds = []
+    def builder():
+        builds.append(1)
+        return make_prices(rows)
+    assert cache.get_or_build('excel:abc', builder) is first
+    assert cache.get_or_build('excel:abc', builder) is first
+    assert len(builds) == 1
+
+    edited = cache.put(make_prices(rows + [('2024-02-05', 'GASOIL Mo1', 80.00)]))
+    assert edited is not first and len(first) == 2
+
+    # a volume-only edit is new content: VWAP bars of the two sets differ
+    light, heavy = make_prices(rows), make_prices(rows)
+    light['volume'], heavy['volume'] = [100.0, 100.0], [100.0, 300.0]
+    assert content_hash(light) != content_hash(heavy)
+    assert cache.put(light) is not cache.put(heavy)
+
+
+def test_price_cache_eviction_keeps_live_sets():
+    cache = PriceCache(memory_budget_bytes=1)
+    held = cache.put(make_prices([('2024-02-01', 'GASOIL Mo1', 77.00)]))
+    cache.put(make_prices([('2024-02-01', 'GASOIL Mo2', 75.00)]))
+    assert cache.stats()['entries'] == 1 and cache.evictions == 1
+    # a session still holds the evicted set, so the same content resolves to it
+    assert cache.put(make_prices([('2024-02-01', 'GASOIL Mo1', 77.00)])) is held
+    # bringing it back evicts the least recently used set: the budget still holds
+    assert cache.stats()['entries'] == 1 and cache.evictions == 2
+
+    budget_cache = PriceCache(memory_budget_bytes=held.nbytes)
+    sets = [budget_cache.put(make_prices([('2024-02-01', f"GASOIL Mo{month}", 75.00)])) for month in range(1, 4)]
+    for entry in sets * 2:
+        assert budget_cache.get(entry.key) is entry
+        assert budget_cache.total_bytes <= budget_cache.memory_budget_bytes
+
+
+def test_instrument_registry_aliases_and_spacing():
+    registry = InstrumentRegistry({'GASOIL 2500PPM MOPS': 'GAS OIL2500PPM MOPS'})
+    mops = registry.intern('GAS OIL2500PPM MOPS')
+    assert registry.intern(' gasoil   2500ppm mops ') == mops
+    assert registry.intern('GASOIL Mo1') != mops
+    assert registry.intern('') == MISSING_INSTRUMENT_ID
+    assert list(registry.intern_many(['GASOIL 2500PPM MOPS', None, 'gasoil mo1'])) == [mops, MISSING_INSTRUMENT_ID, 1]
+
+    # an alias registered after the variant was seen takes over its ID
+    variant = registry.intern('380 CST MOPAG')
+    registry.add_alias('380 CST MOPAG', '380 CST AG MOPAG')
+    assert registry.intern('380 cst ag mopag') == variant
+    assert registry.name(variant) == '380 CST AG MOPAG'
+
+
+def test_compact_price_frame_round_trips():
+    prices = make_prices([('2024-02-01', 'GASOIL Mo1', 77.25), ('2024-02-02', 'GASOIL Mo1', 76.10)] * 50)
+    compact = compact_price_frame(prices, float32_prices=True)
+    assert isinstance(compact['instrument'].dtype, pd.CategoricalDtype)
+    assert compact['price'].dtype == np.float32
+    assert np.allclose(expand_price_frame(compact)['price'], prices['price'], atol=1e-4)
+    assert np.isclose(PriceIndex(compact).lookup(GO1, '2024-02-02')[0], 76.10)
+    assert content_hash(compact) != content_hash(prices)
+
+    # prices float32 cannot hold within tolerance stay float64
+    precise = make_prices([('2024-02-01', 'GASOIL Mo1', 1234567.891)])
+    assert compact_price_frame(precise, float32_prices=True)['price'].dtype == np.float64
+
+    report = price_memory_report(compact).set_index('Column')
+    assert report.loc['Total', 'Stored (MB)'] < report.loc['Total', 'Plain (MB)']
+    assert np.isclose(report.loc['price', 'Saving (%)'], 50.0)
+
+
+def test_apply_price_changes_upserts_and_patches_index():
+    prices = compact_price_frame(make_prices([
+        ('2024-02-01', 'GASOIL Mo1', 77.00),
+        ('2024-02-01', '180 CST AG MOPAG', 75.40),
+        ('2024-02-02', 'GASOIL Mo1', 76.00),
+        ('2024-02-02', '180 CST AG MOPAG', 74.95),
+    ]))
+    index = PriceIndex(prices)
+    upserts = make_prices([
+        ('2024-02-02', 'gasoil  mo1', 76.50),  # replaces the 2 Feb print
+        ('2024-02-05', 'GASOIL Mo3', 78.00),   # new instrument
+    ])
+
+    # delete the 1 Feb fuel oil print
+    updated, changed = apply_price_changes(prices, [1], upserts)
+    assert len(updated) == 4
+    assert isinstance(updated['instrument'].dtype, pd.CategoricalDtype)
+    assert list(updated['date']) == sorted(updated['date'])
+    fo = INSTRUMENTS.intern('180 CST AG MOPAG')
+    assert changed == {GO1, fo, INSTRUMENTS.intern('GASOIL Mo3')}
+
+    patched = index.patched(updated, changed)
+    assert patched.lookup(GO1, '2024-02-02')[0] == 76.5
+    assert patched.lookup(fo, '2024-02-01') == (None, None, None)
+    assert patched.lookup(INSTRUMENTS.intern('GASOIL Mo3'), '2024-02-05')[0] == 78.0
+    for key, (dates, values) in PriceIndex(updated).series.items():
+        assert np.array_equal(patched.series[key][0], dates) and np.array_equal(patched.series[key][1], values)
+
+
+def test_window_averages_price_fixed_and_pending_days():
+    prices = make_prices([
+        ('2024-03-01', 'GASOIL Mo1', 70.00),  # Fri
+        ('2024-03-04', 'GASOIL Mo1', 72.00),  # Mon
+        ('2024-03-05', 'GASOIL Mo1', 74.00),
+        ('2024-03-06', 'GASOIL Mo1', 76.00),
+        ('2024-03-07', 'GASOIL Mo1', 78.00),
+    ])
+    index = PriceIndex(prices)
+    missing = INSTRUMENTS.intern('GASOIL Mo3')
+    windows = index.window_averages(
+        [GO1, GO1, GO1, missing],
+        ['2024-03-01', '2024-03-04', '2024-03-06', '2024-03-01'],
+        ['2024-03-07', '2024-03-05', '2024-03-12', '2024-03-07'],
+    )
+    assert np.allclose(windows['average'][:3], [74.0, 73.0, 77.0])
+    assert list(windows['priced_days']) == [5, 2, 2, 0]
+    assert np.isnan(windows['average'][3])
+
+    # as of Tue 5 Mar: 3 prints fixed, Wed-Fri pending at the 74.00 print
+    partial = index.window_averages([GO1], ['2024-03-01'], ['2024-03-08'], as_of='2024-03-05')
+    assert partial['priced_days'][0] == 3 and partial['pending_days'][0] == 3
+    assert np.isclose(partial['fixed_average'][0], 72.0)
+    assert np.isclose(partial['average'][0], (70 + 72 + 74 + 3 * 74) / 6)
+    # a window that has not started is fully provisional
+    ahead = index.window_averages([GO1], ['2024-03-11'], ['2024-03-15'], as_of='2024-03-07')
+    assert ahead['pending_days'][0] == 5 and np.isclose(ahead['average'][0], 78.0)
+
+    # prefix sums survive patching of other instruments
+    assert np.isclose(index.patched(prices, [missing]).window_averages([GO1], ['2024-03-04'], ['2024-03-05'])['average'][0], 73.0)
+
+
+def test_resample_prices_bars_and_cached_views():
+    ticks = make_prices([
+        ('2024-03-04 09:00', 'GASOIL Mo1', 70.00),
+        ('2024-03-04 16:00', 'GASOIL Mo1', 72.00),
+        ('2024-03-04 17:30', 'GASOIL Mo1', 73.00),
+        ('2024-03-04 10:15', '180 CST AG MOPAG', 60.00),
+        ('2024-03-05 09:30', 'GASOIL Mo1', 71.00),
+    ])
+    ticks['volume'] = [100.0, 300.0, 0.0, 50.0, 10.0]
+    compact = compact_price_frame(ticks)
+
+    eod = resample_prices(compact, 'eod')
+    assert list(eod['date'].astype(str)) == ['2024-03-04', '2024-03-04', '2024-03-05']
+    assert PriceIndex(eod).lookup(GO1, '2024-03-04')[0] == 73.0
+    assert isinstance(eod['instrument'].dtype, pd.CategoricalDtype)
+
+    cutoff = PriceIndex(resample_prices(compact, 'cutoff', cutoff='16:30'))
+    assert cutoff.lookup(GO1, '2024-03-04')[0] == 72.0
+    vwap = PriceIndex(resample_prices(compact, 'vwap'))
+    assert np.isclose(vwap.lookup(GO1, '2024-03-04')[0], (70 * 100 + 72 * 300) / 400)
+    # intraday bars are stamped at their close: the 16:00-17:00 bar is known at 17:00
+    hourly = PriceIndex(resample_prices(compact, 'eod', frequency='h'))
+    assert hourly.lookup(GO1, '2024-03-04 17:00')[0] == 72.0
+    assert hourly.lookup(GO1, '2024-03-04 16:45', 'last')[:2] == (70.0, pd.Timestamp('2024-03-04 10:00'))
+    assert hourly.lookup(GO1, '2024-03-04 23:59', 'last')[0] == 73.0
+
+    prices = PriceSet('ticks', compact)
+    assert prices.intraday and prices.view('raw') is prices
+    view = prices.view('cutoff', cutoff='16:30')
+    assert prices.view('cutoff', cutoff='16:30') is view and view.key != prices.key
+    assert prices.nbytes > PriceSet('ticks', compact).nbytes
+    # views are capped per set and built through the cache count against its budget
+    base_bytes = PriceSet('ticks', compact).nbytes
+    for minute in range(20):
+        prices.view('cutoff', cutoff=f"16:{minute:02d}")
+    assert len(prices._views) == MAX_VIEWS_PER_SET and prices.view('cutoff', cutoff='16:30') is not view
+    assert prices.nbytes == base_bytes + sum(kept.nbytes for kept in prices._views.values())
+    cache = PriceCache(memory_budget_bytes=2 * base_bytes)
+    first, second = cache.put(compact), cache.put(make_prices([('2024-03-04', 'GASOIL Mo2', 70.00)]))
+    assert cache.view(second, 'cutoff', cutoff='16:30') is second and cache.evictions == 0
+    cache.view(first, 'vwap', frequency='h')
+    assert cache.evictions == 1 and list(cache._entries) == [first.key]
+
+    daily = PriceSet('daily', make_prices([('2024-03-04', 'GASOIL Mo1', 70.00)]))
+    assert daily.view('eod') is daily and daily.view('cutoff', cutoff='16:30') is daily
+
+    # upserts replace the print with the same timestamp only
+    upsert = make_prices([('2024-03-04 16:00', 'GASOIL Mo1', 72.50)])
+    upsert['volume'] = 0.0
+    updated, _ = apply_price_changes(compact, [], upsert)
+    assert len(updated) == 5 and 72.5 in updated['price'].tolist() and 70.0 in updated['price'].tolist()
+
+
+def test_screen_price_quality_flags_each_check():
+    days = pd.bdate_range('2024-01-01', periods=40)
+    rng = np.random.default_rng(7)
+    clean = 75 * np.exp(np.cumsum(rng.normal(0, 0.01, len(days))))
+    rows = [(day, 'GASOIL Mo1', price) for day, price in zip(days, clean)]
+    rows[20] = (days[20], 'GASOIL Mo1', clean[20] / 10)              # misplaced decimal
+    rows += [(day, '180 CST AG MOPAG', 60.0) for day in days[:6]]     # stale run
+    rows += [(days[8], '180 CST AG MOPAG', 61.0)]                     # after a 2 day gap
+    rows += [(days[8], '180 CST AG MOPAG', 61.5)]                     # conflicting duplicate
+    prices = make_prices(rows).sample(frac=1.0, random_state=1).reset_index(drop=True)
+
+    exceptions = screen_price_quality(prices)
+    flagged = {(check, instrument) for check, instrument in zip(exceptions['Check'], exceptions['Instrument'])}
+    assert flagged == {
+        ('Outlier', 'GASOIL Mo1'),
+        ('Stale', '180 CST AG MOPAG'),
+        ('Missing days', '180 CST AG MOPAG'),
+        ('Conflicting duplicate', '180 CST AG MOPAG')
+    }
+    outlier = exceptions[exceptions['Check'] == 'Outlier'].iloc[0]
+    assert outlier['Date'] == days[20] and np.isclose(prices.loc[outlier['Row'], 'price'], clean[20] / 10)
+    assert 'to 61.50' in exceptions.loc[exceptions['Check'] == 'Conflicting duplicate', 'Detail'].iloc[0]
+
+    # a sustained level shift is a jump, not an outlier
+    shifted = clean.copy()
+    shifted[30:] *= 1.4
+    jumps = screen_price_quality(make_prices([(day, 'GASOIL Mo1', price) for day, price in zip(days, shifted)]))
+    assert list(jumps['Check']) == ['Jump'] and jumps['Date'].iloc[0] == days[30]
+    assert screen_price_quality(make_prices([])).empty
+
+
+def test_usd_rates_as_of_either_quote_direction():
+    fx_index = PriceIndex(make_prices([
+        ('2024-02-01', 'SGDUSD', 0.745),
+        ('2024-02-05', 'SGDUSD', 0.742),
+        ('2024-02-01', 'USDEUR', 0.925),
+    ]))
+    dates = ['2024-01-31', '2024-02-01', '2024-02-03', '2024-02-05', '2024-02-20']
+
+    sgd = usd_rates(fx_index, 'SGD', dates)
+    assert np.isnan(sgd[0])
+    assert np.allclose(sgd[1:], [0.745, 0.745, 0.742, 0.742])
+    assert np.isnan(usd_rates(fx_index, 'sgd', dates, max_staleness_days=5)[-1])
+
+    # only USDEUR is quoted: EUR converts at its inverse
+    assert np.isclose(usd_rates(fx_index, 'EUR', ['2024-02-02'])[0], 1 / 0.925)
+    assert np.array_equal(usd_rates(fx_index, 'USD', dates), np.ones(5))
+    assert np.isnan(usd_rates(fx_index, 'JPY', dates)).all()
+
+
+if __name__ == "__main__":
+    print("Market Data Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_price_index_lookup_modes,
+        test_price_index_last_print_wins_on_duplicates,
+        test_price_cache_shares_identical_content,
+        test_price_cache_eviction_keeps_live_sets,
+        test_instrument_registry_aliases_and_spacing,
+        test_compact_price_frame_round_trips,
+        test_apply_price_changes_upserts_and_patches_index,
+        test_window_averages_price_fixed_and_pending_days,
+        test_resample_prices_bars_and_cached_views,
+        test_screen_price_quality_flags_each_check,
+        test_usd_rates_as_of_either_quote_direction,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
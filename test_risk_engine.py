@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the risk analytics in risk_engine.py
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from market_data import INSTRUMENTS
+from risk_engine import (
+    book_exposures, simulate_pnl_distribution, stress_test_grid, trade_book_frame, exposure_ladder,
+    hedge_effectiveness, rolling_effectiveness_frame, ValuationCache, ChunkedSeriesJob,
+    match_hedges_to_lots, backtest_hedge_policies, policy_grid
+)
+
+
+def make_price_history(days=120, seed=7):
+    """Synthetic daily history for a fuel oil product and a gasoil hedge"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2024-01-01', periods=days)
+    shocks = rng.multivariate_normal([0, 0], [[0.0004, 0.0003], [0.0003, 0.0004]], size=days)
+    fo = 68.0 * np.exp(np.cumsum(shocks[:, 0]))
+    go = 71.0 * np.exp(np.cumsum(shocks[:, 1]))
+    rows = []
+    for day, fo_price, go_price in zip(dates, fo, go):
+        rows.append({'date': day, 'instrument': '380 CST AG MOPAG', 'price': fo_price, 'type': 'Physical'})
+        rows.append({'date': day, 'instrument': 'GASOIL Mo2', 'price': go_price, 'type': 'Hedge'})
+    df = pd.DataFrame(rows)
+    df['instrument_id'] = INSTRUMENTS.intern_many(df['instrument'])
+    return df
+
+
+def open_cargo_book():
+    """The "FO Cargo (Open Position)" demo preset"""
+    physical_trades = [{
+        'date': '2024-03-01',
+        'quantity': 150000,
+        'buy_price': 68.50,
+        'buy_premium_discount': -1.25,
+        'sale_price': 0.0,
+        'sale_date': '',
+        'product_name': '380 CST AG MOPAG'
+    }]
+    hedge_trades = [{
+        'contract': 'GASOIL Mo2',
+        'volume': -150000,
+        'entry_price': 71.20,
+        'exit_price': 0.0,
+        'trade_date': '2024-03-01',
+        'status': 'Open',
+        'exit_date': ''
+    }]
+    return physical_trades, hedge_trades
+
+
+def test_book_exposures_open_positions_only():
+    physical_trades, hedge_trades = open_cargo_book()
+    exposures = book_exposures(physical_trades, hedge_trades, '2024-05-01')
+    assert list(exposures['leg']) == ['physical', 'hedge']
+    assert exposures.loc[0, 'ref_price'] == 67.25
+
+    assert book_exposures(physical_trades, hedge_trades, '2024-02-01').empty
+
+    hedge_trades[0]['exit_date'] = '2024-04-01'
+    exposures = book_exposures(physical_trades, hedge_trades, '2024-05-01')
+    assert list(exposures['leg']) == ['physical']
+
+
+def test_monte_carlo_reproducible_across_chunks_and_workers():
+    prices = make_price_history()
+    physical_trades, hedge_trades = open_cargo_book()
+    kwargs = dict(horizon_days=10, n_paths=3000, seed=11, memory_cap_mb=1)
+
+    serial = simulate_pnl_distribution(prices, physical_trades, hedge_trades, '2024-05-31', max_workers=1, **kwargs)
+    parallel = simulate_pnl_distribution(prices, physical_trades, hedge_trades, '2024-05-31', max_workers=2, **kwargs)
+
+    assert serial['chunks'] > 1
+    assert np.array_equal(serial['net_pnl'], parallel['net_pnl'])
+    assert len(serial['net_pnl']) == 3000
+    assert serial['histogram']['count'].sum() == 3000
+    net_percentiles = serial['percentiles']['Net P&L ($)'].to_numpy()
+    assert np.all(np.diff(net_percentiles) >= 0)
+    assert len(serial['bands']) == 10
+
+
+def test_monte_carlo_hedge_offsets_physical():
+    prices = make_price_history()
+    physical_trades, hedge_trades = open_cargo_book()
+    hedged = simulate_pnl_distribution(prices, physical_trades, hedge_trades, '2024-05-31', n_paths=5000, seed=3, max_workers=1)
+    unhedged = simulate_pnl_distribution(prices, physical_trades, [], '2024-05-31', n_paths=5000, seed=3, max_workers=1)
+    assert hedged['std_net_pnl'] < unhedged['std_net_pnl']
+
+
+def test_stress_grid_linear_in_shocks():
+    prices = make_price_history()
+    physical_trades, hedge_trades = open_cargo_book()
+    result = stress_test_grid(
+        prices, physical_trades, hedge_trades, '2024-05-31',
+        x_axis={'instruments': ['GASOIL Mo2'], 'shocks': np.linspace(-10, 10, 101), 'mode': 'absolute'},
+        y_axis={'instruments': ['380 CST AG MOPAG'], 'shocks': np.linspace(-3, 3, 101), 'mode': 'absolute'}
+    )
+    assert result['net'].shape == (101, 101)
+    assert np.isclose(result['net'][50, 50], result['base_net'])
+    # short 150,000 gasoil: +$10 costs $1.5M on the hedge leg only
+    assert np.isclose(result['hedge'][50, -1] - result['hedge'][50, 50], -1_500_000)
+    assert np.isclose(result['physical'][50, -1], result['physical'][50, 50])
+    assert np.isclose(result['physical'][-1, 50] - result['physical'][50, 50], 450_000)
+
+
+def test_exposure_ladder_nets_by_instrument_and_tenor():
+    physical_trades, hedge_trades = open_cargo_book()
+    physical_trades.append({'date': '2024-03-05', 'quantity': 50000, 'sale_date': '2024-04-01', 'product_name': '380 CST AG MOPAG'})
+    hedge_trades.append({'contract': 'GASOIL Mo1', 'volume': -20000, 'trade_date': '2024-03-05', 'status': 'Open', 'exit_date': ''})
+    book = trade_book_frame(physical_trades, hedge_trades)
+
+    ladder = exposure_ladder(book, '2024-03-10').set_index(['Instrument', 'Tenor'])
+    assert ladder.loc[('380 CST AG MOPAG', '2024-03'), 'Physical (MT)'] == 200000
+    assert ladder.loc[('GASOIL Mo2', '2024-05'), 'Hedge (MT)'] == -150000
+    assert ladder.loc[('GASOIL Mo1', '2024-04'), 'Net (MT)'] == -20000
+
+    # the second lot is sold on 1 April
+    ladder = exposure_ladder(book, '2024-04-01').set_index(['Instrument', 'Tenor'])
+    assert ladder.loc[('380 CST AG MOPAG', '2024-03'), 'Physical (MT)'] == 150000
+    assert exposure_ladder(book, '2024-02-01').empty
+
+
+def test_hedge_effectiveness_matches_pandas_rolling():
+    prices = make_price_history(days=300)
+    result = hedge_effectiveness(prices, ['380 CST AG MOPAG', '180 CST AG MOPAG'], ['GASOIL Mo2'], window=20)
+    assert result['pairs'] == [('380 CST AG MOPAG', 'GASOIL Mo2')]
+
+    rolling = rolling_effectiveness_frame(result, '380 CST AG MOPAG', 'GASOIL Mo2')
+    changes = prices.pivot_table(index='date', columns='instrument', values='price').diff().iloc[1:]
+    physical, hedge = changes['380 CST AG MOPAG'], changes['GASOIL Mo2']
+    expected_beta = physical.rolling(20).cov(hedge) / hedge.rolling(20).var()
+    expected_r2 = physical.rolling(20).corr(hedge) ** 2
+    assert np.allclose(rolling['beta'].to_numpy()[19:], expected_beta.to_numpy()[19:])
+    assert np.allclose(rolling['r2'].to_numpy()[19:], expected_r2.to_numpy()[19:])
+
+    summary = result['summary'].iloc[0]
+    assert np.isclose(summary['Optimal Hedge Ratio'], physical.cov(hedge) / hedge.var())
+
+
+def test_valuation_cache_lru():
+    cache = ValuationCache(max_entries=2)
+    calls = []
+    def compute(value):
+        return lambda: calls.append(value) or value
+
+    assert cache.get_or_compute('a', compute('a')) == 'a'
+    assert cache.get_or_compute('b', compute('b')) == 'b'
+    assert cache.get_or_compute('a', compute('a')) == 'a'
+    cache.get_or_compute('c', compute('c'))  # evicts 'b', the least recently used
+    cache.get_or_compute('b', compute('b'))
+    assert calls == ['a', 'b', 'c', 'b']
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 4
+    assert len(cache) == 2
+
+
+def test_chunked_series_job_orders_chunks_and_cancels():
+    dates = list(pd.bdate_range('2024-01-01', periods=23))
+    def value_chunk(chunk, cancel_event):
+        return pd.DataFrame({'date': chunk, 'net_pnl': range(len(chunk))})
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        job = ChunkedSeriesJob('book', dates, value_chunk, executor, chunk_size=5)
+        assert job.chunks_total == 5
+        executor.shutdown(wait=True)
+        assert job.done and job.chunks_done == 5 and not job.errors()
+        assert list(job.completed_frame()['date']) == dates
+
+    release = threading.Event()
+    def blocked_chunk(chunk, cancel_event):
+        release.wait(5)
+        return None if cancel_event.is_set() else pd.DataFrame({'date': chunk})
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        job = ChunkedSeriesJob('book', dates, blocked_chunk, executor, chunk_size=5)
+        job.cancel()
+        release.set()
+    assert job.cancelled and job.done
+    assert job.completed_frame().empty
+
+    # jobs sharing an executor take turns: a short job is not queued behind a long one
+    order, started = [], threading.Event()
+    def traced_chunk(name):
+        def value(chunk, cancel_event):
+            started.wait(5)
+            order.append(name)
+            return pd.DataFrame({'date': chunk})
+        return value
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        long_job = ChunkedSeriesJob('long', dates, traced_chunk('long'), executor, chunk_size=5, max_queued=1)
+        short_job = ChunkedSeriesJob('short', dates[:5], traced_chunk('short'), executor, chunk_size=5, max_queued=1)
+        started.set()
+        for _ in range(500):
+            if long_job.done and short_job.done:
+                break
+            time.sleep(0.01)
+    assert long_job.done and short_job.done
+    assert order == ['long', 'short', 'long', 'long', 'long', 'long']
+    assert list(long_job.completed_frame()['date']) == dates
+
+
+def test_hedge_matching_pairs_volumes_and_dates():
+    lots = [
+        (0, {'date': '2024-03-01', 'quantity': 150000}),
+        (2, {'date': '2024-03-20', 'quantity': 50000}),
+        (3, {'date': '2024-03-21', 'quantity': 20000}),
+    ]
+    hedges = [
+        (0, {'trade_date': '2024-03-20', 'volume': -50000}),
+        (1, {'trade_date': '2024-03-01', 'volume': -150000}),
+        (4, {'trade_date': '2024-03-21', 'volume': 20000}),  # buy hedge: cannot hedge a long lot
+    ]
+    result = match_hedges_to_lots(lots, hedges)
+    assert dict(zip(result['matches']['Lot'], result['matches']['Hedge'])) == {0: 1, 2: 0}
+    assert result['unmatched_lots'] == [3] and result['unmatched_hedges'] == [4]
+    assert result['matches']['Mismatch (MT)'].abs().sum() == 0
+
+    # a gap beyond the limit leaves the lot unmatched
+    far = match_hedges_to_lots(lots[:1], [(1, {'trade_date': '2024-06-01', 'volume': -150000})], max_gap_days=30)
+    assert far['matches'].empty
+
+    # against brute force on a small random book
+    rng = np.random.default_rng(5)
+    days = pd.date_range('2024-01-01', periods=40).strftime('%Y-%m-%d')
+    lots = [(i, {'date': days[rng.integers(40)], 'quantity': float(rng.integers(1, 10) * 10000)}) for i in range(4)]
+    hedges = [(i, {'trade_date': days[rng.integers(40)], 'volume': -float(rng.integers(1, 10) * 10000)}) for i in range(5)]
+
+    def cost(pairs):
+        matched_lots = {lot for lot, _ in pairs}
+        matched_hedges = {hedge for _, hedge in pairs}
+        total = sum(t['quantity'] for p, t in lots if p not in matched_lots)
+        total += sum(-h['volume'] for p, h in hedges if p not in matched_hedges)
+        for lot, hedge in pairs:
+            q, v = lots[lot][1]['quantity'], -hedges[hedge][1]['volume']
+            gap = abs((pd.Timestamp(lots[lot][1]['date']) - pd.Timestamp(hedges[hedge][1]['trade_date'])).days)
+            total += abs(q - v) + 500.0 * gap
+        return total
+
+    best = min(
+        cost([(lot, hedge) for lot, hedge in zip(range(4), perm) if hedge is not None])
+        for perm in itertools.permutations(list(range(5)) + [None] * 4, 4)
+    )
+    result = match_hedges_to_lots(lots, hedges)
+    found = cost(list(zip(result['matches']['Lot'], result['matches']['Hedge'])))
+    if result['method'] == 'optimal':
+        assert np.isclose(found, best)
+    else:
+        assert found >= best
+
+
+def test_backtest_hedge_policies_scales_and_reduces_vol():
+    prices = make_price_history(days=200)
+    physical_trades, _ = open_cargo_book()
+    physical_trades[0].update({'sale_price': 70.0, 'sale_date': '2024-05-15'})
+    physical_trades.append({'date': '2024-06-03', 'quantity': 80000, 'buy_price': 69.0, 'sale_price': 0.0,
+                            'sale_date': '', 'product_name': '380 CST AG MOPAG'})
+    policies = policy_grid(['GASOIL Mo2'], [0.0, 0.8, 1.0, 1.2]) + [{'contract': 'GASOIL Mo3', 'hedge_ratio': 1.0}]
+
+    serial = backtest_hedge_policies(prices, physical_trades, policies, max_workers=1, policies_per_chunk=2)
+    parallel = backtest_hedge_policies(prices, physical_trades, policies, max_workers=2, policies_per_chunk=2)
+    pd.testing.assert_frame_equal(serial['summary'], parallel['summary'])
+    assert serial['chunks'] == 3 and serial['lots'] == 2
+
+    summary = serial['summary'].set_index('Policy')
+    go = prices[prices['instrument'] == 'GASOIL Mo2'].set_index('date')['price']
+    expected = -150000 * (go['2024-05-15'] - go['2024-03-01']) - 80000 * (go.iloc[-1] - go['2024-06-03'])
+    assert np.isclose(summary.loc['GASOIL Mo2 @ 100%', 'Hedge P&L ($)'], expected)
+    assert np.isclose(summary.loc['GASOIL Mo2 @ 80%', 'Hedge P&L ($)'], 0.8 * expected)
+    assert summary.loc['GASOIL Mo2 @ 0%', 'Hedge P&L ($)'] == 0
+    assert summary.loc['GASOIL Mo2 @ 100%', 'Daily P&L Std ($)'] < summary.loc['GASOIL Mo2 @ 0%', 'Daily P&L Std ($)']
+    assert serial['missing_contracts'] == ['GASOIL Mo3']
+    assert summary.loc['GASOIL Mo3 @ 100%', 'Hedged Lots'] == 0
+
+    # cumulative daily P&L of a policy ends at its market-based total
+    unhedged_path = serial['cumulative']['GASOIL Mo2 @ 0%']
+    hedged_path = serial['cumulative']['GASOIL Mo2 @ 100%']
+    assert np.isclose(hedged_path.iloc[-1] - unhedged_path.iloc[-1], expected)
+
+
+if __name__ == "__main__":
+    print("Risk Engine Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_book_exposures_open_positions_only,
+        test_monte_carlo_reproducible_across_chunks_and_workers,
+        test_monte_carlo_hedge_offsets_physical,
+        test_stress_grid_linear_in_shocks,
+        test_exposure_ladder_nets_by_instrument_and_tenor,
+        test_hedge_effectiveness_matches_pandas_rolling,
+        test_valuation_cache_lru,
+        test_chunked_series_job_orders_chunks_and_cancels,
+        test_hedge_matching_pairs_volumes_and_dates,
+        test_backtest_hedge_policies_scales_and_reduces_vol,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the contract roll calendar in roll_calendar.py
+"""
+
+import numpy as np
+
+from roll_calendar import (
+    RollCalendar, parse_relative_label, roll_calendar, month_label, contract_expiries, to_days, expiry_rule,
+    EXPIRY_RULES, DEFAULT_EXPIRY_RULE
+)
+
+
+def test_parse_relative_label():
+    assert parse_relative_label('GASOIL Mo1') == ('GASOIL', 1)
+    assert parse_relative_label(' gasoil  mo3 ') == ('GASOIL', 3)
+    assert parse_relative_label('GASOIL 500PPM Mo1') == ('GASOIL 500PPM', 1)
+    # a trailing 'M3' is a grade or tenor, not a relative label
+    assert parse_relative_label('380 CST M3') is None
+    assert parse_relative_label('GAS OIL2500PPM MOPS') is None
+    assert parse_relative_label('180 CST AG MOPAG') is None
+    assert parse_relative_label('GASOIL Mo0') is None
+
+
+def test_grades_take_their_family_expiry_rule():
+    assert expiry_rule('GASOIL 500PPM') is EXPIRY_RULES['GASOIL']
+    assert expiry_rule('gasoil') is EXPIRY_RULES['GASOIL']
+    assert expiry_rule('GASOILS') is DEFAULT_EXPIRY_RULE and expiry_rule('DUBAI') is DEFAULT_EXPIRY_RULE
+    feb = to_days(['2024-02-01']).astype('datetime64[M]').astype(np.int64)
+    assert str(contract_expiries('GASOIL 500PPM', feb)[0]) == '2024-02-12'
+
+
+def test_roll_calendar_resolves_contract_months():
+    # ICE gasoil: two business days before the 14th (14 Jan 2024 is a Sunday)
+    feb, mar = to_days(['2024-02-01', '2024-03-01']).astype('datetime64[M]').astype(np.int64)
+    assert str(contract_expiries('GASOIL', [feb - 1, feb, mar])[0]) == '2024-01-11'
+    assert str(contract_expiries('GASOIL', [feb])[0]) == '2024-02-12'
+
+    calendar = RollCalendar('GASOIL', '2024-01-01', '2024-03-31')
+    months = calendar.contract_months([1, 2, 1], ['2024-01-20', '2024-01-20', '2024-01-11'])
+    assert [month_label(m) for m in months] == ['Feb-24', 'Mar-24', 'Jan-24']
+
+    offsets = calendar.nearby_offsets(months, ['2024-02-01', '2024-02-12', '2024-02-13'])
+    assert offsets.tolist() == [[1, 1, 0], [2, 2, 1], [0, 0, -1]]
+    assert str(calendar.expiry(months)[0]) == '2024-02-12'
+
+    # swaps roll on the last business day of the prior month
+    swaps = RollCalendar('DUBAI', '2024-02-01', '2024-03-31')
+    assert [month_label(m) for m in swaps.front_months(['2024-02-29', '2024-03-01'])] == ['Mar-24', 'Apr-24']
+
+    assert roll_calendar('gasoil', '2024-01-05', '2024-02-01') is roll_calendar('GASOIL', '2024-06-01', '2024-12-31')
+    try:
+        calendar.front_months(['2024-05-01'])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("dates outside the calendar must raise")
+
+
+if __name__ == "__main__":
+    print("Roll Calendar Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_parse_relative_label,
+        test_grades_take_their_family_expiry_rule,
+        test_roll_calendar_resolves_contract_months,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
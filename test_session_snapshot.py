@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the binary session snapshot format in session_snapshot.py
+"""
+
+import numpy as np
+import pandas as pd
+
+from session_snapshot import dump_snapshot, load_snapshot, SnapshotError, MAGIC, _PREFIX
+
+
+def sample_session():
+    physical_trades = [
+        {'date': '2024-03-01', 'quantity': 150000, 'buy_price': 68.5, 'sale_price': 0.0, 'sale_date': '', 'buy_currency': 'USD'},
+        {'date': '2024-03-05', 'quantity': 50000.0, 'buy_price': 69, 'sale_price': 71.25, 'sale_date': '2024-03-20'},
+    ]
+    hedge_trades = [
+        {'contract': 'GASOIL Mo2', 'volume': -150000, 'entry_price': 71.2, 'exit_price': 0.0, 'status': 'Open', 'expiry': None},
+    ]
+    prices = pd.DataFrame({
+        'date': pd.to_datetime(['2024-03-01 00:00', '2024-03-01 16:30', '2024-03-04 00:00']),
+        'instrument': pd.Categorical(['GASOIL Mo1', '180 CST AG MOPAG', 'GASOIL Mo1']),
+        'price': np.array([77.0, 75.4, 76.25], dtype=np.float32),
+        'type': ['Hedge', 'Physical', 'Hedge'],
+    })
+    return physical_trades, hedge_trades, prices
+
+
+def test_snapshot_round_trips_trades_prices_and_metadata():
+    physical_trades, hedge_trades, prices = sample_session()
+    data = dump_snapshot(physical_trades, hedge_trades, prices, metadata={'cargo_name': 'GO-KAKI STAR'})
+    assert data.startswith(MAGIC)
+
+    restored = load_snapshot(data)
+    # dict key order, ints vs floats, missing keys and None all survive
+    assert restored['physical_trades'] == physical_trades
+    assert [list(trade) for trade in restored['physical_trades']] == [list(trade) for trade in physical_trades]
+    assert isinstance(restored['physical_trades'][0]['quantity'], int)
+    assert isinstance(restored['physical_trades'][1]['buy_price'], int)
+    assert restored['hedge_trades'] == hedge_trades
+    assert restored['metadata'] == {'cargo_name': 'GO-KAKI STAR'}
+
+    restored_prices = restored['prices']
+    assert restored_prices['price'].dtype == np.float32
+    assert restored_prices['date'].equals(prices['date'])
+    assert list(restored_prices['instrument']) == list(prices['instrument'].astype(str))
+    assert list(restored_prices['type']) == list(prices['type'])
+    assert restored['fx_rates'] is None
+
+    empty = load_snapshot(dump_snapshot([], []))
+    assert empty['physical_trades'] == [] and empty['prices'] is None
+
+
+def test_snapshot_rejects_corrupt_and_unknown_files():
+    data = dump_snapshot(*sample_session())
+    for bad, message in [
+        (data[:-5], 'checksum'),
+        (data[:100] + bytes([data[100] ^ 0xFF]) + data[101:], 'checksum'),
+        (b'PK\x03\x04' + data[4:], 'Not a session snapshot'),
+        (data[:8] + (99).to_bytes(2, 'little') + data[10:], 'version 99'),
+        (data[:_PREFIX.size], 'too short'),
+    ]:
+        try:
+            load_snapshot(bad)
+        except SnapshotError as err:
+            assert message in str(err), err
+        else:
+            raise AssertionError(f"expected SnapshotError ({message})")
+
+
+if __name__ == "__main__":
+    print("Session Snapshot Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_snapshot_round_trips_trades_prices_and_metadata,
+        test_snapshot_rejects_corrupt_and_unknown_files,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the trade book helpers in trade_book.py
+"""
+
+from trade_book import OpenPositionIndex, lot_is_open, hedge_is_open
+
+
+def sample_book():
+    physical_trades = [
+        {'date': '2024-03-01', 'quantity': 150000, 'buy_price': 68.50, 'sale_price': 0.0},
+        {'date': '2024-03-05', 'quantity': 50000, 'buy_price': 69.00, 'sale_price': 71.00},
+        {'date': '2024-03-08', 'quantity': 25000, 'buy_price': 67.75, 'sale_price': 0.0},
+    ]
+    hedge_trades = [
+        {'contract': 'GASOIL Mo2', 'volume': -150000, 'entry_price': 71.20, 'trade_date': '2024-03-01', 'status': 'Open'},
+        {'contract': 'GASOIL Mo1', 'volume': -50000, 'entry_price': 70.10, 'trade_date': '2024-03-05', 'status': 'Closed'},
+    ]
+    return physical_trades, hedge_trades
+
+
+def test_open_position_index_matches_full_scan():
+    physical_trades, hedge_trades = sample_book()
+    index = OpenPositionIndex(physical_trades, hedge_trades, version='v1')
+
+    new_lot = {'date': '2024-03-10', 'quantity': 40000, 'buy_price': 70.00, 'sale_price': 0.0}
+    physical_trades.append(new_lot)
+    index.add_lot(len(physical_trades) - 1, new_lot)
+    new_hedge = {'contract': 'GASOIL Mo3', 'volume': -40000, 'entry_price': 72.00, 'trade_date': '2024-03-10', 'status': 'Open'}
+    hedge_trades.append(new_hedge)
+    index.add_hedge(len(hedge_trades) - 1, new_hedge)
+
+    physical_trades[0]['sale_price'] = 72.00
+    index.close_lot(0)
+    hedge_trades[0]['status'] = 'Closed'
+    index.close_hedge(0)
+
+    assert [p for p, _ in index.open_lots] == [p for p, t in enumerate(physical_trades) if lot_is_open(t)] == [2, 3]
+    assert [p for p, _ in index.open_hedges] == [p for p, h in enumerate(hedge_trades) if hedge_is_open(h)] == [2]
+    assert index.pending_volume == 65000
+    assert index.open_hedge_volume == 40000
+    assert round(index.hedge_ratio, 4) == round(40000 / 65000 * 100, 4)
+    assert index.lot_options[0][1] == "Trade 2: 2024-03-08 - 25,000 MT at $67.75"
+    assert index.hedge_options[0][1].startswith("ID 3: GASOIL Mo3")
+
+
+if __name__ == "__main__":
+    print("Trade Book Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_open_position_index_matches_full_scan,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
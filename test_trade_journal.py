@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the event-sourced trade journal in trade_journal.py
+"""
+
+from trade_journal import TradeJournal, BitemporalIndex
+
+
+def lot(day, quantity=10000, price=70.0):
+    return {'date': day, 'quantity': quantity, 'buy_price': price, 'sale_price': 0.0, 'sale_date': ''}
+
+
+def hedge(day, volume=-10000, price=72.0):
+    return {'contract': 'GASOIL Mo1', 'volume': volume, 'entry_price': price, 'exit_price': 0.0,
+            'trade_date': day, 'status': 'Open', 'exit_date': ''}
+
+
+def test_journal_replays_from_snapshots_and_as_of_time():
+    journal = TradeJournal(snapshot_interval=4)
+    journal.add_lot(lot('2024-03-01'), recorded_at='2024-03-01 09:00')
+    journal.add_hedge(hedge('2024-03-01'), recorded_at='2024-03-01 09:01')
+    journal.update_lot(0, {'sale_price': 74.0, 'sale_date': '2024-03-10'}, recorded_at='2024-03-10 15:00')
+    journal.update_hedge(0, {'exit_price': 73.0, 'status': 'Closed'}, recorded_at='2024-03-10 15:00')
+    for day in range(2, 12):
+        journal.add_lot(lot(f"2024-03-{day:02d}", price=70.0 + day), recorded_at=f"2024-03-{day + 10:02d}")
+
+    physical, hedges = journal.book()
+    assert len(journal) == 14 and len(physical) == 11
+    assert physical[0]['sale_price'] == 74.0 and hedges[0]['status'] == 'Closed'
+    # the audit trail numbers trades like the Sell form: lots from 0, hedges from 1
+    details = journal.history()['Detail']
+    assert details.iloc[-3] == 'Trade 0: sale_price=74.0, sale_date=2024-03-10'
+    assert details.iloc[-4] == 'ID 1: exit_price=73.0, status=Closed'
+
+    # state after event 5 comes from the snapshot at seq 3 plus two replayed events
+    physical, hedges = journal.book(5)
+    assert [trade['date'] for trade in physical] == ['2024-03-01', '2024-03-02', '2024-03-03']
+    assert journal.book(as_of='2024-03-05') == ([lot('2024-03-01')], [hedge('2024-03-01')])
+    assert journal.book(as_of='2024-02-01') == ([], [])
+
+    # returned books are copies: editing one does not rewrite history
+    physical[0]['buy_price'] = 0.0
+    assert journal.book(5)[0][0]['buy_price'] == 70.0
+
+
+def test_undo_appends_revert_events():
+    journal = TradeJournal(snapshot_interval=3)
+    journal.add_lot(lot('2024-03-01'))
+    journal.add_hedge(hedge('2024-03-01'))
+    journal.update_lot(0, {'sale_price': 74.0, 'sale_currency': 'SGD'})
+    journal.clear(lots=True, hedges=False)
+
+    journal.undo()
+    assert journal.book() == ([dict(lot('2024-03-01'), sale_price=74.0, sale_currency='SGD')], [hedge('2024-03-01')])
+    journal.undo()
+    assert journal.book() == ([lot('2024-03-01')], [hedge('2024-03-01')])
+    journal.undo()
+    journal.undo()
+    assert journal.book() == ([], []) and not journal.can_undo
+    assert journal.undo() is None
+
+    # the audit trail keeps every change and its reversal
+    history = journal.history()
+    assert len(history) == 8
+    assert list(history['Event'][:4]) == ['Undo'] * 4
+    assert history['Detail'].iloc[0] == 'Reverted event 0'
+    # the revert events replay like any other
+    assert journal.book(5) == ([lot('2024-03-01')], [hedge('2024-03-01')])
+
+
+def test_bitemporal_book_as_of_valuation_and_knowledge_dates():
+    journal = TradeJournal(snapshot_interval=4)
+    index = BitemporalIndex(journal)
+    journal.add_lot(lot('2024-02-10', price=70.0), recorded_at='2024-02-10 10:00')
+    journal.add_hedge(hedge('2024-02-12'), recorded_at='2024-02-12 10:00')
+    journal.add_lot(lot('2024-02-16', price=71.0), recorded_at='2024-02-16 10:00')
+    # on 20 Feb the first lot's price is corrected and the hedge volume restated
+    journal.restate([('lot', 0, {'buy_price': 69.5}), ('hedge', 0, {'volume': -8000})], recorded_at='2024-02-20 09:00')
+
+    physical, hedges = index.book('2024-02-15', known_at='2024-02-18')
+    assert [trade['buy_price'] for trade in physical] == [70.0] and hedges[0]['volume'] == -10000
+    physical, hedges = index.book('2024-02-15', known_at='2024-02-20 09:00')
+    assert [trade['buy_price'] for trade in physical] == [69.5] and hedges[0]['volume'] == -8000
+    assert index.book() == journal.book()
+    assert index.book(known_at='2024-02-11') == ([lot('2024-02-10', price=70.0)], [])
+
+    # undoing the correction opens new versions; the corrected ones stay on record
+    journal.undo(recorded_at='2024-02-21')
+    assert index.book('2024-02-15', known_at='2024-02-20 12:00')[0][0]['buy_price'] == 69.5
+    assert index.book('2024-02-15')[0][0]['buy_price'] == 70.0
+    assert index.book() == journal.book()
+    journal.clear(lots=True, hedges=False, recorded_at='2024-02-22')
+    assert index.book(known_at='2024-02-23') == ([], [hedge('2024-02-12')])
+    assert len(index.book('2024-02-20', known_at='2024-02-21 12:00')[0]) == 2
+
+
+def test_restating_a_month_is_one_event():
+    journal = TradeJournal()
+    for day in range(1, 30):
+        journal.add_lot(lot(f"2024-02-{day:02d}", price=70.0), recorded_at=f"2024-02-{day:02d} 18:00")
+    index = BitemporalIndex(journal)
+    journal.restate([('lot', position, {'buy_price': 70.25}) for position in range(29)], recorded_at='2024-03-01')
+
+    assert len(journal) == 30 and len(index.book()[0]) == 29
+    assert {trade['buy_price'] for trade in index.book(known_at='2024-02-29 23:00')[0]} == {70.0}
+    assert {trade['buy_price'] for trade in index.book('2024-02-10', known_at='2024-03-01')[0]} == {70.25}
+    assert len(index.book('2024-02-10', known_at='2024-03-01')[0]) == 10
+    assert journal.history()['Detail'].iloc[0] == '29 trade(s) corrected'
+
+
+if __name__ == "__main__":
+    print("Trade Journal Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_journal_replays_from_snapshots_and_as_of_time,
+        test_undo_appends_revert_events,
+        test_bitemporal_book_as_of_valuation_and_knowledge_dates,
+        test_restating_a_month_is_one_event,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Regression tests for trade sheet validation in trade_schema.py
+"""
+
+import numpy as np
+import pandas as pd
+
+from trade_schema import (
+    PHYSICAL_TRADE_SCHEMA, HEDGE_TRADE_SCHEMA, REJECTION_COLUMNS, apply_defaults, validate_trade_sheet
+)
+
+
+def test_import_rejects_bad_rows_and_reports_each_error():
+    sheet = pd.DataFrame({
+        'date': [pd.Timestamp('2024-03-01'), '2024-03-02', 'next week', 45000, '2024-03-05'],
+        'quantity': [150000, '50,000', 20000, 'lots', np.nan],
+        'buy_price': [68.5, '69.25', 70.0, 70.0, 71.0],
+        'sale_date': [np.nan, '20/03/2024', '', np.nan, np.nan],
+        'buy_currency': ['usd', ' SGD ', 'USD', 'USD', 'SGDX'],
+        'trader': ['AK', np.nan, 'JL', 'JL', 'JL']
+    })
+    records, rejections = validate_trade_sheet(sheet, PHYSICAL_TRADE_SCHEMA, 'Physical_Trades', {'product_name': 'Gasoil 10ppm'})
+
+    # the two clean rows load typed, with defaults filled and extra columns kept
+    assert len(records) == 2
+    assert records[0]['date'] == '2024-03-01' and records[0]['quantity'] == 150000.0
+    assert records[0]['buy_currency'] == 'USD' and records[0]['sale_date'] == '' and records[0]['sale_price'] == 0.0
+    assert records[0]['product_name'] == 'Gasoil 10ppm' and records[0]['trader'] == 'AK'
+    assert records[1]['quantity'] == 50000.0 and records[1]['buy_price'] == 69.25
+    assert records[1]['sale_date'] == '2024-03-20' and records[1]['buy_currency'] == 'SGD' and records[1]['trader'] == ''
+
+    assert list(rejections.columns) == REJECTION_COLUMNS
+    assert list(zip(rejections['Row'], rejections['Column'], rejections['Error'])) == [
+        (4, 'date', 'not a date'),
+        (5, 'date', 'not a date'),
+        (5, 'quantity', 'not a number'),
+        (6, 'buy_currency', 'not a three-letter currency code'),
+        (6, 'quantity', 'required value missing'),
+    ]
+    assert list(rejections['Value'][:3]) == ['next week', '45000', 'lots'] and rejections['Value'].iloc[4] == ''
+
+
+def test_hedge_sheet_without_required_column_and_session_defaults():
+    sheet = pd.DataFrame({'contract': ['GASOIL Mo1', 'GASOIL Mo2'], 'volume': [-1000, -2000],
+                          'exit_price': [np.nan, 74.0], 'status': ['closed', 'Pending']})
+    records, rejections = validate_trade_sheet(sheet, HEDGE_TRADE_SCHEMA, 'Hedge_Trades')
+    assert records == []
+    assert set(rejections['Error']) == {'required column missing', 'not one of Open, Closed'}
+    assert list(rejections['Row']) == [2, 3, 3]
+
+    sheet['entry_price'] = 72.0
+    records, rejections = validate_trade_sheet(sheet, HEDGE_TRADE_SCHEMA, 'Hedge_Trades')
+    assert len(records) == 1 and len(rejections) == 1
+    assert records[0]['status'] == 'Closed' and records[0]['exit_price'] == 0.0 and records[0]['currency'] == 'USD'
+
+    # the session fills the same defaults into trades entered before a field existed
+    trades = [{'contract': 'GASOIL Mo1', 'volume': -1000, 'entry_price': 72.0, 'status': 'Closed'}]
+    apply_defaults(trades, HEDGE_TRADE_SCHEMA)
+    assert trades[0]['status'] == 'Closed' and trades[0]['exit_date'] == '' and trades[0]['currency'] == 'USD'
+    assert 'volume' in trades[0] and len(trades[0]) == 8
+
+
+if __name__ == "__main__":
+    print("Trade Schema Regression Tests")
+    print("=" * 60)
+    for test in [
+        test_import_rejects_bad_rows_and_reports_each_error,
+        test_hedge_sheet_without_required_column_and_session_defaults,
+    ]:
+        test()
+        print(f"PASS {test.__name__}")
@@ -0,0 +1,105 @@
+"""
+Trade book state helpers for the Oil Trading P&L app.
+"""
+
+
+def lot_is_open(trade) -> bool:
+    """A physical lot stays pending until it has a sale price"""
+    return (trade.get('sale_price', 0.0) or 0.0) == 0.0
+
+
+def hedge_is_open(hedge) -> bool:
+    return hedge.get('status', 'Open') == 'Open'
+
+
+def lot_ref(position: int) -> str:
+    """How every screen refers to a physical lot: its book position, counted from 0"""
+    return f"Trade {position}"
+
+
+def hedge_ref(position: int) -> str:
+    """How every screen refers to a hedge: its book position, counted from 1"""
+    return f"ID {position + 1}"
+
+
+def lot_label(position: int, trade) -> str:
+    return f"{lot_ref(position)}: {trade['date']} - {trade['quantity']:,.0f} MT at ${trade['buy_price']:.2f}"
+
+
+def hedge_label(position: int, hedge) -> str:
+    label = (
+        f"{hedge_ref(position)}: {hedge['contract']} | {hedge['volume']:,.0f} MT | "
+        f"Entry: ${hedge['entry_price']:.2f} | Trade: {hedge.get('trade_date', '-')}"
+    )
+    if hedge.get('expiry'):
+        label += f" | Exp: {hedge['expiry']}"
+    return label
+
+
+class OpenPositionIndex:
+    """Open physical lots and open hedges of a book, kept current by the trading actions.
+
+    Positions are list indices into `physical_trades` / `hedge_trades`.
+    The index is built with one scan and afterwards updated per trade by
+    `add_lot`, `close_lot`, `add_hedge` and `close_hedge`, which also keep
+    the volume totals and selectbox labels current. New trades are appended
+    to the book, so insertion order is book order. `version` is the trade
+    book version the index reflects; bulk changes (imports, resets, demo
+    loads) leave it behind and the owner rebuilds.
+    """
+
+    def __init__(self, physical_trades, hedge_trades, version=None):
+        self.version = version
+        self._lots = {}
+        self._hedges = {}
+        self.pending_volume = 0.0
+        self.open_hedge_volume = 0.0
+        for position, trade in enumerate(physical_trades):
+            if lot_is_open(trade):
+                self.add_lot(position, trade)
+        for position, hedge in enumerate(hedge_trades):
+            if hedge_is_open(hedge):
+                self.add_hedge(position, hedge)
+
+    def add_lot(self, position: int, trade):
+        self._lots[position] = (trade, lot_label(position, trade))
+        self.pending_volume += trade.get('quantity', 0) or 0
+
+    def close_lot(self, position: int):
+        trade, _ = self._lots.pop(position)
+        self.pending_volume -= trade.get('quantity', 0) or 0
+
+    def add_hedge(self, position: int, hedge):
+        self._hedges[position] = (hedge, hedge_label(position, hedge))
+        self.open_hedge_volume += abs(hedge.get('volume', 0) or 0)
+
+    def close_hedge(self, position: int):
+        hedge, _ = self._hedges.pop(position)
+        self.open_hedge_volume -= abs(hedge.get('volume', 0) or 0)
+
+    @property
+    def open_lots(self):
+        """[(position, trade)] in book order"""
+        return [(position, self._lots[position][0]) for position in self._lots]
+
+    @property
+    def open_hedges(self):
+        """[(position, hedge)] in book order"""
+        return [(position, self._hedges[position][0]) for position in self._hedges]
+
+    @property
+    def lot_options(self):
+        """[(position, selectbox label)] in book order"""
+        return [(position, self._lots[position][1]) for position in self._lots]
+
+    @property
+    def hedge_options(self):
+        """[(position, selectbox label)] in book order"""
+        return [(position, self._hedges[position][1]) for position in self._hedges]
+
+    @property
+    def hedge_ratio(self) -> float:
+        """Open hedge volume as a percentage of pending physical volume"""
+        if self.pending_volume <= 0:
+            return 0.0
+        return self.open_hedge_volume / self.pending_volume * 100.0
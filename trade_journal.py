@@ -0,0 +1,396 @@
+"""
+Append-only journal of trade book events with periodic snapshots.
+"""
+
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+from trade_book import lot_ref, hedge_ref
+
+
+# Events between snapshots: rebuilding any past state replays at most this many
+SNAPSHOT_INTERVAL = 1000
+
+EVENT_KINDS = {
+    'add_lot': 'Add buy',
+    'add_hedge': 'Add hedge',
+    'update_lot': 'Complete sale',
+    'update_hedge': 'Close hedge',
+    'restate': 'Correction',
+    'remove_lot': 'Remove buy',
+    'remove_hedge': 'Remove hedge',
+    'clear': 'Clear',
+    'load_book': 'Load book',
+    'revert': 'Undo'
+}
+
+
+SIDE_UPDATES = {'lot': 'update_lot', 'hedge': 'update_hedge'}
+
+
+def copy_book(physical_trades, hedge_trades):
+    """Independent copy of a book (trade dicts are flat, so one level is enough)"""
+    return [dict(trade) for trade in physical_trades], [dict(hedge) for hedge in hedge_trades]
+
+
+def apply_event(physical_trades, hedge_trades, kind: str, payload: dict) -> None:
+    """Apply one event to a book's lists in place.
+
+    Trade dicts already in the lists are never modified: an update swaps in
+    a new dict. That lets snapshots share the dicts of the head state.
+    """
+    if kind == 'add_lot':
+        physical_trades.append(dict(payload['trade']))
+    elif kind == 'add_hedge':
+        hedge_trades.append(dict(payload['hedge']))
+    elif kind in ('update_lot', 'update_hedge'):
+        records = physical_trades if kind == 'update_lot' else hedge_trades
+        record = {**records[payload['position']], **payload['changes']}
+        for key in payload.get('drop', ()):
+            record.pop(key, None)
+        records[payload['position']] = record
+    elif kind == 'restate':
+        for correction in payload['corrections']:
+            apply_event(physical_trades, hedge_trades, SIDE_UPDATES[correction['side']], correction)
+    elif kind == 'remove_lot':
+        physical_trades.pop(payload['position'])
+    elif kind == 'remove_hedge':
+        hedge_trades.pop(payload['position'])
+    elif kind == 'clear':
+        if payload.get('lots', True):
+            physical_trades.clear()
+        if payload.get('hedges', True):
+            hedge_trades.clear()
+    elif kind == 'load_book':
+        physical_trades[:], hedge_trades[:] = copy_book(payload['physical_trades'], payload['hedge_trades'])
+    elif kind == 'revert':
+        for inverse_kind, inverse_payload in payload['events']:
+            apply_event(physical_trades, hedge_trades, inverse_kind, inverse_payload)
+    else:
+        raise ValueError(f"Unknown trade event kind: {kind}")
+
+
+class TradeJournal:
+    """Trade book as an append-only sequence of events.
+
+    Event `seq` is its position in the journal; `book(seq)` is the state
+    after applying events 0..seq. Every `snapshot_interval` events the head
+    state's trade lists are snapshotted (sharing the unchanged trade dicts), so rebuilding any earlier state loads the
+    nearest snapshot at or before it and replays only the tail. Nothing is
+    ever rewritten: `undo` appends a 'revert' event carrying the
+    compensating changes, so the audit trail keeps both the change and its
+    reversal. Updates record the values they overwrite, which makes their
+    inverse exact without replaying.
+    """
+
+    def __init__(self, snapshot_interval: int = SNAPSHOT_INTERVAL):
+        self.snapshot_interval = snapshot_interval
+        self._kinds = []
+        self._payloads = []
+        self._recorded_at = []
+        self._snapshot_seqs = []
+        self._snapshots = []
+        self._undoable = []
+        self._physical = []
+        self._hedges = []
+
+    def __len__(self) -> int:
+        return len(self._kinds)
+
+    def record(self, kind: str, payload: dict, recorded_at=None) -> int:
+        """Append an event, apply it to the head state and return its seq"""
+        if kind not in EVENT_KINDS:
+            raise ValueError(f"Unknown trade event kind: {kind}")
+        # naive local wall-clock stamps, comparable with the app's date/time inputs
+        stamp = pd.Timestamp.now().value if recorded_at is None else pd.Timestamp(recorded_at).value
+        if self._recorded_at and stamp < self._recorded_at[-1]:
+            # the journal is ordered by record time; a clock step back must not reorder it
+            stamp = self._recorded_at[-1]
+        apply_event(self._physical, self._hedges, kind, payload)
+        seq = len(self._kinds)
+        self._kinds.append(kind)
+        self._payloads.append(payload)
+        self._recorded_at.append(stamp)
+        if kind == 'revert':
+            self._undoable.pop()
+        else:
+            self._undoable.append(seq)
+        if (seq + 1) % self.snapshot_interval == 0:
+            self._snapshot_seqs.append(seq)
+            self._snapshots.append((tuple(self._physical), tuple(self._hedges)))
+        return seq
+
+    def add_lot(self, trade, recorded_at=None) -> int:
+        return self.record('add_lot', {'trade': dict(trade)}, recorded_at)
+
+    def add_hedge(self, hedge, recorded_at=None) -> int:
+        return self.record('add_hedge', {'hedge': dict(hedge)}, recorded_at)
+
+    @staticmethod
+    def _change(records, position: int, changes) -> dict:
+        current = records[position]
+        return {
+            'position': position,
+            'changes': dict(changes),
+            'before': {key: current[key] for key in changes if key in current},
+            'added': [key for key in changes if key not in current]
+        }
+
+    def _update(self, kind: str, records, position: int, changes, recorded_at) -> int:
+        return self.record(kind, self._change(records, position, changes), recorded_at)
+
+    def update_lot(self, position: int, changes, recorded_at=None) -> int:
+        return self._update('update_lot', self._physical, position, changes, recorded_at)
+
+    def update_hedge(self, position: int, changes, recorded_at=None) -> int:
+        return self._update('update_hedge', self._hedges, position, changes, recorded_at)
+
+    def restate(self, corrections, recorded_at=None) -> int:
+        """Correct any number of trades in one event.
+
+        `corrections` is a list of (side, position, changes) with side
+        'lot' or 'hedge'. The previous values stay in the journal, so the
+        book as known before the correction can still be rebuilt.
+        """
+        physical_trades, hedge_trades = list(self._physical), list(self._hedges)
+        items = []
+        for side, position, changes in corrections:
+            records = physical_trades if side == 'lot' else hedge_trades
+            item = dict(self._change(records, position, changes), side=side)
+            # later corrections of the same trade see the earlier ones
+            apply_event(physical_trades, hedge_trades, SIDE_UPDATES[side], item)
+            items.append(item)
+        return self.record('restate', {'corrections': items}, recorded_at)
+
+    def clear(self, lots: bool = True, hedges: bool = True, recorded_at=None) -> int:
+        return self.record('clear', {'lots': lots, 'hedges': hedges}, recorded_at)
+
+    def load_book(self, physical_trades, hedge_trades, recorded_at=None) -> int:
+        physical_copy, hedge_copy = copy_book(physical_trades, hedge_trades)
+        return self.record('load_book', {'physical_trades': physical_copy, 'hedge_trades': hedge_copy}, recorded_at)
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undoable)
+
+    def undo(self, recorded_at=None):
+        """Revert the latest change not yet undone; returns the revert event's seq, or None"""
+        if not self._undoable:
+            return None
+        target = self._undoable[-1]
+        kind, payload = self._kinds[target], self._payloads[target]
+        if kind == 'add_lot':
+            inverse = [('remove_lot', {'position': len(self._physical) - 1})]
+        elif kind == 'add_hedge':
+            inverse = [('remove_hedge', {'position': len(self._hedges) - 1})]
+        elif kind in ('update_lot', 'update_hedge'):
+            inverse = [(kind, {'position': payload['position'], 'changes': payload['before'], 'drop': payload['added']})]
+        elif kind == 'restate':
+            inverse = [('restate', {'corrections': [
+                {'side': item['side'], 'position': item['position'], 'changes': item['before'], 'drop': item['added']}
+                for item in reversed(payload['corrections'])
+            ]})]
+        else:
+            physical_trades, hedge_trades = self.book(target - 1)
+            inverse = [('load_book', {'physical_trades': physical_trades, 'hedge_trades': hedge_trades})]
+        return self.record('revert', {'seq': target, 'events': inverse}, recorded_at)
+
+    def events(self, start: int = 0):
+        """(seq, kind, payload, recorded_at ns) of every event from `start` on"""
+        for seq in range(start, len(self._kinds)):
+            yield seq, self._kinds[seq], self._payloads[seq], self._recorded_at[seq]
+
+    def seq_as_of(self, as_of) -> int:
+        """Seq of the last event recorded at or before `as_of` (-1 before the first)"""
+        return bisect_right(self._recorded_at, pd.Timestamp(as_of).value) - 1
+
+    def book(self, seq=None, as_of=None):
+        """(physical_trades, hedge_trades) after event `seq`, or as recorded at `as_of`; fresh copies"""
+        if as_of is not None:
+            seq = self.seq_as_of(as_of)
+        if seq is None or seq >= len(self._kinds) - 1:
+            return copy_book(self._physical, self._hedges)
+        if seq < 0:
+            return [], []
+        nearest = bisect_right(self._snapshot_seqs, seq) - 1
+        if nearest >= 0:
+            physical_trades, hedge_trades = list(self._snapshots[nearest][0]), list(self._snapshots[nearest][1])
+            start = self._snapshot_seqs[nearest] + 1
+        else:
+            physical_trades, hedge_trades = [], []
+            start = 0
+        for position in range(start, seq + 1):
+            apply_event(physical_trades, hedge_trades, self._kinds[position], self._payloads[position])
+        return copy_book(physical_trades, hedge_trades)
+
+    def history(self, limit=None) -> pd.DataFrame:
+        """Audit view of the journal, latest event first"""
+        first = 0 if limit is None else max(len(self._kinds) - limit, 0)
+        rows = []
+        for seq in range(len(self._kinds) - 1, first - 1, -1):
+            kind, payload = self._kinds[seq], self._payloads[seq]
+            rows.append({
+                'Seq': seq,
+                'Recorded': pd.Timestamp(self._recorded_at[seq], unit='ns'),
+                'Event': EVENT_KINDS[kind],
+                'Detail': describe_event(kind, payload)
+            })
+        return pd.DataFrame(rows, columns=['Seq', 'Recorded', 'Event', 'Detail'])
+
+
+def describe_event(kind: str, payload: dict) -> str:
+    if kind == 'add_lot':
+        trade = payload['trade']
+        return f"{trade.get('date', '')} {trade.get('quantity', 0):,.0f} MT at {trade.get('buy_price', 0.0):.2f}"
+    if kind == 'add_hedge':
+        hedge = payload['hedge']
+        return f"{hedge.get('contract', '')} {hedge.get('volume', 0):,.0f} MT at {hedge.get('entry_price', 0.0):.2f}"
+    if kind in ('update_lot', 'update_hedge'):
+        label = (lot_ref if kind == 'update_lot' else hedge_ref)(payload['position'])
+        changes = ', '.join(f"{key}={value}" for key, value in payload['changes'].items())
+        return f"{label}: {changes}"
+    if kind == 'restate':
+        return f"{len(payload['corrections'])} trade(s) corrected"
+    if kind == 'clear':
+        parts = [name for name, flag in (('physical', payload.get('lots', True)), ('hedges', payload.get('hedges', True))) if flag]
+        return ' and '.join(parts)
+    if kind == 'load_book':
+        return f"{len(payload['physical_trades'])} trades, {len(payload['hedge_trades'])} hedges"
+    if kind == 'revert':
+        return f"Reverted event {payload['seq']}"
+    return ''
+
+
+# Record-time end of a version that is still current
+OPEN_END = np.iinfo(np.int64).max
+SIDES = ('lot', 'hedge')
+VALID_FROM_FIELDS = {'lot': 'date', 'hedge': 'trade_date'}
+
+
+class BitemporalIndex:
+    """Every version of every trade with its valid time and record time.
+
+    Built from a TradeJournal and kept current with `sync`. Each version is
+    one row: the trade as recorded, its valid-time start (trade date) and
+    the record-time interval [recorded_from, recorded_to) during which it
+    was the latest known version. A correction, sale or undo closes the
+    current version and opens a new one with the same `trade_id`, so
+    history is never overwritten.
+
+    Rows are appended in record-time order, so `recorded_from` is sorted:
+    `book` finds the versions recorded by the knowledge time with one
+    `np.searchsorted` and filters that prefix with vectorized interval
+    tests. Restating a month of trades is one journal event and one append
+    per corrected trade.
+    """
+
+    def __init__(self, journal: TradeJournal):
+        self.journal = journal
+        self._synced = 0
+        self._size = 0
+        self._recorded_from = np.empty(64, dtype=np.int64)
+        self._recorded_to = np.empty(64, dtype=np.int64)
+        self._valid_from = np.empty(64, dtype=np.int64)
+        self._sides = np.empty(64, dtype=np.int8)
+        self._trade_ids = np.empty(64, dtype=np.int64)
+        self._records = []
+        self._next_trade_id = 0
+        self._current = {'lot': [], 'hedge': []}
+        self.sync()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def sync(self) -> None:
+        """Index the journal events recorded since the last sync"""
+        for seq, kind, payload, stamp in self.journal.events(self._synced):
+            self._apply(kind, payload, stamp)
+            self._synced = seq + 1
+
+    def _grow(self) -> None:
+        for name in ('_recorded_from', '_recorded_to', '_valid_from', '_sides', '_trade_ids'):
+            array = getattr(self, name)
+            grown = np.empty(len(array) * 2, dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            setattr(self, name, grown)
+
+    def _open(self, side: str, record, stamp: int, trade_id=None) -> int:
+        if self._size == len(self._recorded_from):
+            self._grow()
+        if trade_id is None:
+            trade_id = self._next_trade_id
+            self._next_trade_id += 1
+        row = self._size
+        valid_from = pd.to_datetime(record.get(VALID_FROM_FIELDS[side]) or None, errors='coerce')
+        self._recorded_from[row] = stamp
+        self._recorded_to[row] = OPEN_END
+        self._valid_from[row] = np.iinfo(np.int64).min if pd.isna(valid_from) else valid_from.normalize().value
+        self._sides[row] = SIDES.index(side)
+        self._trade_ids[row] = trade_id
+        self._records.append(record)
+        self._size += 1
+        return row
+
+    def _close(self, row: int, stamp: int) -> None:
+        self._recorded_to[row] = stamp
+
+    def _revise(self, side: str, payload, stamp: int) -> None:
+        current = self._current[side]
+        row = current[payload['position']]
+        record = {**self._records[row], **payload['changes']}
+        for key in payload.get('drop', ()):
+            record.pop(key, None)
+        self._close(row, stamp)
+        current[payload['position']] = self._open(side, record, stamp, self._trade_ids[row])
+
+    def _apply(self, kind: str, payload: dict, stamp: int) -> None:
+        if kind in ('add_lot', 'add_hedge'):
+            side = 'lot' if kind == 'add_lot' else 'hedge'
+            self._current[side].append(self._open(side, dict(payload['trade' if side == 'lot' else 'hedge']), stamp))
+        elif kind in ('update_lot', 'update_hedge'):
+            self._revise('lot' if kind == 'update_lot' else 'hedge', payload, stamp)
+        elif kind == 'restate':
+            for correction in payload['corrections']:
+                self._revise(correction['side'], correction, stamp)
+        elif kind in ('remove_lot', 'remove_hedge'):
+            side = 'lot' if kind == 'remove_lot' else 'hedge'
+            self._close(self._current[side].pop(payload['position']), stamp)
+        elif kind in ('clear', 'load_book'):
+            for side, flag in (('lot', payload.get('lots', True)), ('hedge', payload.get('hedges', True))):
+                if kind == 'clear' and not flag:
+                    continue
+                for row in self._current[side]:
+                    self._close(row, stamp)
+                self._current[side] = []
+            if kind == 'load_book':
+                self._current['lot'] = [self._open('lot', dict(trade), stamp) for trade in payload['physical_trades']]
+                self._current['hedge'] = [self._open('hedge', dict(hedge), stamp) for hedge in payload['hedge_trades']]
+        elif kind == 'revert':
+            for inverse_kind, inverse_payload in payload['events']:
+                self._apply(inverse_kind, inverse_payload, stamp)
+
+    def rows(self, valuation_date=None, known_at=None) -> np.ndarray:
+        """Version rows in force on `valuation_date` as known at `known_at`, in book order"""
+        self.sync()
+        known = OPEN_END - 1 if known_at is None else pd.Timestamp(known_at).value
+        recorded = np.searchsorted(self._recorded_from[:self._size], known, side='right')
+        live = self._recorded_to[:recorded] > known
+        if valuation_date is not None:
+            live &= self._valid_from[:recorded] <= pd.Timestamp(valuation_date).value
+        rows = np.flatnonzero(live)
+        # trade ids follow book order: adds append and only the newest trade is ever removed
+        return rows[np.lexsort((self._trade_ids[rows], self._sides[rows]))]
+
+    def book(self, valuation_date=None, known_at=None):
+        """(physical_trades, hedge_trades) entered by `valuation_date` as recorded at `known_at`.
+
+        Without `known_at` this is the current book; without
+        `valuation_date` every trade known at the time. Copies, so callers
+        may edit them.
+        """
+        physical_trades, hedge_trades = [], []
+        for row in self.rows(valuation_date, known_at):
+            (physical_trades if self._sides[row] == 0 else hedge_trades).append(dict(self._records[row]))
+        return physical_trades, hedge_trades
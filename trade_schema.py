@@ -0,0 +1,142 @@
+"""
+Trade book schema: field types and defaults, and validation of imported sheets.
+"""
+
+import numpy as np
+import pandas as pd
+
+from market_data import BASE_CURRENCY
+
+
+# Field -> type, default. Fields without a default are required on import.
+# Types: 'number', 'date' (stored as 'YYYY-MM-DD', '' when unset),
+# 'currency' (three-letter code), 'text', or a tuple of allowed values.
+PHYSICAL_TRADE_SCHEMA = {
+    'date': {'type': 'date'},
+    'quantity': {'type': 'number'},
+    'buy_price': {'type': 'number'},
+    'buy_premium_discount': {'type': 'number', 'default': 0.0},
+    'sale_price': {'type': 'number', 'default': 0.0},
+    'sale_premium_discount': {'type': 'number', 'default': 0.0},
+    'sale_date': {'type': 'date', 'default': ''},
+    'buy_pricing_start': {'type': 'date', 'default': ''},
+    'buy_pricing_end': {'type': 'date', 'default': ''},
+    'buy_currency': {'type': 'currency', 'default': BASE_CURRENCY},
+    'sale_currency': {'type': 'currency', 'default': BASE_CURRENCY},
+    # session-dependent: the selected product, passed in as an override
+    'product_name': {'type': 'text', 'default': ''},
+    'product_category': {'type': 'text', 'default': ''}
+}
+
+HEDGE_TRADE_SCHEMA = {
+    'contract': {'type': 'text'},
+    'volume': {'type': 'number'},
+    'entry_price': {'type': 'number'},
+    'exit_price': {'type': 'number', 'default': 0.0},
+    'trade_date': {'type': 'date', 'default': ''},
+    'status': {'type': ('Open', 'Closed'), 'default': 'Open'},
+    'exit_date': {'type': 'date', 'default': ''},
+    'currency': {'type': 'currency', 'default': BASE_CURRENCY}
+}
+
+REJECTION_COLUMNS = ['Sheet', 'Row', 'Column', 'Value', 'Error']
+
+
+def field_defaults(schema: dict, overrides=None) -> dict:
+    """{field: default} of the optional fields, with session-dependent `overrides`"""
+    defaults = {field: spec['default'] for field, spec in schema.items() if 'default' in spec}
+    defaults.update(overrides or {})
+    return defaults
+
+
+def apply_defaults(records, schema: dict, overrides=None) -> None:
+    """Fill missing optional fields of trade dicts in place"""
+    defaults = field_defaults(schema, overrides)
+    for record in records:
+        for field, default in defaults.items():
+            record.setdefault(field, default)
+
+
+def _blank(series: pd.Series) -> np.ndarray:
+    return (series.isna() | series.astype(str).str.strip().eq('')).to_numpy()
+
+
+def _coerce(series: pd.Series, kind):
+    """(coerced column, invalid mask, error message) for the non-blank values of a column"""
+    if kind == 'number':
+        # thousands separators as typed in spreadsheets: '150,000'
+        values = pd.to_numeric(series.astype(str).str.replace(',', '', regex=False).str.strip(), errors='coerce')
+        return values.astype(float), values.isna().to_numpy(), "not a number"
+    if kind == 'date':
+        # numbers are not dates here, even though to_datetime would read them as epoch offsets
+        numeric = pd.to_numeric(series, errors='coerce').notna().to_numpy()
+        stamps = pd.to_datetime(series.where(~numeric), errors='coerce', format='mixed')
+        return stamps.dt.strftime('%Y-%m-%d'), stamps.isna().to_numpy(), "not a date"
+    text = series.astype(str).str.strip()
+    if kind == 'currency':
+        text = text.str.upper()
+        return text, ~text.str.fullmatch(r'[A-Z]{3}').to_numpy(dtype=bool), "not a three-letter currency code"
+    if isinstance(kind, tuple):
+        # accept any capitalisation of an allowed value
+        lookup = {value.lower(): value for value in kind}
+        canonical = text.str.lower().map(lookup)
+        return canonical, canonical.isna().to_numpy(), f"not one of {', '.join(kind)}"
+    return text, np.zeros(len(text), dtype=bool), ""
+
+
+def validate_trade_sheet(df: pd.DataFrame, schema: dict, sheet_name: str, overrides=None):
+    """Coerce an imported sheet to the trade schema.
+
+    Every schema column is cast in one vectorized pass; blanks take the
+    field default (as the session's `apply_defaults` would) and are errors
+    for required fields. Columns outside the schema pass through, with
+    blanks as ''. Returns (clean records, rejections): rows with any error
+    are left out of the records and every error is one rejection row, with
+    the spreadsheet row number (header is row 1).
+    """
+    if df is None:
+        df = pd.DataFrame()
+    df = df.rename(columns=lambda column: str(column).strip()).reset_index(drop=True)
+    defaults = field_defaults(schema, overrides)
+    rows = np.arange(len(df)) + 2
+    clean = pd.DataFrame(index=df.index)
+    rejected = np.zeros(len(df), dtype=bool)
+    errors = []
+
+    def reject(mask, column, values, message):
+        nonlocal rejected
+        if mask.any():
+            rejected |= mask
+            errors.append(pd.DataFrame({
+                'Sheet': sheet_name,
+                'Row': rows[mask],
+                'Column': column,
+                'Value': values[mask].astype(str) if values is not None else '',
+                'Error': message
+            }))
+
+    for field, spec in schema.items():
+        if field not in df.columns:
+            if field in defaults:
+                clean[field] = defaults[field]
+            else:
+                reject(np.ones(len(df), dtype=bool), field, None, "required column missing")
+            continue
+        raw = df[field].astype(object)
+        blank = _blank(raw)
+        shown = raw.where(~blank, '').to_numpy()
+        values, invalid, message = _coerce(raw, spec['type'])
+        reject(invalid & ~blank, field, shown, message)
+        if field in defaults:
+            values = values.where(~blank, defaults[field])
+        else:
+            reject(blank, field, shown, "required value missing")
+        clean[field] = values.astype(object).where(~(invalid & ~blank), None)
+
+    for column in df.columns:
+        if column not in schema:
+            clean[column] = df[column].astype(object).where(~_blank(df[column]), '')
+
+    rejections = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=REJECTION_COLUMNS)
+    rejections = rejections.sort_values(['Row', 'Column'], kind='stable', ignore_index=True)
+    return clean[~rejected].to_dict(orient='records'), rejections